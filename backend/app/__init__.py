@@ -1,114 +1,79 @@
 '''
-  init file, set up the app/tests
+  init file, the app factory, importing the package doesn't create an app,
+  touch the database or load the blueprints
+    flask run (FLASK_APP=app finds create_app), gunicorn 'app:create_app()'
 '''
 import sys
-from dotenv import load_dotenv
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_cors import CORS
+from .database import SQLAlchemy
+
+# extensions, bound to each app by create_app
+db = SQLAlchemy()
+cors = CORS()
+
+
+def init_migrations(app):
+  '''
+    registers Flask-Migrate for the flask db commands, it pulls in alembic, a third
+    of the startup time, so create_app only calls this when it is already loaded,
+    which the flask command line does through its db command
+  '''
+  from flask_migrate import Migrate
+  return Migrate(app, db, render_as_batch=True)
 
-# load env
-load_dotenv()
 
 # create app function
 def create_app(name="app", config=None, testing=False):
   '''
     creates app, accepts name and config
     config allows for passing testing configs
+    every call makes a new app with its own config, database engines and menu cache
   '''
+  from dotenv import load_dotenv
+  from .encoding import init_app as init_encoding
+  from .compression import init_app as init_compression
+  from .queries import init_app as init_queries
+  from .metrics import init_app as init_metrics
+  from .profiling import init_app as init_profiling
+
+  # load env
+  load_dotenv()
   app = Flask(name)
   if config:
-    print("testing")
     app.config.from_mapping(config)
   elif testing:
-    print("testing")
     app.config.from_object('config_test')
   else:
-    print("not testing")
     # get from config.py
     app.config.from_object('config')
-    
-  # Define the database object
-  db = SQLAlchemy(app)
-  # setup migration
-  migrate = Migrate(app, db)
-  # setup cors for api routes and specific origin
-  cors = CORS(app, resources={r"/api/*": {"CORS_ORIGINS": "http://127.0.0.1:3000/"}})
-  # return
-  return [app, db]
 
-# check testApp arg
-if '--testApp' in sys.argv:
-  # get test db uri
-  # database_uri = os.environ.get('TEST_DB_URI')
-  # sqllite_database_uri = os.environ.get('TEST_SQLITEDB_URI')
-  # {
-  #   'SQLALCHEMY_DATABASE_URI': sqllite_database_uri,
-  #   'SQLALCHEMY_ECHO': True,
-  #   'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-  # }
-  # Define the WSGI application object
-  app, db = create_app(__name__, testing=True)
-  
-else:
-  # Define the WSGI application object
-  app, db = create_app(__name__, None)
-
-# Import a module / component using its blueprint handler variable (mod_auth)
-from .user.controllers import user_bp as user_blueprint
-from .drink.controllers import drink_bp as drink_blueprint
-
-# Register blueprint(s)
-app.register_blueprint(user_blueprint, url_prefix='/api')
-app.register_blueprint(drink_blueprint, url_prefix='/api')
-
-# Build the database, This will create the database file using SQLAlchemy
-# check testApp arg
-if '--testApp' not in sys.argv: db.create_all()
-
-# import cli functons
-from .utils import *
-
-# app = None
-# db = None
-
-# # create_app func for cli args
-# def create_cliapp(param: str):
-#   global app 
-#   global db
-  
-#   app = Flask(__name__)
-#   if param == 'test':
-#     print("testing")
-#     app.config.from_object('config_test')
-#   elif param == 'dev':
-#     print("not testing")
-#     # get from config.py
-#     app.config.from_object('config')
-    
-#   # Define the database object
-#   db = SQLAlchemy(app)
-#   # setup migration
-#   migrate = Migrate(app, db)
-#   # setup cors for api routes and specific origin
-#   cors = CORS(app, resources={r"/api/*": {"CORS_ORIGINS": "http://127.0.0.1:3000/"}})
-  
-#   # Import a module / component using its blueprint handler variable (mod_auth)
-#   from .auth.controllers import auth_bp as authentication_blueprint
-#   from .drink.controllers import drink_bp as drink_blueprint
+  # bind the database object
+  db.init_app(app)
+  # setup migration, only needed by the flask db commands
+  if 'flask_migrate' in sys.modules:
+    init_migrations(app)
+  # setup cors for api routes and specific origin
+  cors.init_app(app, resources={r"/api/*": {"CORS_ORIGINS": "http://127.0.0.1:3000/"}})
+  # sampled cProfile runs, first so the profile covers the other hooks
+  init_profiling(app)
+  # json responses with the JSON_BACKEND encoder
+  init_encoding(app)
+  # gzip/deflate/brotli for clients that accept it
+  init_compression(app)
+  # query counts and Server-Timing per request
+  init_queries(app)
+  # request latency and status counts, served at /metrics
+  init_metrics(app)
 
-#   # Register blueprint(s)
-#   app.register_blueprint(authentication_blueprint, url_prefix='/api/auth')
-#   app.register_blueprint(drink_blueprint, url_prefix='/api')
-  
-#   if param == 'test':
-#     # import test cases
-#     from .auth.tests import AuthTestCase
-#     from .drink.tests import DrinkTestCase
-    
-#     # start test
-#     unittest.main(verbosity=2)
-  
-#   return app
+  # blueprints, imported here so importing the package stays cheap
+  from .user.controllers import user_bp
+  from .drink.controllers import drink_bp
+  app.register_blueprint(user_bp, url_prefix='/api')
+  app.register_blueprint(drink_bp, url_prefix='/api')
 
+  # cli commands, tables are created with flask app dbtables create or flask db upgrade
+  from .utils import app_cli
+  app.cli.add_command(app_cli)
+  # return
+  return app
@@ -0,0 +1,99 @@
+'''
+  a process wide asyncio event loop on a background thread and a pooled httpx
+  client for it, so outbound calls (jwks, management api) wait on the loop instead
+  of holding a thread each
+'''
+import asyncio
+import os
+import threading
+import weakref
+
+
+class EventLoopThread:
+  '''
+    EventLoopThread
+    runs an event loop on a daemon thread, started on first use,
+    sync code hands it coroutines with submit or run
+    Args:
+      name (str): thread name
+  '''
+  def __init__(self, name='aio-loop'):
+    self.name = name
+    self._loop = None
+    self._lock = threading.Lock()
+    if hasattr(os, 'register_at_fork'):
+      # the thread doesn't exist in a forked child, it starts its own loop on first use
+      ref = weakref.ref(self)
+      os.register_at_fork(after_in_child=lambda: ref() and ref()._reset())
+
+  def _reset(self):
+    self._loop = None
+    self._lock = threading.Lock()
+
+  @property
+  def loop(self):
+    if self._loop is None:
+      with self._lock:
+        if self._loop is None:
+          loop = asyncio.new_event_loop()
+          threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+          self._loop = loop
+    return self._loop
+
+  def submit(self, coroutine):
+    '''
+      schedules a coroutine on the loop, returns a concurrent.futures.Future
+    '''
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+  def run(self, coroutine, timeout=None):
+    '''
+      runs a coroutine on the loop and waits for its result, from any thread but the loop's
+    '''
+    return self.submit(coroutine).result(timeout)
+
+
+class AsyncClient:
+  '''
+    AsyncClient
+    a pooled httpx.AsyncClient for each event loop, its connections belong to the
+    loop that opened them (e.g. not to the parent of a fork), httpx is imported on
+    first use so importing the app stays cheap
+    Args:
+      pool_size (int): max open connections per host, further requests wait for a free one
+      timeout (float): seconds to connect, and to wait for each read or write
+  '''
+  def __init__(self, pool_size=10, timeout=5.0):
+    self.pool_size = pool_size
+    self.timeout = timeout
+    self._loop = None
+    self._client = None
+
+  @property
+  def client(self):
+    loop = asyncio.get_running_loop()
+    if loop is not self._loop:
+      import httpx
+      self._client = httpx.AsyncClient(timeout=self.timeout,
+        limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+      self._loop = loop
+    return self._client
+
+  async def request(self, method, url, **kwargs):
+    '''
+      sends a request, returns the httpx.Response whatever its status,
+      takes the keyword arguments of httpx.AsyncClient.request
+    '''
+    return await self.client.request(method, url, **kwargs)
+
+  async def close(self):
+    '''
+      closes the pooled connections of the running loop's client
+    '''
+    if self._client is not None and self._loop is asyncio.get_running_loop():
+      await self._client.aclose()
+      self._loop = self._client = None
+
+
+# shared by the jwks store and the async management client
+event_loop = EventLoopThread()
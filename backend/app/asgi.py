@@ -0,0 +1,242 @@
+'''
+  the async serving mode, an ASGI app around the flask app: the drink listings and the
+  user routes that call the management api run as coroutines on the server's event loop
+  (drink.async_controllers, user.async_controllers), every other route runs the flask app
+  on a thread of a pool, with the same hooks, error handlers and responses as under WSGI
+    uvicorn --factory app.asgi:create_asgi_app
+'''
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import environ as env
+from werkzeug.exceptions import HTTPException
+
+# threads running the sync routes, an event stream holds one while its client is connected
+ASGI_THREADS = int(env.get('ASGI_THREADS', 64))
+
+
+def build_environ(scope, body):
+  '''
+    wsgi environ of an http scope and its whole request body
+  '''
+  server = scope.get('server') or ('localhost', 80)
+  client = scope.get('client') or ('', 0)
+  environ = {
+    'REQUEST_METHOD': scope['method'],
+    'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+    'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+    'QUERY_STRING': scope['query_string'].decode('ascii'),
+    'SERVER_NAME': server[0],
+    'SERVER_PORT': str(server[1]),
+    'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+    'REMOTE_ADDR': client[0],
+    'REMOTE_PORT': str(client[1]),
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': scope.get('scheme', 'http'),
+    'wsgi.input': io.BytesIO(body),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+  }
+  for name, value in scope['headers']:
+    name = name.decode('latin1').upper().replace('-', '_')
+    if name == 'CONTENT_LENGTH' or name == 'CONTENT_TYPE':
+      key = name
+    else:
+      key = 'HTTP_' + name
+    value = value.decode('latin1')
+    # repeated headers are joined like a wsgi server does
+    environ[key] = environ[key] + ',' + value if key in environ else value
+  return environ
+
+
+def status_code(status):
+  # '200 OK' -> 200
+  return int(status.split(' ', 1)[0])
+
+
+def response_start(status, headers):
+  return {
+    'type': 'http.response.start',
+    'status': status,
+    'headers': [(name.encode('latin1'), value.encode('latin1')) for name, value in headers],
+  }
+
+
+async def read_body(receive):
+  chunks = []
+  while True:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      return None
+    chunks.append(message.get('body', b''))
+    if not message.get('more_body'):
+      return b''.join(chunks)
+
+
+class AsgiApp:
+  '''
+    AsgiApp
+    serves a flask app over ASGI, requests for the endpoints of the async handlers run
+    them on the event loop, the rest run the flask app on a thread, the user handlers
+    aren't used with MANAGEMENT_ASYNC, read when this is made
+    Args:
+      app (Flask): app from create_app
+      threads (int): threads running the sync routes
+  '''
+  def __init__(self, app, threads=None):
+    from .drink.async_controllers import async_views as drink_views
+    from .user.async_controllers import async_views as user_views
+    self.app = app
+    self.views = dict(drink_views)
+    if not app.config.get('MANAGEMENT_ASYNC'):
+      self.views.update(user_views)
+    self.executor = ThreadPoolExecutor(threads or ASGI_THREADS, thread_name_prefix='asgi-sync')
+    self.stats = {'async': 0, 'sync': 0}
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      return await self.lifespan(receive, send)
+    if scope['type'] != 'http':
+      # no websockets
+      return
+    body = await read_body(receive)
+    if body is None:
+      return
+    environ = build_environ(scope, body)
+    try:
+      endpoint = self.app.url_map.bind_to_environ(environ).match()[0]
+    except HTTPException:
+      # 404s, 405s and redirects are answered by the flask app
+      endpoint = None
+    view = self.views.get(endpoint)
+    if view is not None:
+      self.stats['async'] += 1
+      return await self.call_async(view, environ, send)
+    self.stats['sync'] += 1
+    return await self.call_sync(environ, receive, send)
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        await self.close()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+  async def close(self):
+    '''
+      closes the pooled database and http connections, they belong to the running loop
+    '''
+    from .auth import async_management, jwks_store
+    from .database import dispose_async_engines
+    await dispose_async_engines(self.app)
+    await jwks_store.http.close()
+    await async_management.http.close()
+    self.executor.shutdown(wait=False)
+
+  async def dispatch(self, view):
+    '''
+      full_dispatch_request of flask for a coroutine view, in its request context
+    '''
+    from flask import request, request_started
+    app = self.app
+    app.try_trigger_before_first_request_functions()
+    try:
+      request_started.send(app)
+      rv = app.preprocess_request()
+      if rv is None:
+        rv = await view(**request.view_args)
+    except Exception as e:
+      rv = app.handle_user_exception(e)
+    return app.finalize_request(rv)
+
+  async def call_async(self, view, environ, send):
+    '''
+      wsgi_app of flask for a coroutine view, flask's request context is kept in
+      context variables, so each request task has its own
+    '''
+    app = self.app
+    ctx = app.request_context(environ)
+    error = None
+    try:
+      try:
+        ctx.push()
+        response = await self.dispatch(view)
+      except Exception as e:
+        error = e
+        response = app.handle_exception(e)
+      except BaseException:
+        # e.g. the task was cancelled
+        error = sys.exc_info()[1]
+        raise
+      # no body for HEAD and 304, headers fixed up like for a wsgi server
+      app_iter, status, headers = response.get_wsgi_response(environ)
+      await send(response_start(status_code(status), headers))
+      await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+    finally:
+      if error is not None and app.should_ignore_error(error):
+        error = None
+      ctx.auto_pop(error)
+
+  async def call_sync(self, environ, receive, send):
+    loop = asyncio.get_running_loop()
+    disconnected = threading.Event()
+
+    async def watch():
+      while (await receive())['type'] != 'http.disconnect':
+        pass
+      disconnected.set()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+      await loop.run_in_executor(self.executor, self.run_wsgi, environ,
+        lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result(), disconnected)
+    finally:
+      watcher.cancel()
+
+  def run_wsgi(self, environ, send, disconnected):
+    '''
+      runs the flask app and sends its response from a pool thread, the whole response
+      is iterated on this thread, streamed bodies keep their request context on it
+    '''
+    start = {}
+
+    def start_response(status, headers, exc_info=None):
+      start['message'] = response_start(status_code(status), headers)
+
+    iterable = self.app(environ, start_response)
+    try:
+      for chunk in iterable:
+        if disconnected.is_set():
+          # e.g. an event stream whose client left
+          return
+        if chunk:
+          # the headers go with the first chunk, start_response may be called that late
+          if 'message' in start:
+            send(start.pop('message'))
+          send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+      if 'message' in start:
+        send(start.pop('message'))
+      send({'type': 'http.response.body', 'body': b''})
+    finally:
+      if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+def create_asgi_app(name='app', config=None, testing=False, app=None):
+  '''
+    the ASGI app of the async serving mode, for uvicorn --factory
+    Args:
+      name, config, testing: create_app's
+      app (Flask): serve this app instead of creating one
+  '''
+  if app is None:
+    from . import create_app
+    app = create_app(name, config=config, testing=testing)
+  return AsgiApp(app)
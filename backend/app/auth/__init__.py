@@ -1,15 +1,11 @@
-import json
 from flask import request
 from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
-import urllib
 from os import environ as env
 from dotenv import load_dotenv
-from authlib.integrations.flask_client import OAuth
-from app import app
-from auth0.v3.authentication import GetToken
-from auth0.v3.management import Auth0
+from .async_management import AsyncManagementClient
+from .jwks import JWKSKeyStore
+from .management import ManagementClientProvider
+from .token_cache import TokenCache
 
 # loadenv .env
 load_dotenv()
@@ -20,18 +16,37 @@ API_AUDIENCE = env.get("API_AUDIENCE")
 CLIENT_ID=env.get("AUTH0_CLIENT_ID")
 CLIENT_SECRET=env.get("AUTH0_CLIENT_SECRET")
 ALGORITHMS = env.get("ALGORITHMS", ['RS256'])
+# jwks cache, seconds
+JWKS_URL = env.get("JWKS_URL")
+JWKS_CACHE_TTL = int(env.get("JWKS_CACHE_TTL", 600))
+JWKS_MIN_REFRESH_INTERVAL = int(env.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+# refresh expired keys on the event loop instead of in the request that finds them expired
+JWKS_BACKGROUND_REFRESH = env.get("JWKS_BACKGROUND_REFRESH", "").lower() in ("1", "true", "yes")
+# verified token cache size, 0 disables
+TOKEN_CACHE_SIZE = int(env.get("TOKEN_CACHE_SIZE", 1024))
+# seconds before expiry the management api token is refreshed
+MGMT_TOKEN_LEEWAY = int(env.get("MGMT_TOKEN_LEEWAY", 60))
+# keep alive connections to the management api
+MGMT_POOL_SIZE = int(env.get("MGMT_POOL_SIZE", 10))
 
 if not AUTH0_DOMAIN or not API_AUDIENCE or not CLIENT_ID or not CLIENT_SECRET:
   raise ValueError('Missing AUTH0_DOMAIN, API_AUDIENCE, CLIENT_ID or CLIENT_SECRET environment variables.')
 
-# create a new instance of the Auth0 GetToken class
-get_token = GetToken(AUTH0_DOMAIN)
-token = get_token.client_credentials(CLIENT_ID,
-  CLIENT_SECRET, 'https://{}/api/v2/'.format(AUTH0_DOMAIN))
-# get management api token
-mgmt_api_token = token['access_token']
-# create a new instance of the Auth0 Management API client
-auth_management = Auth0(AUTH0_DOMAIN, mgmt_api_token)
+# management api client, the token is fetched on first use and refreshed before it expires
+auth_management = ManagementClientProvider(AUTH0_DOMAIN, CLIENT_ID, CLIENT_SECRET,
+  leeway=MGMT_TOKEN_LEEWAY, pool_size=MGMT_POOL_SIZE)
+# the same api as coroutines on the shared event loop, used by the bulk routes with MANAGEMENT_CLIENT=asyncio
+async_management = AsyncManagementClient(auth_management, pool_size=MGMT_POOL_SIZE)
+
+# public keys of the auth server, loaded on first use
+jwks_store = JWKSKeyStore(
+  JWKS_URL or "https://"+AUTH0_DOMAIN+"/.well-known/jwks.json",
+  ttl=JWKS_CACHE_TTL,
+  min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+  background=JWKS_BACKGROUND_REFRESH
+)
+# decoded payloads of tokens already verified
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
 
 class AuthError(Exception):
   '''
@@ -62,32 +77,27 @@ def get_token_auth_header():
   return split_auth_header[1]
 
 
-def verify_decode_jwt(token):
-  """
-    checks Access Token for validity
-    Args:
-      token (str): The token string to be verified
-  """
-  # get public key
+def token_kid(token):
+  '''
+    key id from the unverified header of a token
+  '''
+  # jose loads the cryptography backend, imported on the first token instead of at startup
+  from jose import jwt
   try:
-    jsonurl = urlopen("https://"+AUTH0_DOMAIN+"/.well-known/jwks.json")
-  except urllib.error.URLError:
-    raise AuthError(description='Unable to reach Auth server, try again later.')
-  jwks = json.loads(jsonurl.read())
-  # get unverified header
-  unverified_header = jwt.get_unverified_header(token)
-  # get rsa key from jwks & unverified header
-  rsa_key = {}
-  for key in jwks["keys"]:
-    if key["kid"] == unverified_header["kid"]:
-      rsa_key = {
-        "kty": key["kty"],
-        "kid": key["kid"],
-        "use": key["use"],
-        "n": key["n"],
-        "e": key["e"]
-      }
-  # decode token using rsa_key
+    unverified_header = jwt.get_unverified_header(token)
+  except jwt.JWTError:
+    raise AuthError(description='Authentication token parse error',
+      error='invalid_header')
+  if 'kid' not in unverified_header:
+    raise AuthError(description='Authorization malformed.', error='invalid_header')
+  return unverified_header['kid']
+
+
+def decode_jwt(token, rsa_key):
+  '''
+    checks the signature and claims of a token with the key of its kid, caches the payload
+  '''
+  from jose import jwt
   if rsa_key:
     try:
       payload = jwt.decode(
@@ -105,8 +115,45 @@ def verify_decode_jwt(token):
     except Exception:
       raise AuthError(description='Authentication token parse error',
         error='invalid_header')
+    token_cache.set(token, payload)
     return payload
   raise AuthError(description='Unable to find RSA key', error='invalid_header', code=403)
+
+
+def verify_decode_jwt(token):
+  """
+    checks Access Token for validity
+    Args:
+      token (str): The token string to be verified
+  """
+  # token already verified and not expired
+  payload = token_cache.get(token)
+  if payload is not None:
+    return payload
+  # get rsa key from the cached jwks & unverified header
+  kid = token_kid(token)
+  try:
+    rsa_key = jwks_store.get_key(kid)
+  except (OSError, ValueError):
+    raise AuthError(description='Unable to reach Auth server, try again later.')
+  return decode_jwt(token, rsa_key)
+
+
+async def verify_decode_jwt_async(token):
+  """
+    verify_decode_jwt for the async serving mode, the key set is fetched on the running loop
+    Args:
+      token (str): The token string to be verified
+  """
+  payload = token_cache.get(token)
+  if payload is not None:
+    return payload
+  kid = token_kid(token)
+  try:
+    rsa_key = await jwks_store.get_key_async(kid)
+  except (OSError, ValueError):
+    raise AuthError(description='Unable to reach Auth server, try again later.')
+  return decode_jwt(token, rsa_key)
   
 
 def check_permissions(required_perm, payload):
@@ -159,6 +206,23 @@ def requires_authorization(permission=''):
     return wrapper
   return requires_auth_decorator
 
+
+def requires_authorization_async(permission=''):
+  '''
+    requires_authorization for the async handlers of app.asgi
+    Args:
+      permission (str): The required permission to access the resource
+  '''
+  def requires_auth_decorator(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+      token = get_token_auth_header()
+      payload = await verify_decode_jwt_async(token)
+      check_permissions(permission, payload)
+      return await func(permission, *args, **kwargs)
+    return wrapper
+  return requires_auth_decorator
+
 # oauth instance
 # oauth = OAuth(app)
 
@@ -0,0 +1,96 @@
+'''
+  the management api calls of the user routes as coroutines, for the shared event loop
+'''
+import asyncio
+import time
+from urllib.parse import quote
+from ..aio import AsyncClient
+from ..metrics import metrics
+
+
+class AsyncManagementClient:
+  '''
+    AsyncManagementClient
+    calls the management api over a pooled aio.AsyncClient (httpx) with a token fetched
+    from the provider's credentials, kept until shortly before it expires,
+    domain and protocol are read from the provider so both point at the same server
+    Args:
+      provider (ManagementClientProvider): credentials, domain, leeway and timeout
+      pool_size (int): max open connections to the management api
+  '''
+  def __init__(self, provider, pool_size=10):
+    self.provider = provider
+    self.http = AsyncClient(pool_size=pool_size, timeout=provider.timeout)
+    self.stats = {'token_fetches': 0}
+    self._token = None
+    self._expires_at = 0
+    self._domain = None
+    self._lock = None
+    self._lock_loop = None
+
+  def url(self, path):
+    return '{}://{}/{}'.format(self.provider.protocol, self.provider.domain, path)
+
+  def is_fresh(self):
+    # a token of another domain, e.g. before a test pointed the provider at a stand in, isn't used
+    return self._token is not None and self._domain == self.provider.domain \
+      and time.time() < self._expires_at - self.provider.leeway
+
+  async def token(self):
+    '''
+      gets a management api token, one coroutine fetches it while the others wait
+    '''
+    if self.is_fresh():
+      return self._token
+    loop = asyncio.get_running_loop()
+    if self._lock_loop is not loop:
+      self._lock, self._lock_loop = asyncio.Lock(), loop
+    async with self._lock:
+      if not self.is_fresh():
+        provider = self.provider
+        with metrics.timer('management_api_duration_seconds', {'call': 'token'}):
+          response = await self.http.request('POST', self.url('oauth/token'), json={
+            'client_id': provider.client_id,
+            'client_secret': provider.client_secret,
+            'audience': 'https://{}/api/v2/'.format(provider.domain),
+            'grant_type': 'client_credentials'
+          })
+        response.raise_for_status()
+        token = response.json()
+        self.stats['token_fetches'] += 1
+        self._token = token['access_token']
+        self._domain = provider.domain
+        self._expires_at = time.time() + int(token.get('expires_in', 86400))
+    return self._token
+
+  async def call(self, method, path, body=None):
+    '''
+      calls the management api, raises httpx.HTTPStatusError on an error response
+    '''
+    headers = {'Authorization': 'Bearer ' + await self.token()}
+    with metrics.timer('management_api_duration_seconds', {'call': method}):
+      response = await self.http.request(method, self.url('api/v2/' + path), headers=headers, json=body)
+    response.raise_for_status()
+    # role changes answer 204
+    return response.json() if response.content else None
+
+  # same names and arguments as auth0.v3.management.Users, ids like auth0|123 are quoted
+  async def add_roles(self, id, roles):
+    return await self.call('POST', 'users/{}/roles'.format(quote(id, safe='')), {'roles': roles})
+
+  async def remove_roles(self, id, roles):
+    return await self.call('DELETE', 'users/{}/roles'.format(quote(id, safe='')), {'roles': roles})
+
+  async def list_roles(self, id):
+    # with totals the roles come in a dict like the sdk's list_roles returns
+    return await self.call('GET', 'users/{}/roles?include_totals=true'.format(quote(id, safe='')))
+
+  async def update(self, id, body):
+    return await self.call('PATCH', 'users/{}'.format(quote(id, safe='')), body)
+
+  def reset(self):
+    '''
+      drops the token, e.g. after the provider's domain changed
+    '''
+    self._token = None
+    self._expires_at = 0
@@ -0,0 +1,226 @@
+'''
+  in process cache for the auth server json web key set (jwks)
+'''
+import asyncio
+import json
+import threading
+import time
+from urllib.request import urlopen
+from ..aio import AsyncClient, event_loop
+from ..metrics import metrics
+
+
+class JWKSKeyStore:
+  '''
+    JWKSKeyStore
+    loads the key set once and keeps the rsa keys indexed by kid,
+    refreshes when the ttl runs out or a token has an unknown kid,
+    serves the stale keys if the auth server can't be reached
+    Args:
+      url (str): url of the key set, file:// urls work for local stubs
+      ttl (int): seconds a loaded key set is considered fresh
+      min_refresh_interval (int): minimum seconds between kid miss refreshes
+      timeout (int): seconds to wait on the auth server
+      background (bool): refresh expired keys on the event loop and keep serving
+        them meanwhile, instead of in the request that noticed
+  '''
+  def __init__(self, url, ttl=600, min_refresh_interval=30, timeout=5, background=False):
+    self.url = url
+    self.ttl = ttl
+    self.min_refresh_interval = min_refresh_interval
+    self.timeout = timeout
+    self.background = background
+    self.http = AsyncClient(pool_size=1, timeout=timeout)
+    self.keys = {}
+    self.loaded_at = None
+    self.last_refresh = None
+    self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0, 'stale': 0}
+    self._lock = threading.Lock()
+    self._refreshing = None
+    # refresh task of the async serving mode's loop, awaited by every request that needs it
+    self._task = None
+
+  def fetch(self):
+    '''
+      gets the key set from the url
+    '''
+    with urlopen(self.url, timeout=self.timeout) as response:
+      return json.loads(response.read())
+
+  async def fetch_async(self):
+    '''
+      gets the key set on the event loop, file:// urls are read on its executor
+    '''
+    if self.url.startswith(('http://', 'https://')):
+      response = await self.http.request('GET', self.url)
+      response.raise_for_status()
+      return response.json()
+    return await asyncio.get_running_loop().run_in_executor(None, self.fetch)
+
+  def load(self, jwks):
+    '''
+      replaces the stored keys with the keys in a key set
+      Args:
+        jwks (dict): the key set, {"keys": [...]}
+    '''
+    keys = {}
+    for key in jwks.get('keys', []):
+      if key.get('kty') != 'RSA' or 'kid' not in key:
+        continue
+      keys[key['kid']] = {
+        'kty': key['kty'],
+        'kid': key['kid'],
+        'use': key.get('use', 'sig'),
+        'n': key['n'],
+        'e': key['e']
+      }
+    self.keys = keys
+    self.loaded_at = time.monotonic()
+
+  def refresh(self, force=False):
+    '''
+      refetches the key set, rate limited unless forced
+      raises urllib.error.URLError if unreachable and there are no keys to serve
+    '''
+    with self._lock:
+      now = time.monotonic()
+      # another thread refreshed while we waited on the lock
+      if not force and self.last_refresh is not None \
+          and now - self.last_refresh < self.min_refresh_interval:
+        return False
+      self.last_refresh = now
+      try:
+        with metrics.timer('jwks_fetch_duration_seconds'):
+          jwks = self.fetch()
+      except Exception:
+        self.stats['errors'] += 1
+        if not self.keys:
+          raise
+        # keep serving what we have
+        self.stats['stale'] += 1
+        return False
+      self.load(jwks)
+      self.stats['refreshes'] += 1
+      return True
+
+  async def _refresh_async(self):
+    try:
+      with metrics.timer('jwks_fetch_duration_seconds'):
+        jwks = await self.fetch_async()
+    except Exception:
+      # keep serving what we have
+      self.stats['errors'] += 1
+      self.stats['stale'] += 1
+      return False
+    self.load(jwks)
+    self.stats['refreshes'] += 1
+    return True
+
+  def _refresh_done(self, future):
+    with self._lock:
+      # a clear() or a later refresh may have replaced it
+      if self._refreshing is future:
+        self._refreshing = None
+
+  def refresh_in_background(self):
+    '''
+      starts a refresh on the event loop, rate limited like refresh, returns its
+      future, or None when one is already running or it's too soon
+    '''
+    with self._lock:
+      now = time.monotonic()
+      if self._refreshing is not None or (self.last_refresh is not None
+          and now - self.last_refresh < self.min_refresh_interval):
+        return None
+      self.last_refresh = now
+      future = self._refreshing = event_loop.submit(self._refresh_async())
+    # outside the lock, a refresh that already finished runs the callback right here
+    future.add_done_callback(self._refresh_done)
+    return future
+
+  def _refresh_task(self, force=False):
+    # the refresh running on this loop, else a new one unless rate limited like refresh
+    task = self._task
+    if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+      return task
+    with self._lock:
+      now = time.monotonic()
+      if not force and self.last_refresh is not None \
+          and now - self.last_refresh < self.min_refresh_interval:
+        return None
+      self.last_refresh = now
+    task = self._task = asyncio.ensure_future(self._refresh_async())
+    return task
+
+  async def refresh_async(self, force=False):
+    '''
+      refresh for coroutines on the running loop, callers that come while one runs
+      wait for it instead of fetching again
+    '''
+    task = self._refresh_task(force)
+    if task is None:
+      return False
+    # a caller that goes away doesn't cancel the others' refresh
+    return await asyncio.shield(task)
+
+  def is_expired(self):
+    return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl
+
+  def get_key(self, kid):
+    '''
+      gets the rsa key for a kid, None if the auth server doesn't know it
+      Args:
+        kid (str): key id from the unverified token header
+    '''
+    if self.is_expired():
+      if self.background and self.keys:
+        # the expired keys are most likely still valid, don't make this request wait
+        self.refresh_in_background()
+      else:
+        self.refresh(force=self.loaded_at is None)
+    key = self.keys.get(kid)
+    if key is not None:
+      self.stats['hits'] += 1
+      return key
+    # unknown kid, keys may have been rotated
+    self.stats['misses'] += 1
+    if self.refresh():
+      return self.keys.get(kid)
+    return None
+
+  async def get_key_async(self, kid):
+    '''
+      get_key for coroutines, expired keys are served while they refresh in a task,
+      raises OSError if no key set could be loaded yet
+      Args:
+        kid (str): key id from the unverified token header
+    '''
+    if self.is_expired():
+      if self.keys:
+        # the expired keys are most likely still valid, don't make this request wait
+        self._refresh_task()
+      else:
+        await self.refresh_async(force=self.loaded_at is None)
+        if self.loaded_at is None:
+          raise OSError('the key set could not be loaded from {}'.format(self.url))
+    key = self.keys.get(kid)
+    if key is not None:
+      self.stats['hits'] += 1
+      return key
+    # unknown kid, keys may have been rotated
+    self.stats['misses'] += 1
+    if await self.refresh_async():
+      return self.keys.get(kid)
+    return None
+
+  def clear(self):
+    '''
+      drops the stored keys and counters
+    '''
+    with self._lock:
+      self.keys = {}
+      self.loaded_at = None
+      self.last_refresh = None
+      self._task = None
+      for stat in self.stats:
+        self.stats[stat] = 0
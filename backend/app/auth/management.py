@@ -0,0 +1,126 @@
+'''
+  lazy provider for the Auth0 management api client, requests and the auth0 sdk
+  are imported on first use
+'''
+import threading
+import time
+from ..metrics import metrics
+
+
+class ManagementClientProvider:
+  '''
+    ManagementClientProvider
+    fetches the management api token on first use and keeps it until shortly
+    before it expires, only one thread refreshes at a time
+    attribute access is passed to the client, so auth_management.users works as before
+    Args:
+      domain (str): auth0 domain
+      client_id (str): machine to machine client id
+      client_secret (str): machine to machine client secret
+      leeway (int): seconds before expiry the token is refreshed
+      pool_size (int): max keep alive connections to the management api
+      timeout (float): connect and read timeout of management api calls
+      protocol (str): https, http is only useful against a local stand in
+  '''
+  def __init__(self, domain, client_id, client_secret, leeway=60, pool_size=10,
+      timeout=5.0, protocol='https'):
+    self.domain = domain
+    self.client_id = client_id
+    self.client_secret = client_secret
+    self.leeway = leeway
+    self.pool_size = pool_size
+    self.timeout = timeout
+    self.protocol = protocol
+    self.stats = {'token_fetches': 0}
+    self._client = None
+    self._expires_at = 0
+    self._override = None
+    self._session = None
+    self._lock = threading.Lock()
+
+  @property
+  def session(self):
+    '''
+      http session shared by every management api call
+    '''
+    if self._session is None:
+      import requests
+      from requests.adapters import HTTPAdapter
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      self._session = session
+    return self._session
+
+  def fetch_token(self):
+    '''
+      requests a new management api token, returns the token response
+    '''
+    from auth0.v3.authentication import GetToken
+    get_token = GetToken(self.domain, timeout=self.timeout, protocol=self.protocol)
+    with metrics.timer('management_api_duration_seconds', {'call': 'token'}):
+      return get_token.client_credentials(self.client_id,
+        self.client_secret, 'https://{}/api/v2/'.format(self.domain))
+
+  def build_client(self, access_token):
+    '''
+      creates the management api client for a token
+    '''
+    from auth0.v3.management import Auth0
+    from .rest import PooledRestClient
+    client = Auth0(self.domain, access_token)
+    # users is the only endpoint we call, route it through the pooled session
+    client.users.protocol = self.protocol
+    client.users.client = PooledRestClient(access_token, self.session, timeout=self.timeout)
+    return client
+
+  def is_fresh(self):
+    return self._client is not None and time.time() < self._expires_at - self.leeway
+
+  def get(self):
+    '''
+      gets a management api client with a valid token
+    '''
+    if self._override is not None:
+      return self._override
+    if self.is_fresh():
+      return self._client
+    with self._lock:
+      # another thread may have refreshed while we waited
+      if not self.is_fresh():
+        token = self.fetch_token()
+        self.stats['token_fetches'] += 1
+        self._client = self.build_client(token['access_token'])
+        self._expires_at = time.time() + int(token.get('expires_in', 86400))
+      return self._client
+
+  def override(self, client):
+    '''
+      serves a stand in client (e.g. a local fake) instead of the real one
+      Args:
+        client: object with the same interface as auth0.v3.management.Auth0, None to reset
+    '''
+    self._override = client
+
+  @property
+  def overridden(self):
+    return self._override is not None
+
+  def reset(self):
+    '''
+      drops the cached client and token
+    '''
+    with self._lock:
+      self._client = None
+      self._expires_at = 0
+      self._override = None
+      if self._session is not None:
+        self._session.close()
+        self._session = None
+
+  def __getattr__(self, name):
+    # only called for attributes the provider itself doesn't have
+    if name.startswith('_'):
+      raise AttributeError(name)
+    return getattr(self.get(), name)
@@ -0,0 +1,81 @@
+'''
+  auth0 rest client over a pooled requests session, imported by the provider on
+  first use so importing the app doesn't load requests and the auth0 sdk
+'''
+import threading
+import requests
+from auth0.v3 import rest
+from ..metrics import metrics
+
+
+class SessionTransport:
+  '''
+    SessionTransport
+    stands in for the requests module in auth0.v3.rest, the sdk's request calls go through
+    the session of the PooledRestClient making them and everything else is requests
+  '''
+  METHODS = ('get', 'post', 'patch', 'put', 'delete')
+
+  def __init__(self):
+    self._local = threading.local()
+
+  def __getattr__(self, name):
+    session = getattr(self._local, 'session', None)
+    if session is not None and name in self.METHODS:
+      return getattr(session, name)
+    return getattr(requests, name)
+
+  def bind(self, session):
+    '''
+      sends this thread's sdk requests through session until unbind
+    '''
+    previous = getattr(self._local, 'session', None)
+    self._local.session = session
+    return previous
+
+  def unbind(self, previous):
+    self._local.session = previous
+
+
+transport = SessionTransport()
+rest.requests = transport
+
+
+class PooledRestClient(rest.RestClient):
+  '''
+    PooledRestClient
+    auth0 rest client that sends requests through a shared requests.Session,
+    so calls reuse pooled keep alive connections instead of opening one each,
+    the sdk's methods run unchanged, so GETs keep its 429 retries with backoff
+    Args:
+      jwt (str): management api token
+      session (requests.Session): shared session
+      timeout (float): connect and read timeout
+  '''
+  def __init__(self, jwt, session, timeout=5.0):
+    super().__init__(jwt, timeout=timeout)
+    self.session = session
+
+  def _call(self, method, *args, **kwargs):
+    # auth0 error responses raise in _process_response and count as errors
+    previous = transport.bind(self.session)
+    try:
+      with metrics.timer('management_api_duration_seconds', {'call': method.upper()}):
+        return getattr(super(), method)(*args, **kwargs)
+    finally:
+      transport.unbind(previous)
+
+  def get(self, url, params=None, headers=None):
+    return self._call('get', url, params=params, headers=headers)
+
+  def post(self, url, data=None, headers=None):
+    return self._call('post', url, data=data, headers=headers)
+
+  def patch(self, url, data=None):
+    return self._call('patch', url, data=data)
+
+  def put(self, url, data=None):
+    return self._call('put', url, data=data)
+
+  def delete(self, url, params=None, data=None):
+    return self._call('delete', url, params=params, data=data)
@@ -0,0 +1,244 @@
+'''
+  helpers for tests and benchmarks, mints RS256 tokens from a local key
+  so protected routes can be exercised without an Auth0 tenant, and stands in
+  for the Auth0 token, jwks and management api endpoints, in process or over http
+'''
+import base64
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+
+def _b64_uint(value):
+  length = (value.bit_length() + 7) // 8
+  return base64.urlsafe_b64encode(value.to_bytes(length, 'big')).rstrip(b'=').decode('ascii')
+
+
+class LocalSigningKey:
+  '''
+    LocalSigningKey
+    locally generated rsa key pair with its public jwks
+    Args:
+      kid (str): key id put in the token headers and the jwks
+  '''
+  def __init__(self, kid='local-test-key'):
+    self.kid = kid
+    self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    self.pem = self.private_key.private_bytes(
+      serialization.Encoding.PEM,
+      serialization.PrivateFormat.PKCS8,
+      serialization.NoEncryption()
+    )
+
+  def jwks(self):
+    '''
+      the public key set, same shape as /.well-known/jwks.json
+    '''
+    numbers = self.private_key.public_key().public_numbers()
+    return {'keys': [{
+      'kty': 'RSA',
+      'kid': self.kid,
+      'use': 'sig',
+      'alg': 'RS256',
+      'n': _b64_uint(numbers.n),
+      'e': _b64_uint(numbers.e)
+    }]}
+
+  def mint(self, domain, audience, permissions=None, subject='auth0|local-user', expires_in=3600):
+    '''
+      signs an access token like the ones issued by Auth0
+      Args:
+        domain (str): auth domain, used for the issuer
+        audience (str): api audience
+        permissions (list): permissions claim
+    '''
+    now = int(time.time())
+    claims = {
+      'iss': 'https://' + domain + '/',
+      'sub': subject,
+      'aud': audience,
+      'iat': now,
+      'exp': now + expires_in,
+      'permissions': permissions or []
+    }
+    return jwt.encode(claims, self.pem, algorithm='RS256', headers={'kid': self.kid})
+
+
+class FakeUsers:
+  '''
+    in memory stand in for auth0.v3.management.Users
+    Args:
+      role_names (dict): role id -> role name
+      latency (float): seconds each call sleeps, simulates the round trip
+  '''
+  def __init__(self, role_names=None, latency=0):
+    self.role_names = role_names or {}
+    self.latency = latency
+    self.roles = {}
+    self.profiles = {}
+    self.calls = []
+    self._lock = threading.Lock()
+
+  def _call(self, name, user_id):
+    with self._lock:
+      self.calls.append((name, user_id))
+    if self.latency:
+      time.sleep(self.latency)
+
+  def add_roles(self, id, roles):
+    self._call('add_roles', id)
+    with self._lock:
+      self.roles.setdefault(id, set()).update(roles)
+
+  def remove_roles(self, id, roles):
+    self._call('remove_roles', id)
+    with self._lock:
+      self.roles.setdefault(id, set()).difference_update(roles)
+
+  def list_roles(self, id, page=0, per_page=25, include_totals=True):
+    self._call('list_roles', id)
+    roles = [
+      {'id': role_id, 'name': self.role_names.get(role_id, role_id)}
+      for role_id in sorted(self.roles.get(id, ()))
+    ]
+    return {'roles': roles, 'start': 0, 'limit': per_page, 'total': len(roles)}
+
+  def update(self, id, body):
+    self._call('update', id)
+    with self._lock:
+      self.profiles.setdefault(id, {}).update(body)
+    return dict(self.profiles[id], user_id=id)
+
+  def count(self, name):
+    return len([call for call in self.calls if call[0] == name])
+
+
+class FakeManagement:
+  '''
+    stand in for the Auth0 management client, pass to auth_management.override()
+  '''
+  def __init__(self, role_names=None, latency=0):
+    self.users = FakeUsers(role_names, latency)
+
+
+USER_ROLES_PATH = re.compile(r'^/api/v2/users/([^/]+)/roles')
+USER_PATH = re.compile(r'^/api/v2/users/([^/]+)$')
+
+
+class FakeAuth0Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def read_json(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    return json.loads(self.rfile.read(length) or b'null')
+
+  def send_json(self, status, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def handle_request(self, method):
+    server = self.server
+    if server.latency:
+      time.sleep(server.latency)
+    with server.lock:
+      server.requests += 1
+    path = self.path.split('?')[0]
+    if method == 'GET' and path == '/.well-known/jwks.json':
+      return self.send_json(200, server.jwks)
+    if method == 'POST' and path == '/oauth/token':
+      self.read_json()
+      return self.send_json(200, {'access_token': 'fake-mgmt-token', 'expires_in': 86400,
+        'token_type': 'Bearer'})
+    with server.lock:
+      limited = server.rate_limited > 0
+      if limited:
+        server.rate_limited -= 1
+    if limited:
+      return self.send_json(429, {'statusCode': 429, 'error': 'Too Many Requests', 'message': 'rate limited'})
+    match = USER_ROLES_PATH.match(path)
+    if match:
+      user_id = unquote(match.group(1))
+      with server.lock:
+        roles = server.roles.setdefault(user_id, set())
+        if method == 'GET':
+          body = {'roles': [{'id': role, 'name': role} for role in sorted(roles)]}
+          return self.send_json(200, body)
+        data = self.read_json()
+        if method == 'POST':
+          roles.update(data['roles'])
+        elif method == 'DELETE':
+          roles.difference_update(data['roles'])
+      return self.send_json(204)
+    match = USER_PATH.match(path)
+    if match and method == 'PATCH':
+      data = self.read_json()
+      return self.send_json(200, dict(data, user_id=unquote(match.group(1))))
+    self.send_json(404, {'statusCode': 404, 'error': 'Not Found', 'message': path})
+
+  def do_GET(self):
+    self.handle_request('GET')
+
+  def do_POST(self):
+    self.handle_request('POST')
+
+  def do_DELETE(self):
+    self.handle_request('DELETE')
+
+  def do_PATCH(self):
+    self.handle_request('PATCH')
+
+
+class FakeAuth0Server(ThreadingHTTPServer):
+  '''
+    FakeAuth0Server
+    Auth0 over http on a background thread, with injected latency
+    Args:
+      latency (float): seconds every request sleeps before answering
+      jwks (dict): key set served on /.well-known/jwks.json
+    rate_limited is the number of following management api requests answered with 429
+  '''
+  daemon_threads = True
+  # the socketserver default of 5 makes concurrent clients wait on connect retries
+  request_queue_size = 128
+
+  def __init__(self, latency=0, jwks=None, port=0):
+    super().__init__(('127.0.0.1', port), FakeAuth0Handler)
+    self.latency = latency
+    self.jwks = jwks or {'keys': []}
+    self.roles = {}
+    self.requests = 0
+    self.connections = 0
+    self.rate_limited = 0
+    self.lock = threading.Lock()
+
+  def process_request(self, request, client_address):
+    # once per accepted connection, keep alive requests reuse it
+    with self.lock:
+      self.connections += 1
+    super().process_request(request, client_address)
+
+  @property
+  def domain(self):
+    return '{}:{}'.format(*self.server_address)
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever, daemon=True)
+    thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
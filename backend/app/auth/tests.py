@@ -0,0 +1,416 @@
+'''
+  holds test cases for the auth module
+'''
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from .jwks import JWKSKeyStore
+from .management import ManagementClientProvider
+from .token_cache import TokenCache
+
+
+def make_jwk(kid):
+  '''
+    builds a fake public key entry for a stub key set
+  '''
+  return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n-' + kid, 'e': 'AQAB'}
+
+
+class JWKSTestCase(unittest.TestCase):
+  '''
+    tests the jwks key store against a local stub key set file
+  '''
+  def setUp(self):
+    '''
+      set up
+      writes a stub key set and points a store at it
+    '''
+    handle, self.path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    self.write_keys('key-1')
+    self.store = JWKSKeyStore('file://' + self.path, ttl=600, min_refresh_interval=0)
+
+
+  def tearDown(self):
+    '''
+      tear down
+    '''
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def write_keys(self, *kids):
+    with open(self.path, 'w') as jwks_file:
+      json.dump({'keys': [make_jwk(kid) for kid in kids]}, jwks_file)
+
+  def test_loads_once(self):
+    '''
+      test keys are fetched once and served from memory
+    '''
+    for _ in range(5):
+      self.assertEqual(self.store.get_key('key-1')['n'], 'n-key-1')
+    self.assertEqual(self.store.stats['refreshes'], 1)
+    self.assertEqual(self.store.stats['hits'], 5)
+
+  def test_refresh_on_unknown_kid(self):
+    '''
+      test a rotated key is picked up on a kid miss
+    '''
+    self.store.get_key('key-1')
+    self.write_keys('key-1', 'key-2')
+    self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+    self.assertEqual(self.store.stats['misses'], 1)
+    self.assertEqual(self.store.stats['refreshes'], 2)
+
+  def test_kid_miss_refresh_is_rate_limited(self):
+    '''
+      test unknown kids don't refetch inside the refresh interval
+    '''
+    self.store.min_refresh_interval = 60
+    self.store.get_key('key-1')
+    for _ in range(3):
+      self.assertIsNone(self.store.get_key('unknown'))
+    self.assertEqual(self.store.stats['refreshes'], 1)
+    self.assertEqual(self.store.stats['misses'], 3)
+
+  def test_ttl_expiry_refetches(self):
+    '''
+      test keys are refetched once the ttl runs out
+    '''
+    self.store.ttl = 0
+    self.store.get_key('key-1')
+    self.store.get_key('key-1')
+    self.assertEqual(self.store.stats['refreshes'], 2)
+
+  def test_serves_stale_keys_when_unreachable(self):
+    '''
+      test stored keys keep working while the auth server is down
+    '''
+    self.store.get_key('key-1')
+    os.remove(self.path)
+    self.store.ttl = 0
+    self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+    self.assertEqual(self.store.stats['stale'], 1)
+
+  def test_background_refresh_finishing_first(self):
+    '''
+      test a background refresh done before submit returns doesn't block the later ones
+    '''
+    import asyncio
+    from unittest.mock import patch
+    from app.aio import event_loop
+    loop = event_loop.loop
+
+    def submit_finished(coroutine):
+      # e.g. a fast file:// read, done before submit returns
+      future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+      future.result()
+      return future
+    self.store.background = True
+    self.store.get_key('key-1')
+    for kid in ('key-2', 'key-3'):
+      self.write_keys('key-1', kid)
+      with patch.object(event_loop, 'submit', submit_finished):
+        future = self.store.refresh_in_background()
+      self.assertIsNotNone(future)
+      self.assertIsNone(self.store._refreshing)
+      self.assertIn(kid, self.store.keys)
+
+  def test_get_key_async(self):
+    '''
+      test concurrent coroutines share one load, expired keys are served while they refresh
+    '''
+    import asyncio
+
+    async def lookups():
+      first = await asyncio.gather(*[self.store.get_key_async('key-1') for _ in range(5)])
+      self.store.ttl = 0
+      self.write_keys('key-1', 'key-2')
+      stale = await self.store.get_key_async('key-1')
+      await self.store._task
+      self.store.ttl = 600
+      return first, stale, await self.store.get_key_async('key-2')
+    first, stale, rotated = asyncio.run(lookups())
+    self.assertEqual({key['kid'] for key in first}, {'key-1'})
+    self.assertEqual(stale['kid'], 'key-1')
+    self.assertEqual(rotated['kid'], 'key-2')
+    self.assertEqual(self.store.stats['refreshes'], 2)
+
+  def test_unreachable_without_keys_raises(self):
+    '''
+      test the fetch error surfaces when there is nothing to serve
+    '''
+    os.remove(self.path)
+    with self.assertRaises(OSError):
+      self.store.get_key('key-1')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+  '''
+    tests the verified token cache
+  '''
+  def setUp(self):
+    '''
+      set up
+    '''
+    self.cache = TokenCache(maxsize=2)
+    self.exp = int(time.time()) + 60
+
+  def test_hit_until_expiry(self):
+    '''
+      test a cached payload is returned until exp
+    '''
+    self.cache.set('token-1', {'sub': 'a', 'exp': self.exp})
+    self.assertEqual(self.cache.get('token-1')['sub'], 'a')
+    self.cache.set('token-2', {'sub': 'b', 'exp': int(time.time()) - 1})
+    self.assertIsNone(self.cache.get('token-2'))
+    self.assertEqual(self.cache.stats['hits'], 1)
+    self.assertEqual(self.cache.stats['misses'], 1)
+
+  def test_lru_eviction(self):
+    '''
+      test the least recently used token is dropped past maxsize
+    '''
+    self.cache.set('token-1', {'exp': self.exp})
+    self.cache.set('token-2', {'exp': self.exp})
+    self.cache.get('token-1')
+    self.cache.set('token-3', {'exp': self.exp})
+    self.assertEqual(len(self.cache), 2)
+    self.assertIsNone(self.cache.get('token-2'))
+    self.assertIsNotNone(self.cache.get('token-1'))
+
+  def test_disabled(self):
+    '''
+      test maxsize 0 stores nothing
+    '''
+    self.cache.maxsize = 0
+    self.cache.set('token-1', {'exp': self.exp})
+    self.assertIsNone(self.cache.get('token-1'))
+
+
+class VerifyTokenTestCase(unittest.TestCase):
+  '''
+    tests verify_decode_jwt with a locally signed token
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from .testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
+  def setUp(self):
+    '''
+      set up
+      serves the local key set from the jwks store
+    '''
+    from app import auth
+    self.auth = auth
+    auth.jwks_store.clear()
+    auth.jwks_store.load(self.key.jwks())
+    auth.token_cache.clear()
+
+  def tearDown(self):
+    '''
+      tear down
+    '''
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+
+  def test_repeat_token_is_cached(self):
+    '''
+      test the second verification of a token is a cache hit
+    '''
+    token = self.key.mint(self.auth.AUTH0_DOMAIN, self.auth.API_AUDIENCE, ['get:drinks-detail'])
+    payload = self.auth.verify_decode_jwt(token)
+    self.assertEqual(payload['permissions'], ['get:drinks-detail'])
+    self.assertIs(self.auth.verify_decode_jwt(token), payload)
+    self.assertEqual(self.auth.token_cache.stats['hits'], 1)
+
+  def test_bad_token_is_not_cached(self):
+    '''
+      test a token with the wrong audience fails every time
+    '''
+    token = self.key.mint(self.auth.AUTH0_DOMAIN, 'other-audience')
+    for _ in range(2):
+      with self.assertRaises(self.auth.AuthError):
+        self.auth.verify_decode_jwt(token)
+    self.assertEqual(len(self.auth.token_cache), 0)
+
+
+class StubProvider(ManagementClientProvider):
+  '''
+    provider with the token request replaced by a counter
+  '''
+  expires_in = 86400
+
+  def fetch_token(self):
+    time.sleep(0.01)
+    return {'access_token': 'token-{}'.format(self.stats['token_fetches']), 'expires_in': self.expires_in}
+
+  def build_client(self, access_token):
+    return {'token': access_token}
+
+
+class ManagementProviderTestCase(unittest.TestCase):
+  '''
+    tests the lazy management api client provider
+  '''
+  def setUp(self):
+    '''
+      set up
+    '''
+    self.provider = StubProvider('example.auth0.com', 'id', 'secret', leeway=60)
+
+  def test_lazy_and_cached(self):
+    '''
+      test the token is fetched on first use only
+    '''
+    self.assertEqual(self.provider.stats['token_fetches'], 0)
+    client = self.provider.get()
+    self.assertIs(self.provider.get(), client)
+    self.assertEqual(self.provider.stats['token_fetches'], 1)
+
+  def test_refresh_before_expiry(self):
+    '''
+      test a token inside the leeway window is refreshed
+    '''
+    self.provider.expires_in = 30
+    self.assertEqual(self.provider.get()['token'], 'token-0')
+    self.assertEqual(self.provider.get()['token'], 'token-1')
+
+  def test_single_flight(self):
+    '''
+      test concurrent first calls fetch one token
+    '''
+    threads = [threading.Thread(target=self.provider.get) for _ in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.provider.stats['token_fetches'], 1)
+
+  def test_override(self):
+    '''
+      test a stand in client is served without fetching a token
+    '''
+    from .testing import FakeManagement
+    fake = FakeManagement()
+    self.provider.override(fake)
+    self.assertIs(self.provider.users, fake.users)
+    self.assertEqual(self.provider.stats['token_fetches'], 0)
+
+
+class AsyncClientTestCase(unittest.TestCase):
+  '''
+    tests the event loop http client (httpx), the async management client and background jwks
+    refreshes against the local stand in for Auth0
+  '''
+  def setUp(self):
+    from app.auth.testing import FakeAuth0Server
+    self.server = FakeAuth0Server(latency=0.05, jwks={'keys': [make_jwk('key-1')]}).start()
+    self.provider = ManagementClientProvider(self.server.domain, 'id', 'secret', protocol='http')
+
+  def tearDown(self):
+    self.server.stop()
+
+  def test_concurrent_calls_share_the_pool(self):
+    '''
+      test concurrent management calls wait on the loop, on at most pool_size connections
+    '''
+    import asyncio
+    from app.aio import event_loop
+    from .async_management import AsyncManagementClient
+    client = AsyncManagementClient(self.provider, pool_size=10)
+    user_ids = ['auth0|async-{}'.format(i) for i in range(30)]
+
+    async def add_all():
+      await asyncio.gather(*(client.add_roles(user_id, ['rol_1']) for user_id in user_ids))
+    started = time.perf_counter()
+    event_loop.run(add_all(), timeout=10)
+    elapsed = time.perf_counter() - started
+    # 30 calls of 50ms, 10 at a time, plus the token
+    self.assertLess(elapsed, 30 * 0.05 / 2)
+    self.assertEqual(self.server.roles['auth0|async-29'], {'rol_1'})
+    self.assertEqual(client.stats['token_fetches'], 1)
+    self.assertLessEqual(self.server.connections, 10)
+    self.assertLess(self.server.connections, self.server.requests)
+    roles = event_loop.run(client.list_roles('auth0|async-0'), timeout=10)
+    self.assertEqual(roles['roles'], [{'id': 'rol_1', 'name': 'rol_1'}])
+
+  def test_error_status_raises(self):
+    '''
+      test an error response raises with its status, not retried unless transient
+    '''
+    import httpx
+    from app.aio import event_loop
+    from app.user.bulk import is_transient
+    from .async_management import AsyncManagementClient
+    client = AsyncManagementClient(self.provider)
+    with self.assertRaises(httpx.HTTPStatusError) as raised:
+      event_loop.run(client.call('GET', 'clients'), timeout=10)
+    self.assertEqual(raised.exception.response.status_code, 404)
+    self.assertFalse(is_transient(raised.exception))
+
+  def test_pooled_client_keeps_sdk_retries(self):
+    '''
+      test the pooled management client sends through its session and gets keep the sdk's 429 retries
+    '''
+    users = self.provider.get().users
+    self.server.roles['auth0|limited'] = {'rol_1'}
+    self.server.rate_limited = 2
+    self.assertEqual(users.list_roles('auth0|limited')['roles'], [{'id': 'rol_1', 'name': 'rol_1'}])
+    self.assertEqual(users.client._metrics['retries'], 2)
+    for i in range(5):
+      users.add_roles('auth0|pooled', ['rol_{}'.format(i)])
+    self.assertEqual(len(self.server.roles['auth0|pooled']), 5)
+    # the token, then one keep alive connection for the management calls
+    self.assertEqual(self.server.connections, 2)
+
+  def test_user_ids_are_quoted(self):
+    '''
+      test ids with a pipe or a space reach the management api as one path segment
+    '''
+    from app.aio import event_loop
+    from .async_management import AsyncManagementClient
+    client = AsyncManagementClient(self.provider)
+    for user_id in ('auth0|quoted', 'auth0|with space/slash'):
+      event_loop.run(client.add_roles(user_id, ['rol_1']), timeout=10)
+      self.assertEqual(self.server.roles[user_id], {'rol_1'})
+
+  def test_transient_errors(self):
+    '''
+      test only connection problems are retried, and once a request may have been sent
+      only for idempotent methods
+    '''
+    import ssl
+    import httpx
+    import requests
+    from app.user.bulk import is_transient
+    post, get = httpx.Request('POST', 'http://auth0/'), httpx.Request('GET', 'http://auth0/')
+    self.assertTrue(is_transient(httpx.ConnectError('refused', request=post)))
+    self.assertFalse(is_transient(httpx.ReadTimeout('timed out', request=post)))
+    self.assertTrue(is_transient(httpx.ReadTimeout('timed out', request=get)))
+    self.assertTrue(is_transient(requests.exceptions.ConnectionError()))
+    for error in (requests.exceptions.InvalidURL(), requests.exceptions.TooManyRedirects(),
+        ssl.SSLCertVerificationError(), OSError()):
+      self.assertFalse(is_transient(error))
+
+  def test_background_jwks_refresh(self):
+    '''
+      test expired keys keep being served while a single refresh runs on the loop
+    '''
+    store = JWKSKeyStore('http://{}/.well-known/jwks.json'.format(self.server.domain),
+      ttl=600, min_refresh_interval=0, background=True)
+    self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+    self.server.jwks = {'keys': [make_jwk('key-1'), make_jwk('key-2')]}
+    store.ttl = 0
+    started = time.perf_counter()
+    for _ in range(5):
+      self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+    self.assertLess(time.perf_counter() - started, 0.05)
+    deadline = time.monotonic() + 10
+    while 'key-2' not in store.keys and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertIn('key-2', store.keys)
+    self.assertEqual(store.stats['refreshes'], 2)
@@ -0,0 +1,81 @@
+'''
+  cache of verified access tokens, repeat tokens skip signature verification
+'''
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+  '''
+    TokenCache
+    bounded lru cache of decoded token payloads keyed by a hash of the raw token,
+    entries are dropped once the token's exp is reached
+    Args:
+      maxsize (int): max number of tokens kept, 0 disables the cache
+  '''
+  def __init__(self, maxsize=1024):
+    self.maxsize = maxsize
+    self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def key(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+  def get(self, token):
+    '''
+      gets the payload of a previously verified token, None if not cached or expired
+      Args:
+        token (str): raw token string
+    '''
+    if self.maxsize <= 0:
+      return None
+    key = self.key(token)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.stats['misses'] += 1
+        return None
+      payload, expires = entry
+      if time.time() >= expires:
+        del self._entries[key]
+        self.stats['misses'] += 1
+        return None
+      self._entries.move_to_end(key)
+      self.stats['hits'] += 1
+      return payload
+
+  def set(self, token, payload):
+    '''
+      stores the payload of a verified token until it expires
+      tokens without an exp claim are not cached
+      Args:
+        token (str): raw token string
+        payload (dict): the verified token claims
+    '''
+    expires = payload.get('exp')
+    if self.maxsize <= 0 or not isinstance(expires, (int, float)):
+      return
+    key = self.key(token)
+    with self._lock:
+      self._entries[key] = (payload, expires)
+      self._entries.move_to_end(key)
+      # least recently used first, expired tokens are dropped on lookup
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.stats['evictions'] += 1
+
+  def __len__(self):
+    return len(self._entries)
+
+  def clear(self):
+    '''
+      drops the cached tokens and counters
+    '''
+    with self._lock:
+      self._entries.clear()
+      for stat in self.stats:
+        self.stats[stat] = 0
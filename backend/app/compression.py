@@ -0,0 +1,132 @@
+'''
+  compresses responses for clients that accept it, with gzip, deflate or brotli when installed
+'''
+import zlib
+from os import environ as env
+from flask import current_app, request
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# mimetypes worth compressing, event streams are left alone
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain',
+  'text/css', 'application/javascript')
+
+
+class ZlibCompressor:
+  '''
+    gzip (wbits 31) or zlib wrapped deflate (wbits 15)
+  '''
+  def __init__(self, level, wbits):
+    self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+  def compress(self, data):
+    return self._compressor.compress(data)
+
+  def flush(self):
+    # everything so far, decodable by the client before the end
+    return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+  def finish(self):
+    return self._compressor.flush()
+
+
+class BrotliCompressor:
+  def __init__(self, quality):
+    self._compressor = brotli.Compressor(quality=quality)
+
+  def compress(self, data):
+    return self._compressor.process(data)
+
+  def flush(self):
+    return self._compressor.flush()
+
+  def finish(self):
+    return self._compressor.finish()
+
+
+def encodings():
+  '''
+    supported encodings, preferred first
+  '''
+  return ('br', 'gzip', 'deflate') if brotli is not None else ('gzip', 'deflate')
+
+
+def get_compressor(encoding):
+  config = current_app.config
+  if encoding == 'br':
+    return BrotliCompressor(config['COMPRESS_BR_LEVEL'])
+  return ZlibCompressor(config['COMPRESS_LEVEL'], 31 if encoding == 'gzip' else 15)
+
+
+def compress(data, encoding):
+  compressor = get_compressor(encoding)
+  return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, compressor):
+  '''
+    compresses a streamed body chunk by chunk, each chunk is flushed so the
+    client gets it right away
+  '''
+  try:
+    for chunk in chunks:
+      if isinstance(chunk, str):
+        chunk = chunk.encode('utf-8')
+      data = compressor.compress(chunk) + compressor.flush()
+      if data:
+        yield data
+    yield compressor.finish()
+  finally:
+    # e.g. ends the request context kept by stream_with_context
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+      close()
+
+
+def compress_response(response):
+  '''
+    after request hook, compresses the body with the best encoding the client accepts
+    a response can carry a dict in response.precompressed, encoded bodies are read from
+    and stored in it so a cached body is only compressed once per encoding
+  '''
+  if response.status_code < 200 or response.status_code in (204, 206, 304) \
+    or response.direct_passthrough or 'Content-Encoding' in response.headers \
+    or response.mimetype not in COMPRESS_MIMETYPES:
+    return response
+  response.vary.add('Accept-Encoding')
+  encoding = request.accept_encodings.best_match(encodings())
+  if encoding is None:
+    return response
+  if response.is_streamed:
+    response.response = compress_stream(response.response, get_compressor(encoding))
+    response.headers.pop('Content-Length', None)
+  else:
+    body = response.get_data()
+    if len(body) < current_app.config['COMPRESS_MIN_SIZE']:
+      return response
+    variants = getattr(response, 'precompressed', None)
+    data = variants.get(encoding) if variants is not None else None
+    if data is None:
+      data = compress(body, encoding)
+      if variants is not None:
+        variants[encoding] = data
+    response.set_data(data)
+  response.headers['Content-Encoding'] = encoding
+  # the encoded body isn't byte for byte the same, If-None-Match still matches a weak etag
+  etag, weak = response.get_etag()
+  if etag and not weak:
+    response.set_etag(etag, weak=True)
+  return response
+
+
+def init_app(app):
+  '''
+    registers response compression, settings default to env vars
+  '''
+  app.config.setdefault('COMPRESS_MIN_SIZE', int(env.get('COMPRESS_MIN_SIZE', 500)))
+  app.config.setdefault('COMPRESS_LEVEL', int(env.get('COMPRESS_LEVEL', 6)))
+  app.config.setdefault('COMPRESS_BR_LEVEL', int(env.get('COMPRESS_BR_LEVEL', 4)))
+  app.after_request(compress_response)
@@ -0,0 +1,215 @@
+'''
+  database object of the app, engine pooling and sqlite pragmas from the config,
+  routing of reads to a replica, and the asyncio engines of the async serving mode
+'''
+import time
+from functools import partial, wraps
+import flask_sqlalchemy
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from .metrics import instrument_pool
+from .queries import instrument
+
+# SQLALCHEMY_BINDS key of the read replica
+REPLICA_BIND = 'replica'
+# asyncio drivers by backend, for the async serving mode (app.asgi)
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+# holds the time until which the client reads from the primary
+STICKY_COOKIE = 'read_primary_until'
+
+# used when the config doesn't set them, e.g. create_app with a config mapping
+DEFAULTS = {
+  'DB_POOL_SIZE': 5,
+  'DB_MAX_OVERFLOW': 10,
+  'DB_POOL_TIMEOUT': 30,
+  'DB_POOL_RECYCLE': 1800,
+  'DB_POOL_PRE_PING': True,
+  'SQLITE_JOURNAL_MODE': 'WAL',
+  'SQLITE_SYNCHRONOUS': 'NORMAL',
+  'SQLITE_BUSY_TIMEOUT': 5000,
+  'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+  'REPLICA_STICKY_SECONDS': 5,
+}
+
+
+def setting(config, name):
+  return config.get(name, DEFAULTS[name])
+
+
+def is_memory(sa_url):
+  return sa_url.database in (None, '', ':memory:')
+
+
+def engine_options(config, sa_url):
+  '''
+    create_engine options for the database url
+  '''
+  pool = {
+    'pool_size': setting(config, 'DB_POOL_SIZE'),
+    'max_overflow': setting(config, 'DB_MAX_OVERFLOW'),
+    'pool_timeout': setting(config, 'DB_POOL_TIMEOUT'),
+  }
+  if sa_url.get_backend_name() != 'sqlite':
+    return dict(pool,
+      pool_recycle=setting(config, 'DB_POOL_RECYCLE'),
+      pool_pre_ping=setting(config, 'DB_POOL_PRE_PING'))
+  if is_memory(sa_url) or not pool['pool_size']:
+    # flask-sqlalchemy uses one shared connection for in memory dbs, and no pool for size 0
+    return {}
+  # reuses connections (and their pragmas) instead of reopening the file per checkout,
+  # a pooled connection is used by one thread at a time
+  return dict(pool, poolclass=QueuePool, connect_args={'check_same_thread': False})
+
+
+def sqlite_pragmas(config):
+  return [
+    ('journal_mode', setting(config, 'SQLITE_JOURNAL_MODE')),
+    ('synchronous', setting(config, 'SQLITE_SYNCHRONOUS')),
+    ('busy_timeout', setting(config, 'SQLITE_BUSY_TIMEOUT')),
+    ('mmap_size', setting(config, 'SQLITE_MMAP_SIZE')),
+  ]
+
+
+def set_pragmas(pragmas, dbapi_connection, connection_record):
+  cursor = dbapi_connection.cursor()
+  try:
+    for name, value in pragmas:
+      cursor.execute('PRAGMA {}={}'.format(name, value))
+  finally:
+    cursor.close()
+
+
+def async_url(sa_url):
+  '''
+    the url with the asyncio driver of its database
+  '''
+  backend = sa_url.get_backend_name()
+  if backend not in ASYNC_DRIVERS:
+    raise ValueError('no asyncio driver for {} databases'.format(backend))
+  return sa_url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def get_async_engine(app, bind=None):
+  '''
+    the asyncio engine (aiosqlite, asyncpg) of app's database or of a bind, made on first use
+    with the pool options, query timing and sqlite pragmas of the sync engine,
+    sqlalchemy.ext.asyncio is imported here so the sync mode doesn't load it
+  '''
+  engines = app.extensions.setdefault('async_engines', {})
+  if bind not in engines:
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    sa_url = make_url(app.config['SQLALCHEMY_BINDS'][bind] if bind else app.config['SQLALCHEMY_DATABASE_URI'])
+    if sa_url.get_backend_name() == 'sqlite' and is_memory(sa_url):
+      # every aiosqlite connection would get an empty database of its own
+      raise ValueError('the async serving mode needs a database file or server')
+    options = dict(engine_options(app.config, sa_url), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if options.get('poolclass') is QueuePool:
+      options['poolclass'] = AsyncAdaptedQueuePool
+    engine = create_async_engine(async_url(sa_url), **options)
+    # events are on the sync engine the async one drives
+    instrument(engine.sync_engine, app.config)
+    instrument_pool(engine.sync_engine)
+    if engine.dialect.name == 'sqlite':
+      event.listen(engine.sync_engine, 'connect', partial(set_pragmas, sqlite_pragmas(app.config)))
+    engines[bind] = engine
+  return engines[bind]
+
+
+async def dispose_async_engines(app):
+  '''
+    closes the pooled connections of app's asyncio engines, on the loop that opened them
+  '''
+  for engine in app.extensions.pop('async_engines', {}).values():
+    await engine.dispose()
+
+
+def async_session():
+  '''
+    asyncio session of the current app for the async handlers of app.asgi, reads from
+    the replica in handlers marked with use_replica, use it with async with
+  '''
+  from sqlalchemy.ext.asyncio import AsyncSession
+  app = current_app._get_current_object()
+  bind = REPLICA_BIND if g.get('use_replica') and has_replica(app) else None
+  return AsyncSession(get_async_engine(app, bind))
+
+
+def has_replica(app):
+  return REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def use_replica(f):
+  '''
+    decorator, the handler's queries read from the replica when one is configured,
+    unless the client wrote within REPLICA_STICKY_SECONDS
+  '''
+  @wraps(f)
+  def decorated(*args, **kwargs):
+    try:
+      sticky = float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+      sticky = False
+    g.use_replica = not sticky
+    return f(*args, **kwargs)
+  return decorated
+
+
+def mark_sticky(response):
+  '''
+    after request hook, a client that wrote reads its writes from the primary for a while
+  '''
+  if g.get('db_wrote') and has_replica(current_app):
+    seconds = setting(current_app.config, 'REPLICA_STICKY_SECONDS')
+    response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds,
+      httponly=True, samesite='Lax')
+  return response
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+  '''
+    RoutingSession
+    sends the reads of handlers marked with use_replica to the replica bind,
+    flushes and insert/update/delete statements always go to the primary
+  '''
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    in_request = has_request_context()
+    if self._flushing or isinstance(clause, UpdateBase):
+      if in_request:
+        g.db_wrote = True
+    elif in_request and g.get('use_replica') and has_replica(self.app):
+      return flask_sqlalchemy.get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+    return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+  '''
+    SQLAlchemy
+    adds the DB_POOL_* options to the engine, SQLALCHEMY_ENGINE_OPTIONS still win,
+    times queries (app.queries), counts pool checkouts (app.metrics), runs the SQLITE_* pragmas on every new sqlite connection, and can route reads
+    to a replica in SQLALCHEMY_BINDS
+  '''
+  def init_app(self, app):
+    super().init_app(app)
+    app.after_request(mark_sticky)
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+  def apply_driver_hacks(self, app, sa_url, options):
+    options = dict(engine_options(app.config, sa_url), **options)
+    return super().apply_driver_hacks(app, sa_url, options)
+
+  def create_engine(self, sa_url, engine_opts):
+    engine = super().create_engine(sa_url, engine_opts)
+    # query counts, slow query log
+    instrument(engine, self.get_app().config)
+    # pool checkouts for /metrics
+    instrument_pool(engine)
+    if engine.dialect.name == 'sqlite':
+      pragmas = sqlite_pragmas(self.get_app().config)
+      event.listen(engine, 'connect', partial(set_pragmas, pragmas))
+    return engine
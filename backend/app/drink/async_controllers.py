@@ -0,0 +1,55 @@
+'''
+  async handlers of the drink listings for the async serving mode (app.asgi), same
+  responses as their sync routes in controllers, read with the asyncio engine
+'''
+from flask import current_app
+from .models import Drink, MenuVersion
+from .controllers import menu_body, cached_response, page_args, page_columns, page_response
+from ..auth import requires_authorization_async
+from ..database import async_session, use_replica
+from app import db
+
+
+async def menu_response(name, format_drink):
+  '''
+    serves a menu listing from the cache with an etag, 304 if the client has it
+  '''
+  async with async_session() as session:
+    async def build():
+      drinks = (await session.execute(db.select(Drink))).scalars().all()
+      return menu_body(drinks, format_drink)
+    menu_cache = current_app.extensions['menu_cache']
+    version = await MenuVersion.current_async(session)
+    return cached_response(*await menu_cache.get_async(name, version, build))
+
+
+async def drinks_page(name, format_drink):
+  '''
+    drinks_page of controllers, the whole cached menu or a keyset page
+  '''
+  args = page_args()
+  if args is None:
+    return await menu_response(name, format_drink)
+  limit, after, fields = args
+  async with async_session() as session:
+    drinks = (await session.execute(db.select(Drink).options(page_columns(fields))
+      .where(Drink.id > after).order_by(Drink.id).limit(limit))).scalars().all()
+    return page_response(drinks, limit, fields, format_drink)
+
+
+@use_replica
+async def get_drinks():
+  return await drinks_page('drinks', Drink.short)
+
+
+@requires_authorization_async('get:drinks-detail')
+@use_replica
+async def get_drinks_detail(permission):
+  return await drinks_page('drinks-detail', Drink.format)
+
+
+# endpoint -> handler, run by app.asgi instead of the blueprint's view
+async_views = {
+  'drink.get_drinks': get_drinks,
+  'drink.get_drinks_detail': get_drinks_detail,
+}
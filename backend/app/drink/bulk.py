@@ -0,0 +1,282 @@
+'''
+  streaming bulk import of drinks, upserts by title in chunked transactions,
+  and streaming ndjson export of the whole catalogue
+'''
+import codecs
+import itertools
+import json
+import zlib
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from .models import Drink, MenuEvent, MenuVersion
+
+# rows per transaction
+CHUNK_SIZE = 1000
+# bytes read from the input at a time
+READ_SIZE = 64 * 1024
+# titles per IN query, below sqlite's bound parameter limit
+LOOKUP_SIZE = 500
+# per row problems listed in the report, the rest are only counted
+MAX_REPORTED = 1000
+# rows fetched from the db, and lines written out, at a time when exporting
+EXPORT_BATCH_SIZE = 1000
+
+
+class ImportFormatError(ValueError):
+  '''
+    the input isn't a json array or ndjson
+  '''
+
+
+def iter_text(stream):
+  '''
+    decodes a binary stream chunk by chunk
+  '''
+  decoder = codecs.getincrementaldecoder('utf-8')()
+  while True:
+    chunk = stream.read(READ_SIZE)
+    if not chunk:
+      tail = decoder.decode(b'', final=True)
+      if tail:
+        yield tail
+      return
+    yield decoder.decode(chunk)
+
+
+def iter_json_array(chunks, buffer):
+  '''
+    yields the items of a top level json array without loading all of it
+  '''
+  decoder = json.JSONDecoder()
+  position = buffer.index('[') + 1
+  eof = False
+  while True:
+    # skip whitespace and separators
+    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+      position += 1
+    if position < len(buffer) and buffer[position] == ']':
+      return
+    complete = False
+    if position < len(buffer):
+      try:
+        item, end = decoder.raw_decode(buffer, position)
+        # a value touching the end of the buffer may be cut (e.g. a number)
+        complete = end < len(buffer) or eof
+      except json.JSONDecodeError:
+        if eof:
+          raise ImportFormatError('invalid json array')
+    elif eof:
+      raise ImportFormatError('unterminated json array')
+    if not complete:
+      chunk = next(chunks, None)
+      if chunk is None:
+        eof = True
+      else:
+        buffer = buffer[position:] + chunk
+        position = 0
+      continue
+    yield item
+    position = end
+
+
+def iter_ndjson(chunks, buffer):
+  '''
+    yields the input line by line
+  '''
+  for chunk in itertools.chain([''], chunks):
+    buffer += chunk
+    lines = buffer.split('\n')
+    buffer = lines.pop()
+    for line in lines:
+      yield line
+  yield buffer
+
+
+def iter_drinks(stream):
+  '''
+    yields (row number, decoded item) from a json array or ndjson binary stream,
+    lines that aren't valid json are yielded as ImportFormatError instances
+  '''
+  chunks = iter_text(stream)
+  buffer = ''
+  # find the first non whitespace character to pick the format
+  for chunk in chunks:
+    buffer += chunk
+    if buffer.strip():
+      break
+  if buffer.lstrip().startswith('['):
+    for row, item in enumerate(iter_json_array(iter(chunks), buffer), start=1):
+      yield row, item
+    return
+  for row, line in enumerate(iter_ndjson(chunks, buffer), start=1):
+    if not line.strip():
+      continue
+    try:
+      yield row, json.loads(line)
+    except ValueError:
+      yield row, ImportFormatError('invalid json')
+
+
+def validate_drink(item):
+  '''
+    returns (title, recipe), raises ValueError with the reason
+  '''
+  if isinstance(item, ImportFormatError):
+    raise item
+  if not isinstance(item, dict) or 'title' not in item or 'recipe' not in item:
+    raise ValueError('title and recipe required')
+  title, recipe = item['title'], item['recipe']
+  if not isinstance(title, str) or not title.strip() or len(title) > 80:
+    raise ValueError('title must be 1 to 80 characters')
+  if isinstance(recipe, dict):
+    # same edge case as POST /drinks
+    recipe = [recipe]
+  if not isinstance(recipe, list):
+    raise ValueError('recipe must be a list')
+  return title, recipe
+
+
+class ImportReport:
+  '''
+    ImportReport
+    counts and per row problems of an import
+  '''
+  def __init__(self):
+    self.inserted = 0
+    self.updated = 0
+    self.conflicts = 0
+    self.invalid = 0
+    self.problems = []
+
+  def problem(self, row, title, error):
+    if len(self.problems) < MAX_REPORTED:
+      self.problems.append({'row': row, 'title': title, 'error': error})
+
+  def format(self):
+    return {
+      'inserted': self.inserted,
+      'updated': self.updated,
+      'conflicts': self.conflicts,
+      'invalid': self.invalid,
+      'errors': self.problems
+    }
+
+
+def dialect_insert():
+  name = db.engine.dialect.name
+  if name == 'sqlite':
+    return sqlite.insert
+  if name == 'postgresql':
+    return postgresql.insert
+  raise NotImplementedError('bulk import needs sqlite or postgresql, not {}'.format(name))
+
+
+def existing_titles(titles):
+  found = set()
+  titles = list(titles)
+  for start in range(0, len(titles), LOOKUP_SIZE):
+    batch = titles[start:start + LOOKUP_SIZE]
+    found.update(title for (title,) in
+      db.session.query(Drink.title).filter(Drink.title.in_(batch)))
+  return found
+
+
+def write_chunk(rows, update, report):
+  '''
+    writes one chunk of (row, title, recipe) in a single transaction
+  '''
+  # the last row wins for a title repeated inside the chunk
+  by_title = {}
+  for row, title, recipe in rows:
+    if title in by_title:
+      report.conflicts += 1
+      report.problem(by_title[title][0], title, 'duplicate title in input, later row used')
+    by_title[title] = (row, recipe)
+  existing = existing_titles(by_title)
+  table = Drink.__table__
+  statement = dialect_insert()(table)
+  if update:
+    statement = statement.on_conflict_do_update(
+      index_elements=[table.c.title],
+      set_={'recipe': statement.excluded.recipe, 'date_modified': func.current_timestamp()}
+    )
+  else:
+    statement = statement.on_conflict_do_nothing(index_elements=[table.c.title])
+    for title in existing:
+      report.conflicts += 1
+      report.problem(by_title[title][0], title, 'title already exists')
+  values = [{'title': title, 'recipe': recipe} for title, (row, recipe) in by_title.items()
+    if update or title not in existing]
+  try:
+    if values:
+      db.session.execute(statement, values).close()
+      MenuEvent.record('reload')
+      MenuVersion.bump()
+    db.session.commit()
+  except Exception:
+    db.session.rollback()
+    raise
+  report.updated += len(existing) if update else 0
+  report.inserted += len(by_title) - len(existing)
+
+
+def import_drinks(stream, update=True, chunk_size=CHUNK_SIZE):
+  '''
+    imports drinks from a binary stream of a json array or ndjson
+    Args:
+      stream: binary file like object
+      update (bool): replace the recipe of existing titles, else report them as conflicts
+      chunk_size (int): rows per transaction
+    returns an ImportReport
+  '''
+  report = ImportReport()
+  rows = []
+  for row, item in iter_drinks(stream):
+    try:
+      title, recipe = validate_drink(item)
+    except ValueError as error:
+      report.invalid += 1
+      report.problem(row, item.get('title') if isinstance(item, dict) else None, str(error))
+      continue
+    rows.append((row, title, recipe))
+    if len(rows) >= chunk_size:
+      write_chunk(rows, update, report)
+      rows = []
+  if rows:
+    write_chunk(rows, update, report)
+  return report
+
+
+def export_drinks(format_drink=Drink.format, batch_size=None):
+  '''
+    yields the whole catalogue as encoded ndjson, one drink per line
+    rows are fetched batch_size at a time (a server side cursor on postgres),
+    so memory doesn't grow with the table
+    Args:
+      format_drink (callable): drink to dict, e.g. Drink.short
+      batch_size (int): rows per fetch and per yielded chunk, defaults to EXPORT_BATCH_SIZE
+  '''
+  batch_size = batch_size or EXPORT_BATCH_SIZE
+  encoder = json.JSONEncoder(separators=(',', ':'))
+  lines = []
+  for drink in Drink.query.order_by(Drink.id).yield_per(batch_size):
+    lines.append(encoder.encode(format_drink(drink)))
+    if len(lines) >= batch_size:
+      yield ('\n'.join(lines) + '\n').encode('utf-8')
+      lines = []
+  if lines:
+    yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+  '''
+    gzips a stream of byte chunks as they come
+  '''
+  # wbits 31 writes the gzip header and trailer
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+  for chunk in chunks:
+    data = compressor.compress(chunk)
+    if data:
+      yield data
+  yield compressor.flush()
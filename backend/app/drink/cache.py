@@ -0,0 +1,65 @@
+'''
+  cache of serialized menu responses, keyed by the menu version in the db
+'''
+import threading
+
+
+class MenuCache:
+  '''
+    MenuCache
+    keeps the encoded json body of each menu listing for the current menu version,
+    with its compressed variants, a bumped version (any drink change, from any worker)
+    makes the entry stale
+  '''
+  def __init__(self):
+    self.stats = {'hits': 0, 'misses': 0}
+    self._entries = {}
+    self._lock = threading.Lock()
+
+  def get(self, name, version, build):
+    '''
+      gets the cached body of a listing, building it on a miss
+      Args:
+        name (str): listing name, e.g. drinks or drinks-detail
+        version (int): current menu version
+        build (callable): returns the encoded body
+      returns (body, etag, variants), variants is a dict of compressed bodies by encoding
+      kept with the entry
+    '''
+    entry = self._lookup(name, version)
+    if entry is not None:
+      return entry
+    return self._store(name, version, build())
+
+  async def get_async(self, name, version, build):
+    '''
+      get for coroutines, build is a coroutine function
+    '''
+    entry = self._lookup(name, version)
+    if entry is not None:
+      return entry
+    return self._store(name, version, await build())
+
+  def _lookup(self, name, version):
+    entry = self._entries.get(name)
+    if entry is not None and entry[0] == version:
+      self.stats['hits'] += 1
+      return entry[1], entry[2], entry[3]
+    self.stats['misses'] += 1
+    return None
+
+  def _store(self, name, version, body):
+    etag = '{}-{}'.format(name, version)
+    variants = {}
+    with self._lock:
+      current = self._entries.get(name)
+      # don't replace a newer entry built by another thread
+      if current is None or current[0] <= version:
+        self._entries[name] = (version, body, etag, variants)
+    return body, etag, variants
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      for stat in self.stats:
+        self.stats[stat] = 0
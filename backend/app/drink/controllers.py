@@ -1,9 +1,20 @@
 '''
   holds the blueprint routes for drink
 '''
-from flask import Blueprint,request, jsonify, abort
+from datetime import datetime, timedelta, timezone
+from os import environ as env
+from flask import Blueprint,request, jsonify, abort, current_app, stream_with_context
 import sqlalchemy
-from .models import Drink
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import load_only
+from .models import Drink, DrinkTombstone, MenuVersion, SYNC_RETENTION_DAYS
+from .cache import MenuCache
+from .events import EventBroker, StreamsFull, SSE_BUSY_RETRY
+from ..database import use_replica
+from ..encoding import encode_json, json_response
+from ..metrics import metrics
+from .bulk import import_drinks, export_drinks, ImportFormatError
+from .search import search as search_drinks
 # auth decorators
 from ..auth import requires_authentication, requires_authorization, AuthError
 from app import db 
@@ -11,6 +22,124 @@ from app import db
 # drink bp
 drink_bp = Blueprint('drink', __name__)
 
+
+@drink_bp.record_once
+def init_state(state):
+  '''
+    per app state, set up when the blueprint is registered on an app
+  '''
+  # encoded menu listings, rebuilt when the menu version changes
+  state.app.extensions['menu_cache'] = MenuCache()
+  # pushes drink changes to event stream clients
+  state.app.extensions['menu_events'] = EventBroker()
+
+
+# drink listing fields and page size limits
+DRINK_FIELDS = ('id', 'title', 'recipe')
+MAX_PAGE_SIZE = 500
+# search results per page when no limit is passed
+SEARCH_PAGE_SIZE = int(env.get('SEARCH_PAGE_SIZE', 20))
+# seconds before the since watermark that are sent again, sqlite timestamps
+# only have second resolution and a slow transaction may commit an older one late
+SYNC_OVERLAP = float(env.get('SYNC_OVERLAP', 1))
+# order of the changes sharing a timestamp, a drink deleted and created again comes back
+SYNC_KINDS = ('deleted', 'drinks')
+# sqlite keeps current_timestamp as text without a fraction of a second, positions
+# are compared in the same format so changes sharing a second match
+SYNC_STAMP = db.DateTime().with_variant(sqlite.DATETIME(
+  storage_format='%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d'), 'sqlite')
+
+
+def menu_body(drinks, format_drink):
+  '''
+    encoded body of a menu listing, kept by the menu cache
+  '''
+  return encode_json({
+    'success': True,
+    'drinks': [format_drink(drink) for drink in drinks]
+  })
+
+
+def cached_response(body, etag, variants):
+  '''
+    response of a cached menu listing, 304 if the client has it
+  '''
+  # already encoded
+  response = json_response(body)
+  # compressed once per menu version and encoding
+  response.precompressed = variants
+  response.set_etag(etag)
+  # answers If-None-Match with 304
+  return response.make_conditional(request)
+
+
+def menu_response(name, format_drink):
+  '''
+    serves a menu listing from the cache with an etag, 304 if the client has it
+  '''
+  def build():
+    return menu_body(Drink.query.all(), format_drink)
+  menu_cache = current_app.extensions['menu_cache']
+  return cached_response(*menu_cache.get(name, MenuVersion.current(), build))
+
+
+def page_args():
+  '''
+    limit, after and fields of a drinks page from the query string, None for the whole menu,
+    aborts with 400 on bad values
+  '''
+  if not any(arg in request.args for arg in ('limit', 'after', 'fields')):
+    return None
+  try:
+    limit = int(request.args.get('limit', MAX_PAGE_SIZE))
+    after = int(request.args.get('after', 0))
+  except ValueError:
+    abort(400, 'limit and after must be integers')
+  if limit < 1 or limit > MAX_PAGE_SIZE:
+    abort(400, 'limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+  fields = request.args.get('fields')
+  fields = [field.strip() for field in fields.split(',')] if fields else list(DRINK_FIELDS)
+  unknown = [field for field in fields if field not in DRINK_FIELDS]
+  if unknown:
+    abort(400, 'unknown fields: {}'.format(', '.join(unknown)))
+  if 'id' not in fields:
+    # needed for the cursor
+    fields.insert(0, 'id')
+  return limit, after, fields
+
+
+def page_columns(fields):
+  # columns not asked for (e.g. the recipe blob) are never loaded
+  return load_only(*[getattr(Drink, field) for field in fields])
+
+
+def page_response(drinks, limit, fields, format_drink):
+  if fields == list(DRINK_FIELDS):
+    formatted = [format_drink(drink) for drink in drinks]
+  else:
+    formatted = [{field: getattr(drink, field) for field in fields} for drink in drinks]
+  return jsonify({
+    'success': True,
+    'drinks': formatted,
+    # cursor for the next page, None on the last one
+    'next': drinks[-1].id if len(drinks) == limit else None
+  })
+
+
+def drinks_page(name, format_drink):
+  '''
+    drink listing, the whole cached menu unless limit/after/fields are passed
+    limit & after page on id (keyset), fields picks the columns loaded from the db
+  '''
+  args = page_args()
+  if args is None:
+    return menu_response(name, format_drink)
+  limit, after, fields = args
+  drinks = Drink.query.options(page_columns(fields)) \
+    .filter(Drink.id > after).order_by(Drink.id).limit(limit).all()
+  return page_response(drinks, limit, fields, format_drink)
+
+
 @drink_bp.route('/drink/test')
 def test():
   # test
@@ -19,24 +148,173 @@ def test():
 
 @drink_bp.route('/drinks', methods=['GET'])
 # @requires_authentication
+@use_replica
 def get_drinks():
-  drinks = Drink.query.all()
+  return drinks_page('drinks', Drink.short)
+  
+
+def parse_sync_token(token):
+  '''
+    (timestamp, kind, id) position of a next token, kind and id are None for the
+    timestamp of a caught up response, which is moved back by SYNC_OVERLAP,
+    timestamps with an offset are taken as utc like the stored ones
+  '''
+  stamp, _, position = token.partition(',')
+  try:
+    stamp = datetime.fromisoformat(stamp)
+    if stamp.tzinfo is not None:
+      stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    if not position:
+      return stamp - timedelta(seconds=SYNC_OVERLAP), None, None
+    kind, id = position.split(',')
+    if kind not in SYNC_KINDS:
+      raise ValueError(kind)
+    return stamp, kind, int(id)
+  except ValueError:
+    abort(400, 'since must be the next token of a previous response')
+
+
+def changed_after(stamp_column, id_column, kind, position):
+  '''
+    filter of the rows of one kind after a position, changes are ordered by
+    timestamp, then deletes before drinks, then id
+  '''
+  stamp, after_kind, after_id = position
+  stamp = db.literal(stamp, SYNC_STAMP)
+  if after_kind is None or SYNC_KINDS.index(kind) < SYNC_KINDS.index(after_kind):
+    return stamp_column > stamp
+  if kind != after_kind:
+    return stamp_column >= stamp
+  return db.or_(stamp_column > stamp, db.and_(stamp_column == stamp, id_column > after_id))
+
+
+@drink_bp.route('/drinks/changes', methods=['GET'])
+# @requires_authentication
+def get_drink_changes():
+  '''
+    up to limit drinks created or updated and ids of drinks deleted since a previous response's next token,
+    everything without since, more is true while the following changes need another call with next,
+    a few changes right before the token of a caught up response can be sent again
+  '''
+  since = request.args.get('since')
+  try:
+    limit = int(request.args.get('limit', MAX_PAGE_SIZE))
+  except ValueError:
+    abort(400, 'limit must be an integer')
+  if limit < 1 or limit > MAX_PAGE_SIZE:
+    abort(400, 'limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+  drinks = Drink.query
+  tombstones = DrinkTombstone.query
+  if since:
+    position = parse_sync_token(since)
+    if position[0] < DrinkTombstone.cutoff():
+      # deletes this old are pruned
+      abort(410, 'since is older than {:g} days, fetch the whole menu again'.format(SYNC_RETENTION_DAYS))
+    drinks = drinks.filter(changed_after(Drink.date_modified, Drink.id, 'drinks', position))
+    tombstones = tombstones.filter(changed_after(DrinkTombstone.deleted_at, DrinkTombstone.id, 'deleted', position))
+  # one more than a page of each, merged in change order
+  changes = [(drink.date_modified, 'drinks', drink.id, drink)
+    for drink in drinks.order_by(Drink.date_modified, Drink.id).limit(limit + 1)] + \
+    [(tombstone.deleted_at, 'deleted', tombstone.id, tombstone)
+    for tombstone in tombstones.order_by(DrinkTombstone.deleted_at, DrinkTombstone.id).limit(limit + 1)]
+  changes.sort(key=lambda change: (change[0], SYNC_KINDS.index(change[1]), change[2]))
+  more = len(changes) > limit
+  changes = changes[:limit]
+  drinks = [change[3] for change in changes if change[1] == 'drinks']
+  # a deleted id can be reused by a newer drink
+  ids = {drink.id for drink in drinks}
+  deleted = {change[3].drink_id for change in changes if change[1] == 'deleted'} - ids
+  if more:
+    # continues right after the last change sent
+    stamp, kind, id, _ = changes[-1]
+    token = '{},{},{}'.format(stamp.isoformat(), kind, id)
+  elif changes:
+    token = max(change[0] for change in changes).isoformat()
+  else:
+    # unchanged if nothing changed
+    token = since.partition(',')[0] if since else since
   return jsonify({
     'success': True,
-    'drinks': [drink.short() for drink in drinks]
+    'drinks': [drink.short() for drink in drinks],
+    'deleted': sorted(deleted),
+    'next': token,
+    'more': more
   })
-  
 
-@drink_bp.route('/drinks-detail', methods=['GET'])
-@requires_authorization('get:drinks-detail')
-def get_drinks_detail(permission):
-  drinks = Drink.query.all()
+
+@drink_bp.route('/drinks/search', methods=['GET'])
+# @requires_authentication
+@use_replica
+def get_drinks_search():
+  '''
+    drinks whose title or ingredients have words starting with every word of q, best match first,
+    limit & offset page through the matches
+  '''
+  query = request.args.get('q', '')
+  try:
+    limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+    offset = int(request.args.get('offset', 0))
+  except ValueError:
+    abort(400, 'limit and offset must be integers')
+  if limit < 1 or limit > MAX_PAGE_SIZE:
+    abort(400, 'limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+  if offset < 0:
+    abort(400, 'offset must not be negative')
+  if not query.strip():
+    abort(400, 'q is required')
+  drinks = search_drinks(query, limit, offset)
   return jsonify({
     'success': True,
-    'drinks': [drink.format() for drink in drinks]
+    'drinks': [drink.short() for drink in drinks],
+    # offset of the next page, None on the last one
+    'next': offset + limit if len(drinks) == limit else None
   })
+
+
+@drink_bp.route('/drinks/events', methods=['GET'])
+# @requires_authentication
+def get_drink_events():
+  '''
+    server sent events of drink changes, replays missed events after Last-Event-ID
+  '''
+  last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+  try:
+    last_id = int(last_id) if last_id else None
+  except ValueError:
+    abort(400, 'Last-Event-ID must be an event id')
+  menu_events = current_app.extensions['menu_events']
+  menu_events.start(current_app._get_current_object())
+  try:
+    subscription, backlog = menu_events.subscribe(last_id)
+  except StreamsFull:
+    # an error would stop EventSource for good, a stream that ends right away makes it come back later
+    return current_app.response_class('retry: {}\n\n'.format(SSE_BUSY_RETRY), mimetype='text/event-stream',
+      headers={'Cache-Control': 'no-cache'})
+  # the stream doesn't touch the db, don't hold a pooled connection for it
+  db.session.remove()
+  return current_app.response_class(menu_events.stream(subscription, backlog),
+    mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@drink_bp.route('/drinks-detail', methods=['GET'])
+@requires_authorization('get:drinks-detail')
+@use_replica
+def get_drinks_detail(permission):
+  return drinks_page('drinks-detail', Drink.format)
   
 
+@drink_bp.route('/drinks/export', methods=['GET'])
+@requires_authorization('get:drinks-detail')
+@use_replica
+def get_drinks_export(permission):
+  '''
+    streams every drink as ndjson, compressed when the client accepts it
+  '''
+  # keeps the db session of the request open until the last line is sent
+  return current_app.response_class(stream_with_context(export_drinks()),
+    mimetype='application/x-ndjson')
+
+
 @drink_bp.route('/drinks', methods=['POST'])
 @requires_authorization('post:drinks')
 def post_drink(permission):
@@ -73,6 +351,30 @@ def post_drink(permission):
   }), 201
   
   
+@drink_bp.route('/drinks/bulk', methods=['POST'])
+@requires_authorization('post:drinks')
+def post_drinks_bulk(permission):
+  '''
+    imports a json array or ndjson body of drinks, streamed and written in chunks
+    existing titles are updated unless ?mode=insert, which reports them as conflicts
+  '''
+  mode = request.args.get('mode', 'upsert')
+  if mode not in ('upsert', 'insert'):
+    abort(400, 'mode must be upsert or insert')
+  try:
+    report = import_drinks(request.stream, update=mode == 'upsert')
+  except ImportFormatError as e:
+    # chunks before the bad input are already committed
+    abort(400, str(e))
+  except Exception as e:
+    print(e)
+    db.session.rollback()
+    abort(500, "Internal server error")
+  finally:
+    db.session.close()
+  return jsonify(dict(report.format(), success=True)), 200
+
+
 @drink_bp.route('/drinks/<int:id>', methods=['PATCH'])
 @requires_authorization('patch:drinks')
 def patch_drink(permission, id):
@@ -213,6 +515,7 @@ Example error handling for unprocessable entity
 
 @drink_bp.errorhandler(AuthError)
 def handle_auth_error(exception):
+  metrics.inc('auth_errors_total', {'error': exception.error, 'code': exception.code})
   return jsonify({
     'success': False,
     'code': exception.code,
@@ -252,6 +555,16 @@ def handle_400(error):
   }), 400
 
 
+@drink_bp.errorhandler(410)
+def handle_410(error):
+  # Gone
+  return jsonify({
+      "success": False,
+      "message": error.description if error.description is not None else "Gone",
+      "error": 410
+  }), 410
+
+
 @drink_bp.errorhandler(405)
 def handle_405(error):
   # Method Not Allowed
@@ -0,0 +1,235 @@
+'''
+  server sent events of menu changes, read from the menu_events table by one
+  poller thread per process and fanned out to every connected client
+'''
+import json
+import queue
+import threading
+import time
+from os import environ as env
+from app import db
+from .models import MenuEvent
+
+# seconds between reads of new events
+SSE_POLL_INTERVAL = float(env.get('SSE_POLL_INTERVAL', 0.5))
+# seconds without events before a keep alive comment is sent
+SSE_HEARTBEAT = float(env.get('SSE_HEARTBEAT', 15))
+# events buffered per client, a client that falls further behind is disconnected
+SSE_CLIENT_BUFFER = int(env.get('SSE_CLIENT_BUFFER', 100))
+# seconds an event id missing below newer ones is waited for, ids are taken when a row is
+# inserted but seen when its transaction commits, on postgres a later id can commit first,
+# an id still missing after this is taken as a rolled back write
+SSE_GAP_TIMEOUT = float(env.get('SSE_GAP_TIMEOUT', 5))
+# open streams per process, 0 for no limit, each holds a server thread until its client leaves,
+# keep it below the threads of a worker so other requests still get one, gunicorn.conf.py sets it
+SSE_MAX_CLIENTS = int(env.get('SSE_MAX_CLIENTS', 0))
+# ms a client turned away by SSE_MAX_CLIENTS waits before it reconnects
+SSE_BUSY_RETRY = int(env.get('SSE_BUSY_RETRY', 10000))
+# events read per query
+EVENT_BATCH_SIZE = 500
+
+
+def format_event(event):
+  '''
+    encodes an event dict as a server sent event
+  '''
+  return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+    event['id'], event['kind'], json.dumps(event['data'], separators=(',', ':')))
+
+
+class StreamsFull(Exception):
+  '''
+    raised by subscribe when max_clients streams are open
+  '''
+
+
+class Subscription:
+  '''
+    Subscription
+    bounded buffer of events for one client
+  '''
+  def __init__(self, size, last_id):
+    self.events = queue.Queue(maxsize=size)
+    # newest event id the client has, older ones are skipped
+    self.last_id = last_id
+    self.dropped = False
+
+
+class EventBroker:
+  '''
+    EventBroker
+    a single poller thread, started with the first subscriber, reads new events
+    and puts them in the buffer of every subscriber, in id order without gaps,
+    so a client resuming after an id has every event before it
+    Args:
+      poll_interval (float): seconds between reads
+      buffer_size (int): events buffered per subscriber
+      gap_timeout (float): seconds a missing id holds back the events after it
+      max_clients (int): open streams at most, 0 for no limit
+  '''
+  def __init__(self, poll_interval=None, buffer_size=None, gap_timeout=None, max_clients=None):
+    self.poll_interval = poll_interval or SSE_POLL_INTERVAL
+    self.buffer_size = buffer_size or SSE_CLIENT_BUFFER
+    self.gap_timeout = SSE_GAP_TIMEOUT if gap_timeout is None else gap_timeout
+    self.max_clients = SSE_MAX_CLIENTS if max_clients is None else max_clients
+    self.last_id = None
+    self.stats = {'polls': 0, 'published': 0, 'dropped': 0, 'errors': 0, 'skipped': 0, 'rejected': 0}
+    # first missing id -> when the poller first saw newer events past it
+    self._gaps = {}
+    self._subscribers = set()
+    self._app = None
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def fetch(self, after, limit=EVENT_BATCH_SIZE, upto=None):
+    '''
+      events with an id above after, and up to upto if given, oldest first
+    '''
+    table = MenuEvent.__table__
+    query = db.select(table.c.id, table.c.kind, table.c.data).where(table.c.id > after)
+    if upto is not None:
+      query = query.where(table.c.id <= upto)
+    with db.engine.connect() as connection:
+      rows = connection.execute(query.order_by(table.c.id).limit(limit)).fetchall()
+    return [{'id': row.id, 'kind': row.kind, 'data': row.data} for row in rows]
+
+  def latest(self):
+    '''
+      (oldest, newest) event id kept in the db, 0 if there are none
+    '''
+    table = MenuEvent.__table__
+    with db.engine.connect() as connection:
+      row = connection.execute(db.select(db.func.min(table.c.id), db.func.max(table.c.id))).one()
+    return row[0] or 0, row[1] or 0
+
+  def start(self, app):
+    '''
+      starts the poller for app once, call from a request
+    '''
+    if self._thread is not None:
+      return
+    with self._lock:
+      if self._thread is None:
+        self._app = app
+        self.last_id = self.latest()[1]
+        self._thread = threading.Thread(target=self._run, daemon=True, name='menu-events')
+        self._thread.start()
+
+  def subscribe(self, last_id=None):
+    '''
+      registers a client, returns (subscription, backlog), raises StreamsFull if
+      max_clients streams are open
+      Args:
+        last_id (int): Last-Event-ID of a reconnecting client, the events after it are
+          in the backlog, or a single reload event if they were pruned
+    '''
+    with self._lock:
+      if self.max_clients and len(self._subscribers) >= self.max_clients:
+        self.stats['rejected'] += 1
+        raise StreamsFull()
+      polled = self.last_id
+      # a client can be ahead of this process' poller
+      subscription = Subscription(self.buffer_size, max(polled, last_id or 0))
+      self._subscribers.add(subscription)
+    if last_id is None or last_id >= polled:
+      return subscription, []
+    oldest, newest = self.latest()
+    if last_id < oldest - 1:
+      # missed events are gone, the client has to fetch the menu
+      return subscription, [{'id': newest, 'kind': 'reload', 'data': None}]
+    backlog = []
+    while True:
+      # newer events may be behind a gap, the poller publishes them once it's closed
+      events = self.fetch(backlog[-1]['id'] if backlog else last_id, upto=polled)
+      backlog.extend(events)
+      if len(events) < EVENT_BATCH_SIZE:
+        return subscription, backlog
+
+  def unsubscribe(self, subscription):
+    with self._lock:
+      self._subscribers.discard(subscription)
+
+  def publish(self, events):
+    '''
+      puts events in every subscriber's buffer, dropping subscribers that are full
+    '''
+    with self._lock:
+      subscribers = list(self._subscribers)
+    for subscription in subscribers:
+      for event in events:
+        try:
+          subscription.events.put_nowait(event)
+        except queue.Full:
+          # reconnects with Last-Event-ID and catches up from the db
+          subscription.dropped = True
+          self.unsubscribe(subscription)
+          self.stats['dropped'] += 1
+          break
+    self.stats['published'] += len(events)
+
+  def contiguous(self, events, now):
+    '''
+      the events up to the first id that is missing and still waited for
+    '''
+    ready = []
+    expected = self.last_id + 1
+    for event in events:
+      if event['id'] != expected:
+        # ids expected .. event id - 1 aren't committed (yet)
+        if now - self._gaps.setdefault(expected, now) < self.gap_timeout:
+          break
+        self.stats['skipped'] += event['id'] - expected
+      ready.append(event)
+      expected = event['id'] + 1
+    return ready
+
+  def poll(self):
+    '''
+      reads and publishes the events written since the last poll
+    '''
+    self.stats['polls'] += 1
+    now = time.monotonic()
+    while True:
+      events = self.fetch(self.last_id)
+      ready = self.contiguous(events, now)
+      if ready:
+        self.last_id = ready[-1]['id']
+        self._gaps = {id: since for id, since in self._gaps.items() if id > self.last_id}
+        self.publish(ready)
+      if len(ready) < len(events) or len(events) < EVENT_BATCH_SIZE:
+        return
+
+  def stream(self, subscription, backlog, heartbeat=None):
+    '''
+      yields the encoded backlog then live events until the client disconnects or is dropped
+    '''
+    heartbeat = heartbeat or SSE_HEARTBEAT
+    try:
+      # sends the headers right away
+      yield ': connected\n\n'
+      for event in backlog:
+        subscription.last_id = max(subscription.last_id, event['id'])
+        yield format_event(event)
+      while not subscription.dropped:
+        try:
+          event = subscription.events.get(timeout=heartbeat)
+        except queue.Empty:
+          yield ': heartbeat\n\n'
+          continue
+        if event['id'] <= subscription.last_id:
+          # already sent from the backlog
+          continue
+        subscription.last_id = event['id']
+        yield format_event(event)
+    finally:
+      self.unsubscribe(subscription)
+
+  def _run(self):
+    with self._app.app_context():
+      while True:
+        time.sleep(self.poll_interval)
+        try:
+          self.poll()
+        except Exception as error:
+          print(error)
+          self.stats['errors'] += 1
@@ -1,8 +1,16 @@
 '''
   Models for drink
 '''
+from datetime import datetime, timedelta
+from os import environ as env
+from sqlalchemy.dialects import postgresql
 from app import db
 
+# newest menu events kept for clients resuming with Last-Event-ID
+MENU_EVENTS_KEEP = int(env.get('MENU_EVENTS_KEEP', 1000))
+# days deletes are kept for delta sync clients, older since tokens must reload the menu
+SYNC_RETENTION_DAYS = float(env.get('SYNC_RETENTION_DAYS', 30))
+
 # Define a base model for other database tables to inherit
 class Base(db.Model):
   '''
@@ -16,14 +24,114 @@ class Base(db.Model):
                                 onupdate=db.func.current_timestamp())
 
 
+class MenuVersion(db.Model):
+  '''
+    MenuVersion Model
+    single row counter bumped by every drink change, shared by all workers
+    so cached menus can tell when they are stale
+  '''
+  __tablename__ = 'menu_version'
+
+  id = db.Column(db.Integer, primary_key=True)
+  version = db.Column(db.Integer, nullable=False, default=0)
+
+  @classmethod
+  def current(cls):
+    version = db.session.query(cls.version).filter(cls.id == 1).scalar()
+    return version or 0
+
+  @classmethod
+  async def current_async(cls, session):
+    '''
+      current for an asyncio session of the async serving mode
+    '''
+    version = (await session.execute(db.select(cls.version).where(cls.id == 1))).scalar()
+    return version or 0
+
+  @classmethod
+  def bump(cls):
+    '''
+      increments the version in the current transaction, commit with the drink change
+    '''
+    updated = db.session.query(cls).filter(cls.id == 1) \
+      .update({cls.version: cls.version + 1}, synchronize_session=False)
+    if not updated:
+      db.session.add(cls(id=1, version=1))
+
+
+class MenuEvent(db.Model):
+  '''
+    MenuEvent Model
+    drink changes pushed to event stream subscribers, written in the same transaction
+    as the change so every worker process can read them in id order
+  '''
+  __tablename__ = 'menu_events'
+  # ids are never reused after old events are pruned
+  __table_args__ = {'sqlite_autoincrement': True}
+
+  id = db.Column(db.Integer, primary_key=True)
+  # created, updated, deleted or reload (many drinks changed, fetch the menu again)
+  kind = db.Column(db.String(16), nullable=False)
+  data = db.Column(db.JSON, nullable=True)
+  date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+  @classmethod
+  def record(cls, kind, drink=None):
+    '''
+      adds an event to the current transaction, commit with the drink change
+    '''
+    if drink is None:
+      data = None
+    elif kind == 'deleted':
+      data = {'id': drink.id}
+    else:
+      data = drink.short()
+    db.session.add(cls(kind=kind, data=data))
+    # drop events older than the newest MENU_EVENTS_KEEP
+    newest = db.session.query(db.func.max(cls.id)).scalar_subquery()
+    db.session.query(cls).filter(cls.id <= newest - MENU_EVENTS_KEEP) \
+      .delete(synchronize_session=False)
+
+
+class DrinkTombstone(db.Model):
+  '''
+    DrinkTombstone Model
+    id of a deleted drink, lets delta sync clients drop it
+  '''
+  __tablename__ = 'drink_tombstones'
+
+  id = db.Column(db.Integer, primary_key=True)
+  drink_id = db.Column(db.Integer, nullable=False)
+  deleted_at = db.Column(db.DateTime, nullable=False, index=True,
+    default=db.func.current_timestamp())
+
+  @classmethod
+  def cutoff(cls):
+    '''
+      tombstones deleted before this are pruned, sqlite's current_timestamp is utc
+    '''
+    return datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS)
+
+  @classmethod
+  def prune(cls):
+    '''
+      drops tombstones older than the retention period in the current transaction
+    '''
+    cls.query.filter(cls.deleted_at < cls.cutoff()).delete(synchronize_session=False)
+
+
 class Drink(Base):
   '''
     Drink Model
   '''
   __tablename__ = 'drinks'
+  # delta sync scans changes after a watermark
+  __table_args__ = (db.Index('ix_drinks_date_modified', 'date_modified'),)
 
   title = db.Column(db.String(80), nullable=False, unique=True)
-  recipe = db.Column(db.PickleType, default=[], nullable=False)
+  # list of {name, color, parts}, jsonb on postgres
+  recipe = db.Column(db.JSON().with_variant(postgresql.JSONB(), 'postgresql'),
+    default=list, nullable=False)
 
   def __init__(self, title, recipe):
     self.title = title
@@ -41,6 +149,10 @@ class Drink(Base):
 
   def insert(self):
     db.session.add(self)
+    # the event needs the new id
+    db.session.flush()
+    MenuEvent.record('created', self)
+    MenuVersion.bump()
     db.session.commit()
     return self
 
@@ -55,6 +167,10 @@ class Drink(Base):
 
   def delete(self):
     db.session.delete(self)
+    db.session.add(DrinkTombstone(drink_id=self.id))
+    DrinkTombstone.prune()
+    MenuEvent.record('deleted', self)
+    MenuVersion.bump()
     db.session.commit()
 
   '''
@@ -68,11 +184,12 @@ class Drink(Base):
   '''
 
   def update(self):
+    MenuEvent.record('updated', self)
+    MenuVersion.bump()
     db.session.commit()
     return self
   
   def short(self):
-    print(self.recipe)
     # short_recipe = [
     #   {'color': rec['color'], 'parts': rec['parts']} for rec in self.recipe
     # ]
@@ -0,0 +1,175 @@
+'''
+  full text search over drink titles and recipe ingredient names, prefix matching
+  and ranked results, title matches rank above ingredient matches
+    queries matching more than SEARCH_RANK_LIMIT drinks (e.g. a single letter) aren't ranked,
+    ranking reads every match, drinks with the words in the title come first, then by id
+    sqlite: fts5 table drinks_search, kept in sync by triggers on drinks, so
+      Drink.insert/update/delete, the bulk import and dbrows drop all update it
+    postgresql: gin index on a tsvector expression of the drinks row, nothing to keep in sync
+'''
+import re
+from os import environ as env
+from sqlalchemy import event, text
+from app import db
+from .models import Drink
+
+# ranking weight of a title match against an ingredient match
+SEARCH_TITLE_WEIGHT = float(env.get('SEARCH_TITLE_WEIGHT', 10))
+# most matches ranked, about 4 ms on sqlite
+SEARCH_RANK_LIMIT = int(env.get('SEARCH_RANK_LIMIT', 2000))
+# words of a query used, the rest are ignored
+MAX_TERMS = 8
+# what the tokenizers index as a word, sqlite's unicode61 splits on underscores too
+WORD = re.compile(r'[^\W_]+')
+
+# names of the recipe items, recipes are a list of {name, color, parts} (or a single one)
+SQLITE_INGREDIENTS = '''(SELECT group_concat(value, ' ') FROM json_tree({row}.recipe)
+  WHERE key = 'name' AND type = 'text')'''
+SQLITE_SYNC = '''
+  INSERT INTO drinks_search (rowid, title, ingredients)
+  VALUES (new.id, new.title, {ingredients});'''.format(ingredients=SQLITE_INGREDIENTS.format(row='new'))
+SQLITE_INSTALL = [
+  # prefix indexes keep 1 to 3 letter prefixes (e.g. "la" for latte) cheap
+  '''CREATE VIRTUAL TABLE IF NOT EXISTS drinks_search USING fts5(title, ingredients,
+  tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')''',
+  'CREATE TRIGGER IF NOT EXISTS drinks_search_insert AFTER INSERT ON drinks BEGIN' + SQLITE_SYNC + '\nEND',
+  # only title and recipe are indexed, date_modified changes don't touch the index
+  '''CREATE TRIGGER IF NOT EXISTS drinks_search_update AFTER UPDATE OF title, recipe ON drinks BEGIN
+  DELETE FROM drinks_search WHERE rowid = old.id;''' + SQLITE_SYNC + '\nEND',
+  '''CREATE TRIGGER IF NOT EXISTS drinks_search_delete AFTER DELETE ON drinks BEGIN
+  DELETE FROM drinks_search WHERE rowid = old.id;
+END''',
+]
+SQLITE_REBUILD = [
+  'DELETE FROM drinks_search',
+  'INSERT INTO drinks_search (rowid, title, ingredients) SELECT id, title, {} FROM drinks'
+    .format(SQLITE_INGREDIENTS.format(row='drinks')),
+  # merges the index segments written row by row into one
+  "INSERT INTO drinks_search (drinks_search) VALUES ('optimize')",
+]
+SQLITE_QUERIES = {
+  'count': 'SELECT count(*) FROM drinks_search WHERE drinks_search MATCH :query',
+  'ranked': '''SELECT rowid FROM drinks_search WHERE drinks_search MATCH :query
+  ORDER BY bm25(drinks_search, :title_weight, 1.0), rowid LIMIT :limit OFFSET :offset''',
+  # matches come in rowid order, stops after the page
+  'page': '''SELECT rowid FROM drinks_search WHERE drinks_search MATCH :query
+  ORDER BY rowid LIMIT :limit OFFSET :offset''',
+}
+
+# the 'simple' config doesn't stem or drop stop words, so prefixes of any word match,
+# lax jsonpath also reads a recipe stored as a single object
+POSTGRES_VECTOR = '''(setweight(to_tsvector('simple', title), 'A') ||
+  setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(recipe, '$[*].name')::text, '')), 'B'))'''
+POSTGRES_INSTALL = [
+  'CREATE INDEX IF NOT EXISTS ix_drinks_search ON drinks USING gin ({})'.format(POSTGRES_VECTOR),
+]
+POSTGRES_REBUILD = ['REINDEX INDEX ix_drinks_search']
+POSTGRES_QUERIES = {
+  'count': "SELECT count(*) FROM drinks WHERE {vector} @@ to_tsquery('simple', :query)",
+  # ts_rank weights are {D, C, B, A}
+  'ranked': '''SELECT id FROM drinks WHERE {vector} @@ to_tsquery('simple', :query)
+  ORDER BY ts_rank(CAST(ARRAY[0, 0, 1.0 / :title_weight, 1.0] AS real[]), {vector}, to_tsquery('simple', :query)) DESC, id
+  LIMIT :limit OFFSET :offset''',
+  'page': '''SELECT id FROM drinks WHERE {vector} @@ to_tsquery('simple', :query)
+  ORDER BY id LIMIT :limit OFFSET :offset''',
+}
+POSTGRES_QUERIES = {name: statement.format(vector=POSTGRES_VECTOR) for name, statement in POSTGRES_QUERIES.items()}
+
+
+def dialect_name(bind):
+  name = bind.dialect.name
+  if name not in ('sqlite', 'postgresql'):
+    raise NotImplementedError('drink search needs sqlite or postgresql, not {}'.format(name))
+  return name
+
+
+def install(bind):
+  '''
+    creates the search table and triggers or the index when they're missing
+  '''
+  statements = SQLITE_INSTALL if dialect_name(bind) == 'sqlite' else POSTGRES_INSTALL
+  for statement in statements:
+    bind.execute(text(statement))
+
+
+@event.listens_for(Drink.__table__, 'after_create')
+def create_index(target, connection, **kw):
+  if connection.dialect.name in ('sqlite', 'postgresql'):
+    install(connection)
+
+
+@event.listens_for(Drink.__table__, 'after_drop')
+def drop_index(target, connection, **kw):
+  # the triggers and the postgresql index go with the table
+  if connection.dialect.name == 'sqlite':
+    connection.execute(text('DROP TABLE IF EXISTS drinks_search'))
+
+
+def rebuild():
+  '''
+    reindexes every drink, e.g. after a migration rebuilt the drinks table without
+    the triggers, returns the number of drinks, commit after
+  '''
+  connection = db.session.connection()
+  install(connection)
+  statements = SQLITE_REBUILD if dialect_name(connection) == 'sqlite' else POSTGRES_REBUILD
+  for statement in statements:
+    connection.execute(text(statement))
+  return db.session.query(db.func.count(Drink.id)).scalar()
+
+
+def query_terms(query):
+  '''
+    lowercased words of the query, punctuation and operators are dropped so any
+    input makes a valid search
+  '''
+  return WORD.findall(query.lower())[:MAX_TERMS]
+
+
+def match_expressions(terms, dialect):
+  '''
+    (every term in the title or ingredients, every term in the title, the matches of the
+    first without the second), each term matches the start of a word
+  '''
+  if dialect == 'sqlite':
+    every = ' '.join('"{}"*'.format(term) for term in terms)
+    title = '{{title}} : ({})'.format(every)
+    return every, title, '({}) NOT ({})'.format(every, title)
+  every = ' & '.join('{}:*'.format(term) for term in terms)
+  # A is the weight of the title lexemes
+  title = ' & '.join('{}:*A'.format(term) for term in terms)
+  return every, title, '({}) & !({})'.format(every, title)
+
+
+def search(query, limit, offset=0):
+  '''
+    drinks matching every word of the query as a prefix, best match first
+    Args:
+      query (str): words of a title or ingredient, e.g. "van lat"
+      limit (int): drinks returned
+      offset (int): matches skipped, for the following pages
+  '''
+  terms = query_terms(query)
+  if not terms:
+    return []
+  dialect = dialect_name(db.session.get_bind())
+  statements = SQLITE_QUERIES if dialect == 'sqlite' else POSTGRES_QUERIES
+  every, title, rest = match_expressions(terms, dialect)
+
+  def run(name, match, limit=limit, offset=offset):
+    return db.session.execute(text(statements[name]), {'query': match,
+      'title_weight': SEARCH_TITLE_WEIGHT, 'limit': limit, 'offset': offset}).scalars().all()
+
+  if run('count', every)[0] <= SEARCH_RANK_LIMIT:
+    ids = run('ranked', every)
+  else:
+    # title matches first, the ingredient matches continue where they end
+    in_title = run('count', title)[0]
+    ids = run('page', title) if offset < in_title else []
+    if len(ids) < limit:
+      ids += run('page', rest, limit - len(ids), max(offset - in_title, 0))
+  if not ids:
+    return []
+  drinks = {drink.id: drink for drink in Drink.query.filter(Drink.id.in_(ids))}
+  # in rank order, a drink deleted in between is left out
+  return [drinks[id] for id in ids if id in drinks]
@@ -1,40 +1,526 @@
 '''
   holds test cases for the auth module
 '''
+import importlib.util
+import io
+import json
 import unittest
-from app import app, db
+import uuid
+from unittest.mock import patch
+from app.testing import app, db, TransactionTestCase
 
-class DrinkTestCase(unittest.TestCase):
+class DrinkTestCase(TransactionTestCase):
   '''
-    base class for drink tests
+    base class for drink tests, each test is rolled back
   '''
-  def setUp(self):
+  def test_get_drinks(self):
     '''
-      set up
-      Define test variables and initialize app.
+      test get drinks
+    '''
+    result = self.client().get('/api/drinks')
+    self.assertEqual(result.status_code, 200)
+    self.assertIn('drinks', result.json)
+
+  def test_get_drinks_etag(self):
+    '''
+      test the menu is served with an etag and 304 when unchanged
+    '''
+    result = self.client().get('/api/drinks')
+    etag = result.headers['ETag']
+    self.assertTrue(etag)
+    result = self.client().get('/api/drinks', headers={'If-None-Match': etag})
+    self.assertEqual(result.status_code, 304)
+    self.assertEqual(result.data, b'')
+
+  def test_drink_change_invalidates_menu(self):
+    '''
+      test a new drink changes the etag and shows up in the menu
     '''
+    from .models import Drink
+    etag = self.client().get('/api/drinks').headers['ETag']
+    with self.app.app_context():
+      drink = Drink(title='etag test {}'.format(uuid.uuid4().hex), recipe=[]).insert()
+      drink_id = drink.id
+    result = self.client().get('/api/drinks', headers={'If-None-Match': etag})
+    self.assertEqual(result.status_code, 200)
+    self.assertNotEqual(result.headers['ETag'], etag)
+    self.assertIn(drink_id, [drink['id'] for drink in result.json['drinks']])
+
+  def test_keyset_pagination_and_fields(self):
+    '''
+      test limit/after pages on id and fields limits the columns returned
+    '''
+    from .models import Drink
+    prefix = uuid.uuid4().hex
+    with self.app.app_context():
+      ids = [Drink(title='page test {} {}'.format(prefix, i), recipe=[{'name': 'milk'}]).insert().id
+        for i in range(3)]
+    result = self.client().get('/api/drinks?limit=2&after={}'.format(ids[0] - 1))
+    self.assertEqual([drink['id'] for drink in result.json['drinks']], ids[:2])
+    self.assertEqual(result.json['next'], ids[1])
+    result = self.client().get('/api/drinks?limit=2&fields=title&after={}'.format(ids[1]))
+    self.assertEqual(result.json['drinks'][0], {'id': ids[2], 'title': 'page test {} 2'.format(prefix)})
+    result = self.client().get('/api/drinks?fields=price')
+    self.assertEqual(result.status_code, 400)
+
+  def test_changes_since_token(self):
+    '''
+      test delta sync returns changed drinks and deleted ids after a token
+    '''
+    from .models import Drink
+    prefix = uuid.uuid4().hex
+    with self.app.app_context():
+      kept, deleted = [Drink(title='sync test {} {}'.format(prefix, i), recipe=[]).insert().id
+        for i in range(2)]
+    result = self.client().get('/api/drinks/changes')
+    token = result.json['next']
+    self.assertIn(kept, [drink['id'] for drink in result.json['drinks']])
+    with self.app.app_context():
+      Drink.query.get(deleted).delete()
+    result = self.client().get('/api/drinks/changes', query_string={'since': token})
+    self.assertIn(deleted, result.json['deleted'])
+    self.assertNotIn(deleted, [drink['id'] for drink in result.json['drinks']])
+    # nothing changed after a token in the future
+    result = self.client().get('/api/drinks/changes', query_string={'since': '2999-01-01T00:00:00'})
+    self.assertEqual((result.json['drinks'], result.json['deleted']), ([], []))
+    self.assertEqual(result.json['next'], '2999-01-01T00:00:00')
+    result = self.client().get('/api/drinks/changes?since=yesterday')
+    self.assertEqual(result.status_code, 400)
+    # an offset is converted to utc
+    result = self.client().get('/api/drinks/changes', query_string={'since': '2999-01-01T02:00:00+02:00'})
+    self.assertEqual(result.status_code, 200)
+    self.assertEqual(result.json['next'], '2999-01-01T02:00:00+02:00')
+    result = self.client().get('/api/drinks/changes', query_string={'since': '2000-01-01T00:00:00+00:00'})
+    self.assertEqual(result.status_code, 410)
+
+  def test_changes_pages(self):
+    '''
+      test limit pages through the changes with a continuation token, changes sharing
+      a timestamp are neither repeated nor skipped
+    '''
+    from .models import Drink
+    prefix = uuid.uuid4().hex
+    token = self.client().get('/api/drinks/changes').json['next']
+    with self.app.app_context():
+      ids = [Drink(title='page sync test {} {}'.format(prefix, i), recipe=[]).insert().id
+        for i in range(5)]
+      Drink.query.get(ids.pop()).delete()
+    drinks, deleted, pages = [], [], 0
+    result = self.client().get('/api/drinks/changes', query_string={'since': token, 'limit': 2})
+    while True:
+      pages += 1
+      self.assertLessEqual(len(result.json['drinks']) + len(result.json['deleted']), 2)
+      drinks += [drink['id'] for drink in result.json['drinks']]
+      deleted += result.json['deleted']
+      if not result.json['more']:
+        break
+      result = self.client().get('/api/drinks/changes', query_string={'since': result.json['next'], 'limit': 2})
+    self.assertGreaterEqual(pages, 3)
+    for id in ids:
+      self.assertEqual(drinks.count(id), 1)
+    self.assertEqual(deleted.count(id + 1), 1)
+    self.assertNotIn(id + 1, drinks)
+    result = self.client().get('/api/drinks/changes', query_string={'limit': 0})
+    self.assertEqual(result.status_code, 400)
+    result = self.client().get('/api/drinks/changes', query_string={'since': '2999-01-01T00:00:00,drinks,x'})
+    self.assertEqual(result.status_code, 400)
+
+  def test_changes_retention(self):
+    '''
+      test tombstones older than the retention period are pruned and older tokens get 410
+    '''
+    from datetime import datetime, timedelta
+    from .models import Drink, DrinkTombstone, SYNC_RETENTION_DAYS
+    old = datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS + 1)
+    with self.app.app_context():
+      db.session.add(DrinkTombstone(drink_id=-1, deleted_at=old))
+      drink = Drink(title='retention test {}'.format(uuid.uuid4().hex), recipe=[]).insert()
+      drink_id = drink.id
+      drink.delete()
+      self.assertEqual(DrinkTombstone.query.filter(DrinkTombstone.drink_id == -1).count(), 0)
+      self.assertEqual(DrinkTombstone.query.filter(DrinkTombstone.drink_id == drink_id).count(), 1)
+    result = self.client().get('/api/drinks/changes', query_string={'since': old.isoformat()})
+    self.assertEqual(result.status_code, 410)
+    self.assertFalse(result.json['success'])
+
+
+class DrinkEventsTestCase(unittest.TestCase):
+  '''
+    tests the event stream, its poller thread reads on its own connection, so the
+    changes are committed and deleted again
+  '''
+  def setUp(self):
     app.testing = True
     self.app = app
-    self.client = self.app.test_client
-    # binds the app to the current context
+    self.client = app.test_client
+
+  def test_events_push_and_resume(self):
+    '''
+      test drink changes are pushed to event stream clients and replayed after Last-Event-ID
+    '''
+    from . import events
+    from .models import Drink
+    broker = events.EventBroker(poll_interval=0.01)
+    with patch.dict(app.extensions, {'menu_events': broker}), patch.object(events, 'SSE_HEARTBEAT', 0.05):
+      result = self.client().get('/api/drinks/events', buffered=False)
+      self.assertEqual(result.mimetype, 'text/event-stream')
+      chunks = iter(result.response)
+      self.assertEqual(next(chunks), b': connected\n\n')
+      with self.app.app_context():
+        drink = Drink(title='event test {}'.format(uuid.uuid4().hex), recipe=[]).insert()
+        drink_id = drink.id
+        drink.delete()
+      received = []
+      while len(received) < 2:
+        chunk = next(chunks)
+        if not chunk.startswith(b':'):
+          received.append(chunk.decode())
+      result.close()
+      self.assertIn('event: created', received[0])
+      self.assertIn('"id":{}'.format(drink_id), received[0])
+      self.assertIn('event: deleted', received[1])
+      # a client that saw the first event gets the second one again on reconnect
+      first_id = received[0].split('\n')[0][len('id: '):]
+      result = self.client().get('/api/drinks/events', headers={'Last-Event-ID': first_id}, buffered=False)
+      chunks = iter(result.response)
+      next(chunks)
+      self.assertEqual(next(chunks).decode(), received[1])
+      result.close()
+
+  def test_events_committed_out_of_order(self):
+    '''
+      test an event id that commits after a newer one is still published, in order,
+      and a client resuming meanwhile doesn't skip it, an id that never commits is given up
+    '''
+    from .events import EventBroker
+    from .models import MenuEvent
+    table = MenuEvent.__table__
+    broker = EventBroker(gap_timeout=60)
+
+    def write(id):
+      # like a postgres transaction that took its id earlier but commits now
+      with self.app.app_context(), db.engine.begin() as connection:
+        connection.execute(table.insert().values(id=id, kind='reload', data=None))
     with self.app.app_context():
-      self.db = db 
-      # create all tables
-      self.db.create_all()
-    pass
+      broker.last_id = broker.latest()[1]
+      first = broker.last_id + 1
+      subscription, _ = broker.subscribe()
+      write(first + 1)
+      broker.poll()
+      self.assertTrue(subscription.events.empty())
+      # resuming clients only get what the poller published
+      self.assertEqual(broker.subscribe(first - 1)[1], [])
+      write(first)
+      broker.poll()
+      self.assertEqual([subscription.events.get_nowait()['id'] for _ in range(2)], [first, first + 1])
+      # first + 2 rolled back
+      write(first + 3)
+      broker.poll()
+      self.assertTrue(subscription.events.empty())
+      broker.gap_timeout = 0
+      broker.poll()
+      self.assertEqual(subscription.events.get_nowait()['id'], first + 3)
+      self.assertEqual(broker.stats['skipped'], 1)
+
+  def test_events_drop_slow_client(self):
+    '''
+      test a client whose buffer is full is dropped instead of blocking the others
+    '''
+    from .events import EventBroker
+    broker = EventBroker(buffer_size=1)
+    broker.last_id = 0
+    slow, _ = broker.subscribe()
+    fast, _ = broker.subscribe()
+    broker.publish([{'id': 1, 'kind': 'reload', 'data': None}])
+    fast.events.get_nowait()
+    broker.publish([{'id': 2, 'kind': 'reload', 'data': None}])
+    self.assertTrue(slow.dropped)
+    self.assertFalse(fast.dropped)
+    self.assertEqual(broker.stats['dropped'], 1)
+    self.assertEqual(list(broker.stream(slow, [])), [': connected\n\n'])
+
+  def test_events_max_clients(self):
+    '''
+      test clients past max_clients are told to reconnect later, and get in once a stream closes
+    '''
+    from . import events
+    broker = events.EventBroker(poll_interval=0.01, max_clients=1)
+    with patch.dict(app.extensions, {'menu_events': broker}):
+      first = self.client().get('/api/drinks/events', buffered=False)
+      self.assertEqual(next(iter(first.response)), b': connected\n\n')
+      result = self.client().get('/api/drinks/events')
+      self.assertEqual(result.status_code, 200)
+      self.assertEqual(result.get_data(as_text=True), 'retry: {}\n\n'.format(events.SSE_BUSY_RETRY))
+      self.assertEqual(broker.stats['rejected'], 1)
+      first.close()
+      result = self.client().get('/api/drinks/events', buffered=False)
+      self.assertEqual(next(iter(result.response)), b': connected\n\n')
+      result.close()
 
 
+class DrinkBulkTestCase(TransactionTestCase):
+  '''
+    tests the bulk drink import
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from app.auth.testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
+  def setUp(self):
+    '''
+      set up
+      serves the local key set, drinks use a unique title prefix
+    '''
+    from app import auth
+    super().setUp()
+    self.auth = auth
+    auth.jwks_store.load(self.key.jwks())
+    self.headers = {'Authorization': 'Bearer ' + self.key.mint(auth.AUTH0_DOMAIN,
+      auth.API_AUDIENCE, ['post:drinks'])}
+    self.prefix = 'bulk {} '.format(uuid.uuid4().hex)
+
   def tearDown(self):
     '''
       tear down
     '''
-    pass
-  
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+    super().tearDown()
+
+  def drink(self, name, parts=1):
+    return {'title': self.prefix + name, 'recipe': [{'name': 'milk', 'color': 'white', 'parts': parts}]}
+
+  def test_ndjson_upsert(self):
+    '''
+      test ndjson rows are inserted, then updated by title, bad rows reported
+    '''
+    body = '\n'.join(json.dumps(self.drink(name)) for name in ('a', 'b')) + '\n{bad json\n'
+    result = self.client().post('/api/drinks/bulk', headers=self.headers, data=body)
+    self.assertEqual(result.status_code, 200)
+    self.assertEqual((result.json['inserted'], result.json['invalid']), (2, 1))
+    self.assertEqual(result.json['errors'][0]['row'], 3)
+    body = json.dumps(self.drink('a', parts=5))
+    result = self.client().post('/api/drinks/bulk', headers=self.headers, data=body)
+    self.assertEqual((result.json['inserted'], result.json['updated']), (0, 1))
+    from .models import Drink
+    with self.app.app_context():
+      drink = Drink.query.filter(Drink.title == self.prefix + 'a').one()
+      self.assertEqual(drink.recipe[0]['parts'], 5)
+
+  def test_json_array_insert_conflicts(self):
+    '''
+      test insert mode reports existing titles instead of updating them
+    '''
+    from . import bulk
+    drinks = [self.drink(str(i)) for i in range(30)]
+    with patch.object(bulk, 'READ_SIZE', 64):
+      result = self.client().post('/api/drinks/bulk', headers=self.headers, data=json.dumps(drinks))
+      self.assertEqual(result.json['inserted'], 30)
+      result = self.client().post('/api/drinks/bulk?mode=insert', headers=self.headers,
+        data=json.dumps(drinks[:2] + [self.drink('new')]))
+    self.assertEqual((result.json['inserted'], result.json['conflicts']), (1, 2))
+    self.assertEqual(sorted(error['row'] for error in result.json['errors']), [1, 2])
+
+  def test_export_ndjson_gzip(self):
+    '''
+      test the export streams one line per drink, gzipped on request
+    '''
+    import gzip
+    from . import bulk
+    self.client().post('/api/drinks/bulk', headers=self.headers,
+      data=json.dumps([self.drink(str(i)) for i in range(5)]))
+    headers = {'Authorization': 'Bearer ' + self.key.mint(self.auth.AUTH0_DOMAIN,
+      self.auth.API_AUDIENCE, ['get:drinks-detail'])}
+    with patch.object(bulk, 'EXPORT_BATCH_SIZE', 2):
+      result = self.client().get('/api/drinks/export', headers=headers)
+      self.assertEqual(result.mimetype, 'application/x-ndjson')
+      self.assertTrue(result.is_streamed)
+      lines = [json.loads(line) for line in result.get_data(as_text=True).splitlines()]
+      exported = [line['title'] for line in lines if line['title'].startswith(self.prefix)]
+      self.assertEqual(exported, [self.prefix + str(i) for i in range(5)])
+      result = self.client().get('/api/drinks/export',
+        headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+    self.assertEqual(result.headers['Content-Encoding'], 'gzip')
+    self.assertEqual(len(gzip.decompress(result.get_data()).splitlines()), len(lines))
+
+
+class DrinkSearchTestCase(TransactionTestCase):
+  '''
+    tests the drink search, drinks share a unique tag word so other tests' drinks don't match
+  '''
+  def setUp(self):
+    super().setUp()
+    self.tag = 'tag' + uuid.uuid4().hex
+
+  def add(self, title, *ingredients):
+    from .models import Drink
+    with self.app.app_context():
+      return Drink(title='{} {}'.format(title, self.tag),
+        recipe=[{'name': name, 'color': 'white', 'parts': 1} for name in ingredients]).insert().id
+
+  def search(self, q, **args):
+    return self.client().get('/api/drinks/search', query_string=dict(args, q='{} {}'.format(q, self.tag)))
+
+  def titles(self, result):
+    return [drink['title'].replace(' ' + self.tag, '') for drink in result.json['drinks']]
+
+  def test_prefix_ranking_and_ingredients(self):
+    '''
+      test words match as prefixes, title matches rank above ingredient matches
+    '''
+    self.add('Flat White', 'espresso', 'vanilla syrup')
+    self.add('Vanilla Latte', 'espresso', 'oat milk')
+    self.add('Crème Brûlée', 'caramel')
+    result = self.search('vani')
+    self.assertEqual(result.status_code, 200)
+    self.assertEqual(self.titles(result), ['Vanilla Latte', 'Flat White'])
+    self.assertEqual(self.titles(self.search('oat lat')), ['Vanilla Latte'])
+    self.assertEqual(self.titles(self.search('creme')), ['Crème Brûlée'])
+    self.assertEqual(self.titles(self.search('mocha')), [])
+    # search operators are plain text
+    self.assertEqual(self.titles(self.search('"vani* (')), ['Vanilla Latte', 'Flat White'])
+    self.assertEqual(self.client().get('/api/drinks/search').status_code, 400)
+
+  def test_index_follows_changes(self):
+    '''
+      test updates, deletes and the bulk import are searchable right away
+    '''
+    from .models import Drink
+    drink_id = self.add('Cortado', 'espresso')
+    with self.app.app_context():
+      drink = Drink.query.get(drink_id)
+      drink.title, drink.recipe = 'Gibraltar ' + self.tag, [{'name': 'steamed milk'}]
+      drink.update()
+    self.assertEqual(self.titles(self.search('cort')), [])
+    self.assertEqual(self.titles(self.search('gib steam')), ['Gibraltar'])
+    with self.app.app_context():
+      Drink.query.get(drink_id).delete()
+    self.assertEqual(self.titles(self.search('gib')), [])
+    from .bulk import import_drinks
+    with self.app.app_context():
+      import_drinks(io.BytesIO(json.dumps([{'title': 'Affogato ' + self.tag, 'recipe': [{'name': 'gelato'}]}]).encode()))
+    self.assertEqual(self.titles(self.search('gela')), ['Affogato'])
+
+  def test_pages_past_the_rank_limit(self):
+    '''
+      test limit & offset page through matches, unranked past SEARCH_RANK_LIMIT,
+      title matches still first
+    '''
+    for i in range(3):
+      self.add('Mocha {}'.format(i), 'milk')
+      self.add('Latte {}'.format(i), 'mocha sauce')
+    ranked = self.titles(self.search('moc', limit=10))
+    with patch('app.drink.search.SEARCH_RANK_LIMIT', 2):
+      pages, offset = [], 0
+      while offset is not None:
+        result = self.search('moc', limit=4, offset=offset)
+        pages += self.titles(result)
+        offset = result.json['next']
+    self.assertEqual(pages, ['Mocha 0', 'Mocha 1', 'Mocha 2', 'Latte 0', 'Latte 1', 'Latte 2'])
+    self.assertEqual(sorted(ranked[:3]), ['Mocha 0', 'Mocha 1', 'Mocha 2'])
+    self.assertEqual(self.search('moc', limit=0).status_code, 400)
+
+  def test_rebuild(self):
+    '''
+      test a rebuild indexes drinks the triggers missed
+    '''
+    from .search import rebuild
+    self.add('Red Eye', 'drip coffee')
+    with self.app.app_context():
+      self.db.session.execute(self.db.text('DELETE FROM drinks_search'))
+      self.db.session.commit()
+    self.assertEqual(self.titles(self.search('red')), [])
+    with self.app.app_context():
+      self.assertGreaterEqual(rebuild(), 1)
+      self.db.session.commit()
+    self.assertEqual(self.titles(self.search('red drip')), ['Red Eye'])
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosqlite'), 'aiosqlite is not installed')
+class DrinkAsgiTestCase(unittest.TestCase):
+  '''
+    tests the async drink handlers of the async serving mode, they read on connections
+    of their own, so the drinks are committed and deleted again
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from app.auth.testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
+  def setUp(self):
+    from app import auth
+    from .models import Drink
+    app.testing = True
+    self.auth = auth
+    auth.jwks_store.load(self.key.jwks())
+    self.headers = {'Authorization': 'Bearer ' + self.key.mint(auth.AUTH0_DOMAIN,
+      auth.API_AUDIENCE, ['get:drinks-detail'])}
+    app.extensions['menu_cache'].clear()
+    with app.app_context():
+      self.drinks = [Drink(title='asgi {} {}'.format(uuid.uuid4().hex, index),
+        recipe=[{'name': 'milk', 'parts': index}]).insert().id for index in range(3)]
+
+  def tearDown(self):
+    from .models import Drink
+    with app.app_context():
+      for drink_id in self.drinks:
+        Drink.query.get(drink_id).delete()
+    app.extensions['menu_cache'].clear()
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+
   def test_get_drinks(self):
     '''
-      test get drinks
+      test the menu is served by the async handler like by the sync one, with its etag
     '''
-    result = self.client().get('/api/drinks')
+    from app.asgi import AsgiApp
+    from app.testing import run_asgi
+    asgi = AsgiApp(app, threads=1)
+
+    async def requests(client):
+      # uncompressed like the test client's
+      result = await client.get('/api/drinks', headers={'Accept-Encoding': 'identity'})
+      cached = await client.get('/api/drinks', headers={'If-None-Match': result.headers['ETag']})
+      return result, cached
+    result, cached = run_asgi(requests, asgi)
+    expected = app.test_client().get('/api/drinks')
     self.assertEqual(result.status_code, 200)
-    self.assertIn('drinks', result.json)
-  
\ No newline at end of file
+    self.assertEqual(result.json(), expected.json)
+    self.assertEqual(result.headers['ETag'], expected.headers['ETag'])
+    self.assertIn('queries', result.headers['Server-Timing'])
+    self.assertEqual(cached.status_code, 304)
+    self.assertEqual(asgi.stats, {'async': 2, 'sync': 0})
+
+  def test_drinks_page(self):
+    '''
+      test keyset pages and their errors from the async handler
+    '''
+    from app.testing import run_asgi
+
+    async def requests(client):
+      after = self.drinks[0] - 1
+      page = await client.get('/api/drinks?limit=2&after={}&fields=title'.format(after))
+      rest = await client.get('/api/drinks?limit=2&after={}'.format(page.json()['next']))
+      bad = await client.get('/api/drinks?limit=many')
+      return page, rest, bad
+    page, rest, bad = run_asgi(requests)
+    self.assertEqual([drink['id'] for drink in page.json()['drinks']], self.drinks[:2])
+    self.assertEqual(list(page.json()['drinks'][0]), ['id', 'title'])
+    self.assertEqual(rest.json()['drinks'][0]['recipe'], [{'name': 'milk', 'parts': 2}])
+    self.assertEqual(bad.status_code, 400)
+
+  def test_get_drinks_detail(self):
+    '''
+      test the async handler checks the token, with the keys fetched on the loop
+    '''
+    from app.testing import run_asgi
+
+    async def requests(client):
+      denied = await client.get('/api/drinks-detail')
+      allowed = await client.get('/api/drinks-detail', headers=self.headers)
+      return denied, allowed
+    denied, allowed = run_asgi(requests)
+    self.assertEqual(denied.status_code, 401)
+    self.assertEqual(allowed.status_code, 200)
+    self.assertTrue(set(self.drinks) <= {drink['id'] for drink in allowed.json()['drinks']})
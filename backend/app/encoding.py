@@ -0,0 +1,116 @@
+'''
+  json encoding of api responses, orjson when it is installed else the stdlib,
+  plugged into flask's jsonify by init_app
+'''
+import datetime
+import json
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+def stdlib_dumps(obj, default, indent=None, sort_keys=False):
+  separators = (',', ':') if indent is None else (', ', ': ')
+  return json.dumps(obj, default=default, indent=indent, sort_keys=sort_keys,
+    separators=separators, ensure_ascii=False).encode('utf-8')
+
+
+def orjson_dumps(obj, default, indent=None, sort_keys=False):
+  option = orjson.OPT_NON_STR_KEYS
+  if indent:
+    option |= orjson.OPT_INDENT_2
+  if sort_keys:
+    option |= orjson.OPT_SORT_KEYS
+  try:
+    return orjson.dumps(obj, default=default, option=option)
+  except orjson.JSONEncodeError:
+    # e.g. integers over 64 bits, the stdlib can still encode them
+    return stdlib_dumps(obj, default, indent, sort_keys)
+
+
+BACKENDS = {'json': stdlib_dumps, 'orjson': orjson_dumps}
+
+
+def default(obj):
+  '''
+    types the backends can't encode, datetimes as iso 8601 like orjson does
+  '''
+  if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+    return obj.isoformat()
+  # decimals, uuids, dataclasses and objects with __html__
+  return FlaskJSONEncoder().default(obj)
+
+
+class ResponseEncoder:
+  '''
+    ResponseEncoder
+    encodes payloads to bytes with the chosen backend
+    Args:
+      backend (str): orjson, json, or auto for orjson when installed
+      sort_keys (bool): sort object keys, like jsonify does by default
+  '''
+  def __init__(self, backend='auto', sort_keys=True):
+    if backend == 'auto':
+      backend = 'orjson' if orjson is not None else 'json'
+    if backend not in BACKENDS:
+      raise ValueError('unknown json backend {}'.format(backend))
+    if backend == 'orjson' and orjson is None:
+      raise RuntimeError('JSON_BACKEND is orjson but it is not installed')
+    self.backend = backend
+    self.sort_keys = sort_keys
+    self._dumps = BACKENDS[backend]
+
+  def dumps(self, obj, indent=None):
+    '''
+      returns the encoded bytes of obj
+    '''
+    return self._dumps(obj, default, indent=indent, sort_keys=self.sort_keys)
+
+
+class JSONEncoder(FlaskJSONEncoder):
+  '''
+    JSONEncoder
+    flask's encoder class, hands encoding to the app's ResponseEncoder
+  '''
+  response_encoder = None
+
+  def default(self, obj):
+    return default(obj)
+
+  def encode(self, obj):
+    # the backends only indent by 2
+    if self.response_encoder is None or self.indent not in (None, 2):
+      return super().encode(obj)
+    return self.response_encoder.dumps(obj, indent=self.indent).decode('utf-8')
+
+
+def init_app(app):
+  '''
+    sets up the response encoder of app from JSON_BACKEND
+  '''
+  encoder = ResponseEncoder(app.config.get('JSON_BACKEND', 'auto'), app.config['JSON_SORT_KEYS'])
+  app.extensions['response_encoder'] = encoder
+  app.json_encoder = type('JSONEncoder', (JSONEncoder,), {'response_encoder': encoder})
+  return encoder
+
+
+def encode_json(payload):
+  '''
+    encodes payload with the current app's encoder, e.g. to cache the body
+  '''
+  return current_app.extensions['response_encoder'].dumps(payload)
+
+
+def json_response(payload, status=200, headers=None):
+  '''
+    json response of payload, bytes are taken as already encoded and sent as they are
+  '''
+  if not isinstance(payload, (bytes, bytearray)):
+    pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    payload = current_app.extensions['response_encoder'].dumps(payload, indent=2 if pretty else None)
+  return current_app.response_class(payload, status=status, headers=headers,
+    mimetype=current_app.config['JSONIFY_MIMETYPE'])
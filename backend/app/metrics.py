@@ -0,0 +1,332 @@
+'''
+  prometheus text format metrics, kept per process in memory or, with METRICS_DIR set,
+  in a mmap'd file per process that /metrics sums up across workers
+'''
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from os import environ as env
+from flask import current_app, g, request
+from sqlalchemy import event
+
+# shared by the worker processes, e.g. a tmpfs directory emptied before the server starts
+METRICS_DIR = env.get('METRICS_DIR')
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+INITIAL_FILE_SIZE = 64 * 1024
+
+
+class MemoryValues:
+  '''
+    float values by key for a single process
+  '''
+  def __init__(self):
+    self._values = defaultdict(float)
+
+  def add(self, key, amount):
+    self._values[key] += amount
+
+  def items(self):
+    return list(self._values.items())
+
+
+class MmapValues:
+  '''
+    MmapValues
+    float values by key written in place in a file, so other processes can read them any time
+    layout: 8 byte used size, then entries of a 4 byte key length, the json key
+    padded to 8 bytes and an 8 byte double
+  '''
+  def __init__(self, path, size=INITIAL_FILE_SIZE):
+    self.path = path
+    self._file = open(path, 'a+b')
+    fd = self._file.fileno()
+    if os.fstat(fd).st_size < size:
+      os.ftruncate(fd, size)
+    self._size = os.fstat(fd).st_size
+    self._mmap = mmap.mmap(fd, self._size)
+    self._used = struct.unpack_from('q', self._mmap, 0)[0] or 8
+    self._positions = {key: position for key, position in self._entries(self._mmap, self._used)}
+
+  @staticmethod
+  def _entries(data, used):
+    position = 8
+    while position < used:
+      length = struct.unpack_from('i', data, position)[0]
+      key = json.loads(bytes(data[position + 4:position + 4 + length]).decode('utf-8'))
+      position += 4 + length + (-(4 + length) % 8)
+      yield (key[0], tuple(tuple(label) for label in key[1])), position
+      position += 8
+
+  @classmethod
+  def read(cls, path):
+    '''
+      (key, value) pairs of another process' file
+    '''
+    with open(path, 'rb') as source:
+      data = source.read()
+    if len(data) < 8:
+      return []
+    used = min(struct.unpack_from('q', data, 0)[0], len(data))
+    return [(key, struct.unpack_from('d', data, position)[0])
+      for key, position in cls._entries(data, used)]
+
+  def _position(self, key):
+    position = self._positions.get(key)
+    if position is not None:
+      return position
+    encoded = json.dumps(key).encode('utf-8')
+    # the value is 8 byte aligned
+    header = 4 + len(encoded) + (-(4 + len(encoded)) % 8)
+    needed = self._used + header + 8
+    if needed > self._size:
+      while needed > self._size:
+        self._size *= 2
+      os.ftruncate(self._file.fileno(), self._size)
+      self._mmap = mmap.mmap(self._file.fileno(), self._size)
+    struct.pack_into('i', self._mmap, self._used, len(encoded))
+    self._mmap[self._used + 4:self._used + 4 + len(encoded)] = encoded
+    position = self._used + header
+    struct.pack_into('d', self._mmap, position, 0.0)
+    self._used = needed
+    # readers stop at the used size, so it is written last
+    struct.pack_into('q', self._mmap, 0, self._used)
+    self._positions[key] = position
+    return position
+
+  def add(self, key, amount):
+    position = self._position(key)
+    struct.pack_into('d', self._mmap, position, struct.unpack_from('d', self._mmap, position)[0] + amount)
+
+  def items(self):
+    return [(key, struct.unpack_from('d', self._mmap, position)[0])
+      for key, position in list(self._positions.items())]
+
+  def close(self):
+    self._mmap.close()
+    self._file.close()
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', r'\\').replace('"', r'\"')
+    .replace('\n', r'\n')) for name, value in labels) + '}'
+
+
+def format_value(value):
+  return repr(int(value)) if value == int(value) else repr(value)
+
+
+class Metrics:
+  '''
+    Metrics
+    counters, gauges and histograms of this process, updates take a short lock,
+    with a directory each process writes its own file and collect() sums all of them
+    Args:
+      directory (str): shared metrics directory, None keeps the values in memory
+  '''
+  def __init__(self, directory=None):
+    self.directory = directory
+    self._meta = {}
+    # bucket, sum and count keys of each histogram label set
+    self._histogram_keys = {}
+    self._lock = threading.Lock()
+    self._open()
+    if directory:
+      # gunicorn --preload forks workers after the import, each needs its own file
+      ref = weakref.ref(self)
+      os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._open())
+
+  def _open(self):
+    self._lock = threading.Lock()
+    self.pid = os.getpid()
+    if self.directory:
+      self._values = MmapValues(os.path.join(self.directory, 'metrics_{}.db'.format(self.pid)))
+    else:
+      self._values = MemoryValues()
+
+  def describe(self, name, kind, description, buckets=DEFAULT_BUCKETS):
+    '''
+      declares a counter, gauge or histogram, only declared metrics are rendered
+    '''
+    self._meta[name] = (kind, description, tuple(buckets) if kind == 'histogram' else None)
+
+  @staticmethod
+  def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in (labels or {}).items()))
+
+  def inc(self, name, labels=None, amount=1):
+    '''
+      adds to a counter, or a gauge when amount is negative
+    '''
+    key = self._key(name, labels)
+    with self._lock:
+      self._values.add(key, amount)
+
+  def _histogram(self, key):
+    keys = self._histogram_keys.get(key)
+    if keys is None:
+      name, labels = key
+      bounds = [repr(bound) for bound in self._meta[name][2]] + ['+Inf']
+      keys = self._histogram_keys[key] = (
+        [(name + '_bucket', labels + (('le', bound),)) for bound in bounds],
+        (name + '_sum', labels), (name + '_count', labels))
+    return keys
+
+  def observe(self, name, value, labels=None):
+    '''
+      records a histogram value, only the bucket it falls in is counted,
+      render() adds them up to prometheus' cumulative buckets
+    '''
+    key = self._key(name, labels)
+    buckets, total, count = self._histogram(key)
+    index = bisect.bisect_left(self._meta[name][2], value)
+    with self._lock:
+      self._values.add(buckets[index], 1)
+      self._values.add(total, value)
+      self._values.add(count, 1)
+
+  @contextmanager
+  def timer(self, name, labels=None):
+    '''
+      observes the time spent in the block, with an outcome label of ok or error
+    '''
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+      yield
+      outcome = 'ok'
+    finally:
+      self.observe(name, time.perf_counter() - started, dict(labels or {}, outcome=outcome))
+
+  def collect(self):
+    '''
+      values of every process, gauges of exited processes are left out
+    '''
+    with self._lock:
+      own = self._values.items()
+    totals = defaultdict(float)
+    for key, value in own:
+      totals[key] += value
+    if self.directory:
+      for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+        pid = int(os.path.basename(path)[len('metrics_'):-len('.db')])
+        if pid == self.pid:
+          continue
+        alive = pid_alive(pid)
+        for key, value in MmapValues.read(path):
+          meta = self._meta.get(key[0])
+          if meta is not None and meta[0] == 'gauge' and not alive:
+            continue
+          totals[key] += value
+    return totals
+
+  def render(self):
+    '''
+      prometheus text exposition format
+    '''
+    totals = self.collect()
+    samples = defaultdict(list)
+    for (name, labels), value in totals.items():
+      samples[name].append((labels, value))
+    lines = []
+    for name, (kind, description, buckets) in sorted(self._meta.items()):
+      lines.append('# HELP {} {}'.format(name, description))
+      lines.append('# TYPE {} {}'.format(name, kind))
+      if kind != 'histogram':
+        for labels, value in sorted(samples[name]):
+          lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+        continue
+      for labels, count in sorted(samples[name + '_count']):
+        # every bucket, in order, including the ones nothing fell into
+        cumulative = 0
+        for bound in [repr(bound) for bound in buckets] + ['+Inf']:
+          bucket = labels + (('le', bound),)
+          cumulative += totals.get((name + '_bucket', bucket), 0)
+          lines.append('{}_bucket{} {}'.format(name, format_labels(bucket), format_value(cumulative)))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels),
+          format_value(totals.get((name + '_sum', labels), 0))))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), format_value(count)))
+    return '\n'.join(lines) + '\n'
+
+
+def pid_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+metrics = Metrics(METRICS_DIR)
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by blueprint and route.')
+metrics.describe('http_requests_total', 'counter', 'Requests by blueprint, route and status code.')
+metrics.describe('auth_errors_total', 'counter', 'Auth errors by error and status code.')
+metrics.describe('jwks_fetch_duration_seconds', 'histogram', 'Time to fetch the auth0 key set.')
+metrics.describe('management_api_duration_seconds', 'histogram', 'Auth0 management api calls by call.')
+metrics.describe('role_cache_lookups_total', 'counter', 'User role cache lookups by result (hit or miss).')
+metrics.describe('db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.')
+metrics.describe('db_pool_connections_in_use', 'gauge', 'Connections currently checked out.')
+metrics.describe('db_query_duration_seconds', 'histogram', 'SQL statement time.')
+
+
+def instrument_pool(engine):
+  '''
+    counts checkouts and connections in use of engine's pool
+  '''
+  labels = {'database': os.path.basename(engine.url.database or '') or engine.url.get_backend_name()}
+
+  def checkout(dbapi_connection, connection_record, connection_proxy):
+    metrics.inc('db_pool_checkouts_total', labels)
+    metrics.inc('db_pool_connections_in_use', labels)
+
+  def checkin(dbapi_connection, connection_record):
+    metrics.inc('db_pool_connections_in_use', labels, -1)
+
+  event.listen(engine, 'checkout', checkout)
+  event.listen(engine, 'checkin', checkin)
+
+
+def start_request():
+  g.metrics_started = time.perf_counter()
+
+
+def record_request(response):
+  '''
+    after request hook, latency and status by route template, not the raw path
+  '''
+  started = g.get('metrics_started')
+  if started is None:
+    return response
+  labels = {
+    'blueprint': request.blueprint or '',
+    'route': request.url_rule.rule if request.url_rule is not None else 'unmatched',
+    'method': request.method
+  }
+  metrics.observe('http_request_duration_seconds', time.perf_counter() - started, labels)
+  metrics.inc('http_requests_total', dict(labels, status=response.status_code))
+  return response
+
+
+def metrics_view():
+  return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+  '''
+    times every request and serves GET /metrics
+  '''
+  app.before_request(start_request)
+  app.after_request(record_request)
+  app.add_url_rule('/metrics', 'metrics', metrics_view)
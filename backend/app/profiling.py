@@ -0,0 +1,164 @@
+'''
+  opt in request profiling, a sample of requests (or requests with a signed
+  X-Profile header) run under cProfile and are written to PROFILE_DIR
+'''
+import cProfile
+import datetime
+import hashlib
+import hmac
+import io
+import os
+import pstats
+import random
+import time
+import uuid
+from flask import current_app, g, request
+
+# requests with a valid value are profiled, see profile_token
+PROFILE_HEADER = 'X-Profile'
+
+# used when the config doesn't set them
+DEFAULTS = {
+  # profiles are only taken when it is set
+  'PROFILE_DIR': None,
+  # fraction of requests profiled, 0.01 is one in a hundred
+  'PROFILE_SAMPLE_RATE': 0.0,
+  # endpoint names sampled, e.g. drink.get_drinks_detail, empty for all of them
+  'PROFILE_ENDPOINTS': (),
+  # newest profiles kept, older ones are deleted
+  'PROFILE_KEEP': 500,
+  # key of the X-Profile header, the header is ignored without it
+  'PROFILE_SECRET': None,
+}
+
+
+def setting(config, name):
+  return config.get(name, DEFAULTS[name])
+
+
+def sign(secret, expires):
+  return hmac.new(secret.encode('utf-8'), str(expires).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def profile_token(secret, seconds=300):
+  '''
+    X-Profile header value that asks for a profile until it expires
+    Args:
+      secret (str): PROFILE_SECRET
+      seconds (int): seconds the value is valid
+  '''
+  expires = int(time.time()) + seconds
+  return '{}:{}'.format(expires, sign(secret, expires))
+
+
+def valid_token(secret, value):
+  try:
+    expires, signature = value.split(':', 1)
+    expired = int(expires) < time.time()
+  except ValueError:
+    return False
+  return not expired and hmac.compare_digest(signature, sign(secret, expires))
+
+
+def wants_profile(config):
+  if not setting(config, 'PROFILE_DIR'):
+    return False
+  secret = setting(config, 'PROFILE_SECRET')
+  header = request.headers.get(PROFILE_HEADER)
+  if header and secret and valid_token(secret, header):
+    return True
+  endpoints = setting(config, 'PROFILE_ENDPOINTS')
+  if endpoints and request.endpoint not in endpoints:
+    return False
+  return random.random() < setting(config, 'PROFILE_SAMPLE_RATE')
+
+
+def profile_name():
+  # sorts by time, the endpoint lets the report pick one
+  return '{}_{}_{}_{}.prof'.format(datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+    (request.endpoint or 'unmatched').replace('.', '-'), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def profile_endpoint(name):
+  '''
+    endpoint of a profile file name, endpoint names can hold underscores too
+  '''
+  parts = name[:-len('.prof')].split('_')
+  return '_'.join(parts[1:-2]).replace('-', '.')
+
+
+def rotate(directory, keep):
+  '''
+    deletes all but the newest keep profiles
+  '''
+  names = sorted(name for name in os.listdir(directory) if name.endswith('.prof'))
+  for name in names[:max(len(names) - keep, 0)]:
+    try:
+      os.remove(os.path.join(directory, name))
+    except FileNotFoundError:
+      # another worker rotated it
+      pass
+
+
+def start_profile():
+  if not wants_profile(current_app.config):
+    return
+  g.profile_name = profile_name()
+  g.profiler = cProfile.Profile()
+  g.profiler.enable()
+
+
+def add_profile_header(response):
+  '''
+    after request hook, tells the client which file holds its profile
+  '''
+  name = g.get('profile_name')
+  if name is not None:
+    response.headers['X-Profile-Id'] = name
+  return response
+
+
+def finish_profile(exception=None):
+  '''
+    teardown hook, so the profile includes the other after request hooks
+  '''
+  profiler = g.pop('profiler', None)
+  if profiler is None:
+    return
+  profiler.disable()
+  config = current_app.config
+  directory = setting(config, 'PROFILE_DIR')
+  os.makedirs(directory, exist_ok=True)
+  profiler.dump_stats(os.path.join(directory, g.profile_name))
+  rotate(directory, setting(config, 'PROFILE_KEEP'))
+
+
+def profile_paths(directory, endpoint=None):
+  '''
+    stored profiles, of one endpoint when given
+  '''
+  if not os.path.isdir(directory):
+    return []
+  return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+    if name.endswith('.prof') and (endpoint is None or profile_endpoint(name) == endpoint)]
+
+
+def report(paths, sort='cumulative', top=20):
+  '''
+    the top functions over all the profiles in paths, as text
+  '''
+  stream = io.StringIO()
+  stats = pstats.Stats(*paths, stream=stream)
+  # pstats prints a line per file otherwise
+  stats.files = []
+  stats.strip_dirs().sort_stats(sort).print_stats(top)
+  return stream.getvalue()
+
+
+def init_app(app):
+  '''
+    registers the profiling hooks, they do nothing until PROFILE_DIR is set
+  '''
+  app.before_request(start_profile)
+  app.after_request(add_profile_header)
+  app.teardown_request(finish_profile)
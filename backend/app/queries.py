@@ -0,0 +1,145 @@
+'''
+  per request sql query counts and time from engine events, a slow query log,
+  repeated (n+1) query warnings and Server-Timing headers
+'''
+import logging
+import time
+from collections import Counter
+from functools import partial
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# used when the config doesn't set them
+DEFAULTS = {
+  'QUERY_STATS': True,
+  'SLOW_QUERY_MS': 100,
+  'N_PLUS_ONE_THRESHOLD': 10,
+  'SERVER_TIMING': True,
+}
+# characters of a statement written to the log
+MAX_LOGGED_STATEMENT = 500
+
+
+def setting(config, name):
+  return config.get(name, DEFAULTS[name])
+
+
+class QueryStats:
+  '''
+    QueryStats
+    queries of one request
+  '''
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.count = 0
+    self.seconds = 0.0
+    self.statements = Counter()
+
+  def add(self, statement, seconds):
+    self.count += 1
+    self.seconds += seconds
+    self.statements[statement] += 1
+
+  def repeated(self, threshold):
+    '''
+      statements run at least threshold times, the usual sign of a query per row
+    '''
+    return [(statement, count) for statement, count in self.statements.most_common()
+      if count >= threshold]
+
+
+def parameter_shape(parameters, executemany=False):
+  '''
+    types of the bound parameters without their values, e.g. (int, str) or 1000 x (str, str)
+  '''
+  if executemany and parameters:
+    return '{} x {}'.format(len(parameters), parameter_shape(parameters[0]))
+  if isinstance(parameters, dict):
+    return '{' + ', '.join('{}: {}'.format(name, type(value).__name__)
+      for name, value in parameters.items()) + '}'
+  if isinstance(parameters, (list, tuple)):
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+  return type(parameters).__name__
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def record_query(slow_seconds, conn, statement, parameters, executemany):
+  seconds = time.perf_counter() - conn.info['query_started'].pop()
+  metrics.observe('db_query_duration_seconds', seconds)
+  if has_request_context():
+    stats = g.get('query_stats')
+    if stats is not None:
+      stats.add(statement, seconds)
+  if seconds >= slow_seconds:
+    logger.warning('slow query %.1f ms: %s parameters: %s', seconds * 1000,
+      statement[:MAX_LOGGED_STATEMENT], parameter_shape(parameters, executemany))
+
+
+def after_cursor_execute(slow_seconds, conn, cursor, statement, parameters, context, executemany):
+  record_query(slow_seconds, conn, statement, parameters, executemany)
+
+
+def handle_error(slow_seconds, exception_context):
+  '''
+    a statement that raised gets no after_cursor_execute, its start is popped here,
+    nothing is started when e.g. the connection or fetching the rows failed
+  '''
+  conn = exception_context.connection
+  if conn is None or not conn.info.get('query_started'):
+    return
+  context = exception_context.execution_context
+  record_query(slow_seconds, conn, exception_context.statement or '', exception_context.parameters,
+    context.executemany if context is not None else False)
+
+
+def instrument(engine, config):
+  '''
+    times every statement run by engine, unless QUERY_STATS is off
+  '''
+  if not setting(config, 'QUERY_STATS'):
+    return
+  slow_seconds = setting(config, 'SLOW_QUERY_MS') / 1000
+  event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+  event.listen(engine, 'after_cursor_execute', partial(after_cursor_execute, slow_seconds))
+  # failed statements are timed too
+  event.listen(engine, 'handle_error', partial(handle_error, slow_seconds))
+
+
+def start_request():
+  g.query_stats = QueryStats()
+
+
+def finish_request(response):
+  '''
+    after request hook, warns about repeated statements and adds Server-Timing
+  '''
+  stats = g.get('query_stats')
+  if stats is None:
+    return response
+  config = current_app.config
+  for statement, count in stats.repeated(setting(config, 'N_PLUS_ONE_THRESHOLD')):
+    logger.warning('possible n+1 in %s %s, ran %d times: %s', request.method, request.path,
+      count, statement[:MAX_LOGGED_STATEMENT])
+  if setting(config, 'SERVER_TIMING'):
+    # queries of a streamed body run after this and aren't counted
+    response.headers.add('Server-Timing', 'db;dur={:.1f};desc="{} queries"'.format(
+      stats.seconds * 1000, stats.count))
+    response.headers.add('Server-Timing', 'app;dur={:.1f}'.format(
+      (time.perf_counter() - stats.started) * 1000))
+  return response
+
+
+def init_app(app):
+  '''
+    collects query stats per request, engines are instrumented by app.database
+  '''
+  if not setting(app.config, 'QUERY_STATS'):
+    return
+  app.before_request(start_request)
+  app.after_request(finish_request)
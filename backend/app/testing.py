@@ -0,0 +1,144 @@
+'''
+  the app the test cases run against, made from config_test once per process,
+  with a database of its own, so test processes can run side by side
+    TEST_DATABASE_URL runs the tests against another database instead of a temporary sqlite file,
+    not an in memory sqlite one, its single shared connection can't hold a transaction per test
+'''
+import atexit
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import event
+from . import create_app, db
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+def temporary_database():
+  '''
+    sqlite file in a directory removed when the process exits
+  '''
+  directory = tempfile.mkdtemp(prefix='coffee_shop_tests_')
+  atexit.register(shutil.rmtree, directory, True)
+  return 'sqlite:///' + os.path.join(directory, 'tests.db')
+
+
+def sqlite_savepoints(engine):
+  '''
+    pysqlite starts transactions on its own and ignores SAVEPOINT, let sqlalchemy emit
+    BEGIN instead so the nested transactions of TransactionTestCase work
+  '''
+  @event.listens_for(engine, 'connect')
+  def connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+  @event.listens_for(engine, 'begin')
+  def begin(connection):
+    connection.exec_driver_sql('BEGIN')
+
+
+def setup_database(app):
+  '''
+    creates the tables once, test cases roll back or clean up what they add
+  '''
+  with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+      sqlite_savepoints(db.engine)
+    db.create_all()
+
+
+app = create_app(testing=True)
+app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URL or temporary_database()
+setup_database(app)
+
+
+class TransactionTestCase(unittest.TestCase):
+  '''
+    TransactionTestCase
+    runs each test in a transaction that is rolled back in tearDown, commits of the
+    app only release a SAVEPOINT, so nothing a test writes is left behind
+    the test and the requests of its test client share one connection, tests whose
+    writes have to be seen by other connections (e.g. a poller thread) use unittest.TestCase
+  '''
+  def setUp(self):
+    app.testing = True
+    self.app = app
+    self.client = app.test_client
+    self.db = db
+    with app.app_context():
+      self.connection = db.engine.connect()
+    self.transaction = self.connection.begin()
+    self.nested = self.connection.begin_nested()
+    self.saved_session = db.session
+    db.session = db.create_scoped_session({'bind': self.connection, 'binds': {}})
+
+    @event.listens_for(db.session, 'after_transaction_end')
+    def restart_savepoint(session, transaction):
+      # a commit or rollback of the app ended the savepoint, start the next one
+      if not self.nested.is_active:
+        self.nested = self.connection.begin_nested()
+
+  def tearDown(self):
+    db.session.remove()
+    db.session = self.saved_session
+    self.transaction.rollback()
+    self.connection.close()
+    # cached menus may hold rolled back drinks under a version number that is used again
+    app.extensions['menu_cache'].clear()
+
+
+def run_asgi(requests, asgi=None):
+  '''
+    runs requests(client), a coroutine function, with an httpx client of the async serving
+    mode (app.asgi) on a new event loop, its pooled connections are closed after,
+    returns what requests returns
+  '''
+  import asyncio
+  import httpx
+  from .asgi import AsgiApp
+  asgi = asgi or AsgiApp(app, threads=4)
+
+  async def main():
+    transport = httpx.ASGITransport(app=asgi)
+    try:
+      async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+        return await requests(client)
+    finally:
+      await asgi.close()
+  return asyncio.run(main())
+
+
+def shard(cases, workers):
+  '''
+    splits test case classes into at most workers lists of names, the largest
+    classes first, each onto the list with the fewest tests so far
+  '''
+  loader = unittest.defaultTestLoader
+  sizes = sorted(((loader.loadTestsFromTestCase(case).countTestCases(), case) for case in cases),
+    key=lambda item: -item[0])
+  shards = [[0, []] for _ in range(max(min(workers, len(sizes)), 1))]
+  for size, case in sizes:
+    smallest = min(shards, key=lambda item: item[0])
+    smallest[0] += size
+    smallest[1].append('{}.{}'.format(case.__module__, case.__qualname__))
+  return [names for _, names in shards if names]
+
+
+def run_names(names, verbosity=2):
+  '''
+    runs tests by dotted name in this process, returns the output and counts so
+    a parent process can report the results of several workers
+  '''
+  stream = io.StringIO()
+  suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+  result = unittest.TextTestRunner(stream=stream, verbosity=verbosity).run(suite)
+  return {
+    'output': stream.getvalue(),
+    'run': result.testsRun,
+    'failures': len(result.failures),
+    'errors': len(result.errors),
+    'skipped': len(result.skipped),
+    'success': result.wasSuccessful(),
+  }
@@ -0,0 +1,625 @@
+'''
+  holds test cases for the app wide parts, encoding, compression, the database,
+  query stats, metrics, profiling, the app factory and the gunicorn settings
+'''
+import importlib.util
+import json
+import time
+import unittest
+import uuid
+from app.testing import app, db, TransactionTestCase
+
+class EncodingTestCase(unittest.TestCase):
+  '''
+    tests the response encoder
+  '''
+  def test_backends_agree(self):
+    '''
+      test both backends give the same compact sorted json, datetimes as iso 8601
+    '''
+    import datetime
+    from app.encoding import ResponseEncoder, orjson
+    payload = {'success': True, 'when': datetime.datetime(2022, 6, 1, 12, 30),
+      'drinks': [{'title': 'caf\u00e9', 'id': 1, 'recipe': [{'parts': 2}]}], 'big': 2 ** 70}
+    encoded = ResponseEncoder('json').dumps(payload)
+    self.assertEqual(json.loads(encoded)['when'], '2022-06-01T12:30:00')
+    self.assertTrue(encoded.startswith(b'{"big":'))
+    if orjson is not None:
+      self.assertEqual(ResponseEncoder('orjson').dumps(payload), encoded)
+    with self.assertRaises(ValueError):
+      ResponseEncoder('yaml')
+
+  def test_jsonify_and_encoded_bytes(self):
+    '''
+      test jsonify goes through the app encoder and bytes are sent as they are
+    '''
+    import datetime
+    from flask import jsonify
+    from app.encoding import json_response
+    with app.test_request_context():
+      self.assertEqual(jsonify(when=datetime.date(2022, 6, 1)).json, {'when': '2022-06-01'})
+      response = json_response(b'{"success":true}', status=201)
+      self.assertEqual((response.status_code, response.mimetype), (201, 'application/json'))
+      self.assertEqual(response.get_data(), b'{"success":true}')
+
+
+class CompressionTestCase(TransactionTestCase):
+  '''
+    tests response compression
+  '''
+  def tearDown(self):
+    app.config['COMPRESS_MIN_SIZE'] = 500
+    super().tearDown()
+
+  def test_menu_compressed_once(self):
+    '''
+      test the cached menu is gzipped once per version and still answers 304
+    '''
+    import gzip
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    plain = self.client().get('/api/drinks')
+    result = self.client().get('/api/drinks', headers={'Accept-Encoding': 'gzip'})
+    self.assertEqual(result.headers['Content-Encoding'], 'gzip')
+    self.assertIn('Accept-Encoding', result.headers['Vary'])
+    self.assertEqual(gzip.decompress(result.get_data()), plain.get_data())
+    etag = result.headers['ETag']
+    self.assertTrue(etag.startswith('W/'))
+    variants = app.extensions['menu_cache']._entries['drinks'][3]
+    self.assertIs(variants['gzip'], result.get_data())
+    result = self.client().get('/api/drinks', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    self.assertEqual(result.status_code, 304)
+
+  def test_negotiation_and_threshold(self):
+    '''
+      test the preferred encoding is picked and small bodies are sent as they are
+    '''
+    import zlib
+    result = self.client().get('/api/drink/test', headers={'Accept-Encoding': 'gzip'})
+    self.assertNotIn('Content-Encoding', result.headers)
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    result = self.client().get('/api/drink/test', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    self.assertEqual(result.headers['Content-Encoding'], 'deflate')
+    self.assertEqual(json.loads(zlib.decompress(result.get_data())), {'message': 'drink'})
+    result = self.client().get('/api/drink/test', headers={'Accept-Encoding': 'identity'})
+    self.assertNotIn('Content-Encoding', result.headers)
+
+
+class DatabaseTestCase(unittest.TestCase):
+  '''
+    tests the engine options and the test transactions
+  '''
+  def test_engine_options(self):
+    '''
+      test servers get pool recycle/pre ping, sqlite files a thread shared pool
+    '''
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.pool import QueuePool
+    from app.database import engine_options
+    config = {'DB_POOL_SIZE': 3, 'DB_POOL_RECYCLE': 60}
+    options = engine_options(config, make_url('postgresql://localhost/coffee'))
+    self.assertEqual((options['pool_size'], options['pool_recycle'], options['pool_pre_ping']), (3, 60, True))
+    options = engine_options(config, make_url('sqlite:///coffee.db'))
+    self.assertIs(options['poolclass'], QueuePool)
+    self.assertNotIn('pool_recycle', options)
+    self.assertEqual(engine_options(config, make_url('sqlite://')), {})
+    self.assertEqual(engine_options({'DB_POOL_SIZE': 0}, make_url('sqlite:///coffee.db')), {})
+
+  def test_sqlite_pragmas(self):
+    '''
+      test new sqlite connections run the configured pragmas
+    '''
+    with app.app_context():
+      connection = db.engine.connect()
+      try:
+        pragmas = [connection.exec_driver_sql('PRAGMA {}'.format(name)).scalar()
+          for name in ('journal_mode', 'synchronous', 'busy_timeout')]
+      finally:
+        connection.close()
+    self.assertEqual(pragmas, ['wal', 1, app.config['SQLITE_BUSY_TIMEOUT']])
+
+  def test_rollback_between_tests(self):
+    '''
+      test drinks committed by a test are gone after its tearDown
+    '''
+    from app.drink.models import Drink
+    from app.drink.tests import DrinkTestCase
+    inner = DrinkTestCase('test_get_drinks')
+    inner.setUp()
+    try:
+      with app.app_context():
+        Drink(title='rolled back {}'.format(uuid.uuid4().hex), recipe=[]).insert()
+        count = Drink.query.count()
+    finally:
+      inner.tearDown()
+    with app.app_context():
+      self.assertEqual(Drink.query.count(), count - 1)
+
+  def test_shard_balances_cases(self):
+    '''
+      test test case classes are split over workers by their number of tests
+    '''
+    from app.testing import shard
+    from app.drink.tests import DrinkTestCase
+    shards = shard([DrinkTestCase, EncodingTestCase, CompressionTestCase, DatabaseTestCase], 2)
+    self.assertEqual(len(shards), 2)
+    self.assertEqual(sorted(name for names in shards for name in names), sorted(['app.drink.tests.DrinkTestCase',
+      'app.tests.EncodingTestCase', 'app.tests.CompressionTestCase', 'app.tests.DatabaseTestCase']))
+    self.assertEqual(shard([EncodingTestCase], 8), [['app.tests.EncodingTestCase']])
+
+
+class QueryStatsTestCase(TransactionTestCase):
+  '''
+    tests per request query instrumentation
+  '''
+  def tearDown(self):
+    app.config['N_PLUS_ONE_THRESHOLD'] = 10
+    super().tearDown()
+
+  def test_server_timing_and_repeated_queries(self):
+    '''
+      test a request reports its query count and time, repeats are logged
+    '''
+    app.config['N_PLUS_ONE_THRESHOLD'] = 1
+    with self.assertLogs('app.queries', 'WARNING') as logs:
+      result = self.client().get('/api/drinks?limit=5')
+    timings = result.headers.getlist('Server-Timing')
+    self.assertRegex(timings[0], r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+    self.assertTrue(timings[1].startswith('app;dur='))
+    self.assertIn('possible n+1 in GET /api/drinks', logs.output[0])
+
+  def test_slow_query_log_shapes(self):
+    '''
+      test slow statements are logged with parameter types, not values
+    '''
+    from app.queries import after_cursor_execute, parameter_shape
+    self.assertEqual(parameter_shape((1, 'secret')), '(int, str)')
+    self.assertEqual(parameter_shape([('a', b'x')] * 3, executemany=True), '3 x (str, bytes)')
+    self.assertEqual(parameter_shape({'title': 'secret'}), '{title: str}')
+    conn = type('Connection', (), {'info': {'query_started': [0.0]}})()
+    with self.assertLogs('app.queries', 'WARNING') as logs:
+      after_cursor_execute(0, conn, None, 'SELECT 1 WHERE ? = ?', (1, 'secret'), None, False)
+    self.assertIn('SELECT 1 WHERE ? = ? parameters: (int, str)', logs.output[0])
+    self.assertNotIn('secret', logs.output[0])
+
+  def test_failed_statement(self):
+    '''
+      test a statement that raises is counted and leaves no start time behind
+    '''
+    from flask import g
+    from sqlalchemy.exc import OperationalError
+    from app.queries import start_request
+    with app.test_request_context(), db.engine.connect() as conn:
+      start_request()
+      with self.assertRaises(OperationalError):
+        conn.exec_driver_sql('SELECT * FROM no_such_table')
+      self.assertEqual(conn.info['query_started'], [])
+      self.assertEqual(g.query_stats.count, 1)
+      self.assertEqual(conn.exec_driver_sql('SELECT 1').scalar(), 1)
+      self.assertEqual(g.query_stats.count, 2)
+
+
+class MetricsTestCase(TransactionTestCase):
+  '''
+    tests the /metrics endpoint and the multiprocess registry
+  '''
+  def test_metrics_endpoint(self):
+    '''
+      test requests are counted by route template and status, auth errors by error
+    '''
+    self.client().get('/api/drinks?limit=5')
+    self.client().get('/api/drinks-detail')
+    result = self.client().get('/metrics')
+    self.assertEqual(result.status_code, 200)
+    self.assertTrue(result.mimetype.startswith('text/plain'))
+    body = result.get_data(as_text=True)
+    self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+    self.assertRegex(body, r'http_requests_total\{blueprint="drink",method="GET",'
+      r'route="/api/drinks",status="200"\} [1-9]')
+    self.assertRegex(body, r'auth_errors_total\{code="401",error="Unauthorized"\} [1-9]')
+    self.assertRegex(body, r'db_pool_checkouts_total\{database="[^"]+"\} [1-9]')
+    self.assertRegex(body, r'db_query_duration_seconds_count [1-9]')
+
+  def test_aggregates_worker_files(self):
+    '''
+      test values of every worker file are summed, gauges of exited workers dropped
+    '''
+    import tempfile
+    from app.metrics import Metrics, MmapValues
+    with tempfile.TemporaryDirectory() as directory:
+      registry = Metrics(directory)
+      registry.describe('jobs_total', 'counter', 'Jobs.')
+      registry.describe('busy', 'gauge', 'Busy.')
+      registry.describe('seconds', 'histogram', 'Seconds.', buckets=(0.1, 1))
+      registry.inc('jobs_total', {'kind': 'a'}, 2)
+      registry.inc('busy')
+      registry.observe('seconds', 0.5)
+      # a worker that has exited, pids above the kernel's pid_max are never alive
+      other = MmapValues('{}/metrics_{}.db'.format(directory, 2 ** 31 - 1), size=64)
+      for index in range(20):
+        other.add(('jobs_total', (('kind', 'b{}'.format(index)),)), 1)
+      other.add(('jobs_total', (('kind', 'a'),)), 3)
+      other.add(('busy', ()), 5)
+      other.close()
+      body = registry.render()
+      registry._values.close()
+    self.assertIn('jobs_total{kind="a"} 5', body)
+    self.assertIn('jobs_total{kind="b19"} 1', body)
+    self.assertIn('busy 1\n', body)
+    self.assertIn('seconds_bucket{le="0.1"} 0\nseconds_bucket{le="1"} 1\n'
+      'seconds_bucket{le="+Inf"} 1\nseconds_sum 0.5\nseconds_count 1\n', body)
+
+
+class ProfilingTestCase(TransactionTestCase):
+  '''
+    tests sampled request profiles and the report command
+  '''
+  def setUp(self):
+    import tempfile
+    super().setUp()
+    self.directory = tempfile.mkdtemp()
+    self.saved = {key: app.config.get(key) for key in ('PROFILE_DIR', 'PROFILE_SAMPLE_RATE',
+      'PROFILE_ENDPOINTS', 'PROFILE_KEEP', 'PROFILE_SECRET')}
+    app.config.update(PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=1.0,
+      PROFILE_ENDPOINTS=('drink.get_drinks',), PROFILE_KEEP=2, PROFILE_SECRET='profile secret')
+
+  def tearDown(self):
+    import shutil
+    app.config.update(self.saved)
+    shutil.rmtree(self.directory)
+    super().tearDown()
+
+  def test_sampled_endpoints_rotate(self):
+    '''
+      test sampled endpoints are profiled, others aren't, and old profiles are deleted
+    '''
+    import os
+    names = [self.client().get('/api/drinks').headers['X-Profile-Id'] for _ in range(3)]
+    result = self.client().get('/api/drink/test')
+    self.assertNotIn('X-Profile-Id', result.headers)
+    self.assertEqual(sorted(os.listdir(self.directory)), sorted(names[1:]))
+    from app.profiling import profile_endpoint, profile_paths
+    self.assertEqual(profile_endpoint(names[0]), 'drink.get_drinks')
+    self.assertEqual(profile_paths(self.directory, 'drink.get_drinks_detail'), [])
+
+  def test_signed_header_and_report(self):
+    '''
+      test a signed X-Profile header profiles any endpoint and the cli reports it
+    '''
+    from app.profiling import profile_token
+    app.config['PROFILE_SAMPLE_RATE'] = 0.0
+    result = self.client().get('/api/drink/test', headers={'X-Profile': '9999999999:forged'})
+    self.assertNotIn('X-Profile-Id', result.headers)
+    result = self.client().get('/api/drink/test',
+      headers={'X-Profile': profile_token('profile secret')})
+    self.assertIn('_drink-test_', result.headers['X-Profile-Id'])
+    output = app.test_cli_runner().invoke(args=['app', 'profiles', '--dir', self.directory,
+      '--endpoint', 'drink.test', '--top', '5']).output
+    self.assertIn('1 profiles', output)
+    self.assertIn('function calls', output)
+
+
+class ReplicaTestCase(unittest.TestCase):
+  '''
+    tests read replica routing, the replica is a second sqlite file synced by the test
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from app.auth.testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
+  def setUp(self):
+    import os, tempfile
+    from app import auth
+    app.testing = True
+    self.auth = auth
+    auth.jwks_store.load(self.key.jwks())
+    self.headers = {'Authorization': 'Bearer ' + self.key.mint(auth.AUTH0_DOMAIN,
+      auth.API_AUDIENCE, ['patch:drinks'])}
+    self.replica = os.path.join(tempfile.mkdtemp(), 'replica.db')
+    app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + self.replica}
+    with app.app_context():
+      db.create_all()
+    self.sync()
+
+  def tearDown(self):
+    import os, shutil
+    with app.app_context():
+      db.get_engine(app, bind='replica').dispose()
+    app.config['SQLALCHEMY_BINDS'] = {}
+    shutil.rmtree(os.path.dirname(self.replica))
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+
+  def sync(self):
+    '''
+      copies the primary into the replica
+    '''
+    import sqlite3
+    primary = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    replica = sqlite3.connect(self.replica)
+    try:
+      primary.backup(replica)
+    finally:
+      primary.close()
+      replica.close()
+
+  def titles(self, client, drink_id):
+    result = client.get('/api/drinks?limit=1&fields=title&after={}'.format(drink_id - 1))
+    return [drink['title'] for drink in result.json['drinks'] if drink['id'] == drink_id]
+
+  def test_reads_replica_and_sticks_after_write(self):
+    '''
+      test listings read the replica, a client that wrote reads the primary for a while
+    '''
+    from app.drink.models import Drink
+    title = 'replica test {}'.format(uuid.uuid4().hex)
+    with app.app_context():
+      drink_id = Drink(title=title, recipe=[]).insert().id
+    try:
+      writer, reader = app.test_client(), app.test_client()
+      # not replicated yet
+      self.assertEqual(self.titles(reader, drink_id), [])
+      self.sync()
+      self.assertEqual(self.titles(reader, drink_id), [title])
+      result = writer.patch('/api/drinks/{}'.format(drink_id), headers=self.headers,
+        json={'title': title + ' 2'})
+      self.assertIn('read_primary_until', result.headers['Set-Cookie'])
+      self.assertEqual(self.titles(writer, drink_id), [title + ' 2'])
+      self.assertEqual(self.titles(reader, drink_id), [title])
+      self.sync()
+      self.assertEqual(self.titles(reader, drink_id), [title + ' 2'])
+    finally:
+      with app.app_context():
+        Drink.query.get(drink_id).delete()
+
+
+class AppFactoryTestCase(unittest.TestCase):
+  '''
+    tests create_app, importing the package has no side effects and apps don't share state
+  '''
+  def test_import_is_cheap(self):
+    '''
+      test importing the package loads neither the blueprints nor alembic
+    '''
+    import os, subprocess, sys
+    source = ('import sys, app; print(",".join(name for name in ("app.drink.controllers", '
+      '"app.user.controllers", "flask_migrate", "jose") if name in sys.modules))')
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', source], cwd=backend, check=True,
+      capture_output=True, text=True).stdout
+    self.assertEqual(output.strip(), '')
+
+  def test_apps_are_isolated(self):
+    '''
+      test two apps with their own databases serve their own menus and caches
+    '''
+    import os, shutil, tempfile
+    from app import create_app
+    from app.drink.models import Drink
+    directory = tempfile.mkdtemp()
+    apps = []
+    try:
+      for index in range(2):
+        other = create_app(testing=True)
+        other.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, '{}.db'.format(index))
+        with other.app_context():
+          db.create_all()
+        apps.append(other)
+      with apps[0].app_context():
+        db.session.add(Drink(title='only in the first app', recipe=[{'name': 'water', 'color': 'blue', 'parts': 1}]))
+        db.session.commit()
+      menus = [[drink['title'] for drink in each.test_client().get('/api/drinks').json['drinks']] for each in apps]
+      self.assertEqual(menus, [['only in the first app'], []])
+      self.assertIsNot(apps[0].extensions['menu_cache'], apps[1].extensions['menu_cache'])
+      self.assertIsNot(apps[0].extensions['menu_events'], apps[1].extensions['menu_events'])
+    finally:
+      for each in apps:
+        with each.app_context():
+          db.get_engine().dispose()
+      shutil.rmtree(directory)
+
+
+@unittest.skipUnless(importlib.util.find_spec('gunicorn'), 'gunicorn is not installed')
+class GunicornTestCase(unittest.TestCase):
+  '''
+    tests gunicorn.conf.py, serves the app from a gunicorn process on a temporary database
+  '''
+  def setUp(self):
+    import os, socket, subprocess, sys, tempfile
+    from app import create_app
+    self.directory = tempfile.mkdtemp()
+    database = 'sqlite:///' + os.path.join(self.directory, 'coffee_shop.db')
+    other = create_app(testing=True)
+    other.config['SQLALCHEMY_DATABASE_URI'] = database
+    with other.app_context():
+      db.create_all()
+      db.get_engine().dispose()
+    with socket.socket() as probe:
+      probe.bind(('127.0.0.1', 0))
+      self.port = probe.getsockname()[1]
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # one worker with 4 threads, 2 of them for event streams
+    env = dict(os.environ, DATABASE_URL=database, GUNICORN_BIND='127.0.0.1:{}'.format(self.port),
+      WEB_CONCURRENCY='1', GUNICORN_THREADS='4', GUNICORN_REQUEST_THREADS='2', SSE_HEARTBEAT='0.2')
+    env.pop('SSE_MAX_CLIENTS', None)
+    self.server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:create_app()'], cwd=backend, env=env,
+      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while True:
+      try:
+        self.get('/api/drink/test')
+        break
+      except OSError:
+        if time.monotonic() > deadline or self.server.poll() is not None:
+          raise
+        time.sleep(0.1)
+
+  def tearDown(self):
+    import shutil
+    self.server.terminate()
+    self.server.wait(10)
+    shutil.rmtree(self.directory)
+
+  def connect(self, path):
+    import http.client
+    connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+    connection.request('GET', path)
+    return connection, connection.getresponse()
+
+  def get(self, path):
+    connection, response = self.connect(path)
+    try:
+      return response.status, response.read()
+    finally:
+      connection.close()
+
+  def test_event_streams_leave_threads_for_requests(self):
+    '''
+      test open event streams each hold a thread, past SSE_MAX_CLIENTS clients are sent away
+      and other requests are still answered
+    '''
+    streams = []
+    try:
+      for _ in range(2):
+        connection, response = self.connect('/api/drinks/events')
+        self.assertEqual(response.read(len(': connected\n\n')), b': connected\n\n')
+        streams.append(connection)
+      status, body = self.get('/api/drinks/events')
+      self.assertEqual((status, body), (200, b'retry: 10000\n\n'))
+      started = time.monotonic()
+      for _ in range(5):
+        self.assertEqual(self.get('/api/drink/test')[0], 200)
+      self.assertLess(time.monotonic() - started, 5)
+    finally:
+      for connection in streams:
+        connection.close()
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosqlite'), 'aiosqlite is not installed')
+class AsgiTestCase(unittest.TestCase):
+  '''
+    tests the ASGI app of the async serving mode, the routes without an async handler
+    run the flask app on its threads
+  '''
+  def setUp(self):
+    from app.asgi import AsgiApp
+    app.testing = True
+    self.asgi = AsgiApp(app, threads=2)
+
+  def test_sync_routes(self):
+    '''
+      test routes without an async handler and unknown paths are answered by the flask app
+    '''
+    from app.testing import run_asgi
+
+    async def requests(client):
+      return await client.get('/api/drink/test'), await client.get('/api/nothing-here'), \
+        await client.put('/api/drinks')
+    found, missing, method = run_asgi(requests, self.asgi)
+    self.assertEqual(found.json(), {'message': 'drink'})
+    self.assertEqual(missing.status_code, 404)
+    self.assertEqual(method.status_code, 405)
+    self.assertEqual(self.asgi.stats, {'async': 0, 'sync': 3})
+
+  def test_streamed_sync_route(self):
+    '''
+      test a streamed body is iterated on one thread, in the request context it was started in
+    '''
+    from app import auth
+    from app.auth.testing import LocalSigningKey
+    from app.drink.models import Drink
+    from app.testing import run_asgi
+    key = LocalSigningKey()
+    auth.jwks_store.load(key.jwks())
+    headers = {'Authorization': 'Bearer ' + key.mint(auth.AUTH0_DOMAIN, auth.API_AUDIENCE, ['get:drinks-detail'])}
+    title = 'asgi export {}'.format(uuid.uuid4().hex)
+    with app.app_context():
+      drink_id = Drink(title=title, recipe=[]).insert().id
+    try:
+      result = run_asgi(lambda client: client.get('/api/drinks/export', headers=headers), self.asgi)
+    finally:
+      with app.app_context():
+        Drink.query.get(drink_id).delete()
+      auth.jwks_store.clear()
+      auth.token_cache.clear()
+    self.assertEqual(result.status_code, 200)
+    self.assertIn(title, [json.loads(line)['title'] for line in result.text.splitlines()])
+
+  def test_lifespan(self):
+    '''
+      test the server's startup and shutdown messages are answered, shutdown closes the pools
+    '''
+    import asyncio
+    from app.database import get_async_engine
+
+    async def lifespan():
+      get_async_engine(app)
+      messages = asyncio.Queue()
+      sent = []
+
+      async def send(message):
+        sent.append(message['type'])
+      for message in ('lifespan.startup', 'lifespan.shutdown'):
+        messages.put_nowait({'type': message})
+      await self.asgi({'type': 'lifespan'}, messages.get, send)
+      return sent
+    self.assertEqual(asyncio.run(lifespan()), ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+    self.assertNotIn('async_engines', app.extensions)
+
+
+@unittest.skipUnless(importlib.util.find_spec('uvicorn') and importlib.util.find_spec('aiosqlite'),
+  'uvicorn or aiosqlite is not installed')
+class UvicornTestCase(unittest.TestCase):
+  '''
+    tests the async serving mode under uvicorn, on a temporary database
+  '''
+  def setUp(self):
+    import os, socket, subprocess, sys, tempfile
+    from app import create_app
+    self.directory = tempfile.mkdtemp()
+    database = 'sqlite:///' + os.path.join(self.directory, 'coffee_shop.db')
+    other = create_app(testing=True)
+    other.config['SQLALCHEMY_DATABASE_URI'] = database
+    with other.app_context():
+      db.create_all()
+      db.get_engine().dispose()
+    with socket.socket() as probe:
+      probe.bind(('127.0.0.1', 0))
+      self.port = probe.getsockname()[1]
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    self.server = subprocess.Popen([sys.executable, '-m', 'uvicorn', '--factory', 'app.asgi:create_asgi_app',
+      '--port', str(self.port), '--log-level', 'warning'], cwd=backend, env=dict(os.environ, DATABASE_URL=database),
+      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while True:
+      try:
+        self.get('/api/drink/test')
+        break
+      except OSError:
+        if time.monotonic() > deadline or self.server.poll() is not None:
+          raise
+        time.sleep(0.1)
+
+  def tearDown(self):
+    import shutil
+    self.server.terminate()
+    self.server.wait(10)
+    shutil.rmtree(self.directory)
+
+  def get(self, path):
+    import http.client
+    connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+    try:
+      connection.request('GET', path)
+      response = connection.getresponse()
+      return response.status, response.read()
+    finally:
+      connection.close()
+
+  def test_serves_async_and_sync_routes(self):
+    '''
+      test uvicorn serves the async drink listing and a sync route
+    '''
+    status, body = self.get('/api/drinks')
+    self.assertEqual((status, json.loads(body)), (200, {'success': True, 'drinks': []}))
+    self.assertEqual(self.get('/api/drinks/changes')[0], 200)
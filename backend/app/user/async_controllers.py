@@ -0,0 +1,96 @@
+'''
+  async handlers of the user routes for the async serving mode (app.asgi), the management
+  api calls wait on the event loop (app.auth.async_management) instead of holding a thread,
+  same responses as their sync routes in controllers
+'''
+import asyncio
+from flask import jsonify, request, abort
+from .bulk import is_transient, BULK_RETRIES, BULK_BACKOFF
+from .controllers import role_cache, change_roles_async, BARISTA_ROLES, MANAGER_ROLES
+from ..auth import AuthError, async_management, requires_authorization_async
+
+
+async def change_role(roles, added, removed):
+  '''
+    adds (POST) or removes (DELETE) roles of the user in the body
+    Args:
+      roles (list): role ids
+      added (str): message of a POST
+      removed (str): message of a DELETE
+  '''
+  data = request.get_json()
+  user_id = data['user_id']
+
+  if not user_id:
+    abort(422, 'user_id required')
+
+  try:
+    await change_roles_async(request.method, user_id, roles)
+  except Exception:
+    abort(500, 'error adding role' if request.method == 'POST' else 'error removing role')
+  return jsonify({
+    'success': True,
+    'message': added if request.method == 'POST' else removed
+  }), 201
+
+
+@requires_authorization_async(['post:baristas', 'post:managers'])
+async def manage_barista(permission):
+  return await change_role(BARISTA_ROLES, 'User added to barista role', 'Barista role has been removed')
+
+
+@requires_authorization_async('post:managers')
+async def manage_manager(permission):
+  return await change_role(MANAGER_ROLES, 'User added to manager role', 'Manager role has been removed')
+
+
+async def list_roles(user_id):
+  '''
+    the roles of a user, rate limits and server errors are retried with backoff
+    like the sdk's lookups
+  '''
+  attempt = 0
+  while True:
+    try:
+      return (await async_management.list_roles(user_id))['roles']
+    except Exception as error:
+      if attempt >= BULK_RETRIES or not is_transient(error):
+        raise
+      await asyncio.sleep(BULK_BACKOFF * 2 ** attempt)
+      attempt += 1
+
+
+@requires_authorization_async(['update:baristas', 'update:managers'])
+async def update_barista(permissions, barista_id):
+  # get data
+  request_data = request.get_json()
+  user_id = request_data['user_id']
+  new_username = request_data['username']
+  # checks
+  if new_username is None or user_id is None:
+    abort(400, description='Error in body data')
+
+  # verify user role of request, cached between role changes
+  user_roles = await role_cache.get_async(user_id, lambda: list_roles(user_id))
+  if any(role['name'] == 'Administrator' for role in user_roles):
+    # user is an admin, cant update
+    raise AuthError(description='User is an admin, cant update', code=403)
+
+  # perform update
+  try:
+    await async_management.update(user_id, {'username': new_username})
+  except Exception:
+    abort(500, description='Error updating username')
+  return jsonify({
+    'success': True,
+    'message': 'Username updated'
+  }), 201
+
+
+# endpoint -> handler, run by app.asgi instead of the blueprint's view,
+# not with MANAGEMENT_ASYNC, where the sync views queue jobs instead
+async_views = {
+  'user.manage_barista': manage_barista,
+  'user.manage_manager': manage_manager,
+  'user.update_barista': update_barista,
+}
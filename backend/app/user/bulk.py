@@ -0,0 +1,156 @@
+'''
+  fans management api calls for many users out over a bounded thread pool
+'''
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ as env
+
+# shared by all bulk requests so concurrent batches can't exceed it
+BULK_MAX_WORKERS = int(env.get('BULK_MAX_WORKERS', 8))
+BULK_RETRIES = int(env.get('BULK_RETRIES', 3))
+BULK_BACKOFF = float(env.get('BULK_BACKOFF', 0.2))
+# management api calls in flight at once per bulk request on the event loop, they don't take a thread each
+BULK_ASYNC_CONCURRENCY = int(env.get('BULK_ASYNC_CONCURRENCY', 50))
+# safe to send again after a connection failed mid request, POST and PATCH aren't
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+  '''
+    gets the process wide pool, created on first use
+  '''
+  global _executor
+  if _executor is None:
+    with _executor_lock:
+      if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS,
+          thread_name_prefix='mgmt-bulk')
+  return _executor
+
+
+def is_transient(error):
+  '''
+    rate limits, auth0 server errors and connection problems are worth retrying
+  '''
+  import requests
+  from auth0.v3.exceptions import Auth0Error
+  if isinstance(error, Auth0Error):
+    return is_transient_status(error.status_code)
+  if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+    return True
+  if 'httpx' in sys.modules:
+    # errors of the asyncio client, it's only loaded once that is used
+    return is_transient_httpx(error)
+  return False
+
+
+def is_transient_status(status_code):
+  return status_code == 429 or (isinstance(status_code, int) and status_code >= 500)
+
+
+def causes(error):
+  '''
+    the exceptions error was raised from, httpx wraps httpcore's which wrap the socket's
+  '''
+  while error is not None:
+    error = error.__cause__ or error.__context__
+    if error is not None:
+      yield error
+
+
+def is_transient_httpx(error):
+  '''
+    a failure before the request was sent is always retried, once it may have
+    reached auth0 only idempotent methods are, so a role change isn't applied twice
+  '''
+  import httpx
+  if isinstance(error, httpx.HTTPStatusError):
+    return is_transient_status(error.response.status_code)
+  if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+    # a certificate that doesn't verify won't on the next try either
+    return not any(isinstance(cause, ssl.SSLError) for cause in causes(error))
+  if isinstance(error, (httpx.ReadError, httpx.ReadTimeout, httpx.WriteError, httpx.WriteTimeout,
+      httpx.RemoteProtocolError)):
+    return error.request.method in IDEMPOTENT_METHODS
+  return False
+
+
+def call_with_retry(func, user_id, retries=None, backoff=None):
+  '''
+    calls func(user_id), retrying transient failures with exponential backoff
+    returns a per user result
+  '''
+  retries = BULK_RETRIES if retries is None else retries
+  backoff = BULK_BACKOFF if backoff is None else backoff
+  attempt = 0
+  while True:
+    try:
+      func(user_id)
+      return {'user_id': user_id, 'success': True}
+    except Exception as error:
+      if attempt >= retries or not is_transient(error):
+        return {'user_id': user_id, 'success': False, 'error': str(error)}
+      time.sleep(backoff * 2 ** attempt)
+      attempt += 1
+
+
+def run_bulk(func, user_ids, retries=None, backoff=None):
+  '''
+    calls func for every user id concurrently
+    Args:
+      func (callable): takes a user id, raises on failure
+      user_ids (list): user ids
+    returns the results in the order of user_ids
+  '''
+  executor = get_executor()
+  futures = [executor.submit(call_with_retry, func, user_id, retries, backoff)
+    for user_id in user_ids]
+  return [future.result() for future in futures]
+
+
+async def call_with_retry_async(func, user_id, retries=None, backoff=None):
+  '''
+    call_with_retry for a coroutine function, waits out the backoff without a thread
+  '''
+  import asyncio
+  retries = BULK_RETRIES if retries is None else retries
+  backoff = BULK_BACKOFF if backoff is None else backoff
+  attempt = 0
+  while True:
+    try:
+      await func(user_id)
+      return {'user_id': user_id, 'success': True}
+    except Exception as error:
+      if attempt >= retries or not is_transient(error):
+        return {'user_id': user_id, 'success': False, 'error': str(error)}
+      await asyncio.sleep(backoff * 2 ** attempt)
+      attempt += 1
+
+
+def run_bulk_async(func, user_ids, retries=None, backoff=None, concurrency=None):
+  '''
+    run_bulk on the shared event loop, the calling thread waits for the whole batch
+    while up to concurrency calls are in flight
+    Args:
+      func (callable): takes a user id, returns a coroutine that raises on failure
+      user_ids (list): user ids
+    returns the results in the order of user_ids
+  '''
+  import asyncio
+  from ..aio import event_loop
+  concurrency = BULK_ASYNC_CONCURRENCY if concurrency is None else concurrency
+
+  async def run_all():
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_one(user_id):
+      async with limit:
+        return await call_with_retry_async(func, user_id, retries, backoff)
+    return await asyncio.gather(*(run_one(user_id) for user_id in user_ids))
+  return event_loop.run(run_all())
@@ -0,0 +1,102 @@
+'''
+  cache of user roles from the management api
+'''
+import threading
+import time
+from collections import OrderedDict
+from ..metrics import metrics
+
+
+class RoleCache:
+  '''
+    RoleCache
+    user_id -> roles, entries expire after the ttl and are invalidated
+    when we change a user's roles ourselves, at most maxsize users are kept,
+    lookups are counted in role_cache_lookups_total on /metrics
+    Args:
+      ttl (int): seconds a user's roles are kept
+      maxsize (int): max number of users kept, the ones stored first are dropped
+  '''
+  def __init__(self, ttl=300, maxsize=1024):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+    # in the order they were stored, which is the order they expire in
+    self._entries = OrderedDict()
+    # bumped on invalidate so a load racing with a role change isn't stored
+    self._generation = 0
+    self._lock = threading.Lock()
+
+  def get(self, user_id, loader):
+    '''
+      gets the roles of a user, calling loader on a miss
+      Args:
+        user_id (str): auth0 user id
+        loader (callable): returns the roles list from the management api
+    '''
+    entry, generation = self._lookup(user_id)
+    if entry is not None:
+      return entry[0]
+    return self._store(user_id, loader(), generation)
+
+  async def get_async(self, user_id, loader):
+    '''
+      get for coroutines, loader is a coroutine function
+    '''
+    entry, generation = self._lookup(user_id)
+    if entry is not None:
+      return entry[0]
+    return self._store(user_id, await loader(), generation)
+
+  def _lookup(self, user_id):
+    # (entry or None on a miss, generation to store the loaded roles with)
+    with self._lock:
+      entry = self._entries.get(user_id)
+      hit = entry is not None and time.monotonic() - entry[1] < self.ttl
+      self.stats['hits' if hit else 'misses'] += 1
+      generation = self._generation
+    metrics.inc('role_cache_lookups_total', {'result': 'hit' if hit else 'miss'})
+    return entry if hit else None, generation
+
+  def _store(self, user_id, roles, generation):
+    with self._lock:
+      if generation == self._generation:
+        self._entries.pop(user_id, None)
+        self._entries[user_id] = (roles, time.monotonic())
+        self._sweep()
+    return roles
+
+  def _sweep(self):
+    # expired users from the front, then the oldest past maxsize
+    now = time.monotonic()
+    while self._entries:
+      user_id, (roles, stored) = next(iter(self._entries.items()))
+      if now - stored < self.ttl and len(self._entries) <= self.maxsize:
+        break
+      del self._entries[user_id]
+      self.stats['evictions'] += 1
+
+  def invalidate(self, user_id):
+    '''
+      drops a user's cached roles, call after changing them
+    '''
+    with self._lock:
+      self._generation += 1
+      if self._entries.pop(user_id, None) is not None:
+        self.stats['invalidations'] += 1
+
+  def hit_rate(self):
+    lookups = self.stats['hits'] + self.stats['misses']
+    return self.stats['hits'] / lookups if lookups else 0.0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def clear(self):
+    '''
+      drops all entries and counters
+    '''
+    with self._lock:
+      self._entries.clear()
+      for stat in self.stats:
+        self.stats[stat] = 0
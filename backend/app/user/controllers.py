@@ -1,13 +1,80 @@
 '''
   holds the blueprint routes for users
 '''
-from flask import Blueprint, jsonify, request, abort
+from os import environ as env
+from flask import Blueprint, jsonify, request, abort, current_app
 from .models import User
-from ..auth import AuthError, auth_management as auth_m, requires_authentication, requires_authorization
+from .cache import RoleCache
+from .bulk import run_bulk, run_bulk_async
+from .jobs import JobQueue
+from ..auth import AuthError, auth_management as auth_m, async_management, requires_authentication, \
+  requires_authorization
+from ..metrics import metrics
 
 # user bp
 user_bp = Blueprint('user', __name__)
 
+# user roles, invalidated by the role changes below
+role_cache = RoleCache(ttl=int(env.get('ROLE_CACHE_TTL', 300)), maxsize=int(env.get('ROLE_CACHE_SIZE', 1024)))
+
+# management api calls queued when MANAGEMENT_ASYNC is on
+job_queue = JobQueue(workers=int(env.get('JOB_WORKERS', 2)), poll_interval=float(env.get('JOB_POLL_INTERVAL', 1)),
+  timeout=float(env.get('JOB_TIMEOUT', 300)))
+
+BARISTA_ROLES = ['rol_PRrubjxSFgct2EQ2'] # barista role id
+MANAGER_ROLES = ['rol_VTeR8Pn9PCmMVWqI'] # manager role id
+# max users in one bulk request
+BULK_MAX_USERS = int(env.get('BULK_MAX_USERS', 100))
+
+@job_queue.handler('roles')
+def change_roles(method, user_id, roles):
+  '''
+    adds (POST) or removes (DELETE) roles, the user's cached roles are dropped either way
+  '''
+  try:
+    if method == 'POST':
+      auth_m.users.add_roles(user_id, roles)
+    else:
+      auth_m.users.remove_roles(user_id, roles)
+  finally:
+    role_cache.invalidate(user_id)
+
+
+async def change_roles_async(method, user_id, roles):
+  '''
+    change_roles on the event loop
+  '''
+  try:
+    if method == 'POST':
+      await async_management.add_roles(user_id, roles)
+    else:
+      await async_management.remove_roles(user_id, roles)
+  finally:
+    role_cache.invalidate(user_id)
+
+
+@job_queue.handler('username')
+def change_username(user_id, username):
+  auth_m.users.update(id=user_id, body={'username': username})
+
+
+def queue_job(kind, payload, key, user_id):
+  '''
+    queues a management api call, answers 202 with the job id
+  '''
+  job = job_queue.submit(kind, payload, key=key, shard=user_id)
+  return jsonify({
+    'success': True,
+    'job_id': job.job_id,
+    'status': job.status
+  }), 202
+
+
+def queue_role_change(user_id, roles):
+  # only identical requests coalesce, an add then a remove for the same user both run, in order
+  return queue_job('roles', {'method': request.method, 'user_id': user_id, 'roles': roles}, None, user_id)
+
+
 @user_bp.route('users/test')
 def test():
   # test
@@ -19,17 +86,19 @@ def test():
 def manage_barista(permission):
   data = request.get_json()
   user_id = data['user_id']
-  roles = ['rol_PRrubjxSFgct2EQ2'] # barista role id
+  roles = BARISTA_ROLES
   
   if not user_id:
     abort(422, 'user_id required')
 
+  if current_app.config.get('MANAGEMENT_ASYNC'):
+    # answer now, the role change runs on a job worker
+    return queue_role_change(user_id, roles)
+
   if request.method == 'POST':
     # add role
     try:
-      # i feel i should be using async here?
-      # not sure how that works in python for now
-      auth_m.users.add_roles(user_id, roles)
+      change_roles('POST', user_id, roles)
       return jsonify({
         'success': True,
         'message': 'User added to barista role'
@@ -39,7 +108,7 @@ def manage_barista(permission):
   elif request.method == 'DELETE':
     # remove role
     try:
-      auth_m.users.remove_roles(user_id, roles)
+      change_roles('DELETE', user_id, roles)
       return jsonify({
         'success': True,
         'message': 'Barista role has been removed'
@@ -55,15 +124,18 @@ def manage_barista(permission):
 def manage_manager(permission):
   data = request.get_json()
   user_id = data['user_id']
-  roles = ['rol_VTeR8Pn9PCmMVWqI'] # manager role id
+  roles = MANAGER_ROLES
   
   if not user_id:
     abort(422, 'user_id required')
 
+  if current_app.config.get('MANAGEMENT_ASYNC'):
+    return queue_role_change(user_id, roles)
+
   if request.method == 'POST':
     # add role
     try:
-      auth_m.users.add_roles(user_id, roles)
+      change_roles('POST', user_id, roles)
       return jsonify({
         'success': True,
         'message': 'User added to manager role'
@@ -73,7 +145,7 @@ def manage_manager(permission):
   elif request.method == 'DELETE':
     # remove role
     try:
-      auth_m.users.remove_roles(user_id, roles)
+      change_roles('DELETE', user_id, roles)
       return jsonify({
         'success': True,
         'message': 'Manager role has been removed'
@@ -84,6 +156,48 @@ def manage_manager(permission):
   abort(405, 'method not allowed')
 
 
+def manage_roles_bulk(roles):
+  '''
+    adds (POST) or removes (DELETE) roles for a list of users
+    the management api calls run concurrently, returns per user results
+  '''
+  data = request.get_json()
+  user_ids = data.get('user_ids') if isinstance(data, dict) else None
+  if not user_ids or not isinstance(user_ids, list) \
+      or not all(isinstance(user_id, str) and user_id for user_id in user_ids):
+    abort(422, 'user_ids required')
+  if len(user_ids) > BULK_MAX_USERS:
+    abort(422, 'at most {} user_ids per request'.format(BULK_MAX_USERS))
+
+  method = request.method
+  # dedupe, keep order
+  user_ids = list(dict.fromkeys(user_ids))
+  if current_app.config.get('MANAGEMENT_CLIENT') == 'asyncio' and not auth_m.overridden:
+    # one coroutine per user on the event loop instead of a pool thread per call
+    results = run_bulk_async(lambda user_id: change_roles_async(method, user_id, roles), user_ids)
+  else:
+    results = run_bulk(lambda user_id: change_roles(method, user_id, roles), user_ids)
+  failed = len([result for result in results if not result['success']])
+  return jsonify({
+    'success': failed == 0,
+    'updated': len(results) - failed,
+    'failed': failed,
+    'results': results
+  }), 200 if failed == 0 else 207
+
+
+@user_bp.route('/baristas/edit/bulk', methods=['POST', 'DELETE'])
+@requires_authorization(['post:baristas', 'post:managers'])
+def manage_baristas_bulk(permission):
+  return manage_roles_bulk(BARISTA_ROLES)
+
+
+@user_bp.route('/managers/edit/bulk', methods=['POST', 'DELETE'])
+@requires_authorization('post:managers')
+def manage_managers_bulk(permission):
+  return manage_roles_bulk(MANAGER_ROLES)
+
+
 @user_bp.route('/baristas/<barista_id>', methods=['PATCH'])
 @requires_authorization(['update:baristas', 'update:managers'])
 def update_barista(permissions, barista_id):
@@ -95,12 +209,16 @@ def update_barista(permissions, barista_id):
   if new_username is None or user_id is None:
     abort(400, description='Error in body data')
     
-  # verify user role of request
-  user_roles = auth_m.users.list_roles(id=user_id)['roles']
+  # verify user role of request, cached between role changes
+  user_roles = role_cache.get(user_id, lambda: auth_m.users.list_roles(id=user_id)['roles'])
   if len(list(filter(lambda x: x['name'] == 'Administrator', user_roles))) > 0:
     # user is an admin, cant update
     raise AuthError(description='User is an admin, cant update', code=403)
   
+  if current_app.config.get('MANAGEMENT_ASYNC'):
+    # newest username wins if an update for this user is still queued
+    return queue_job('username', {'user_id': user_id, 'username': new_username}, ['username', user_id], user_id)
+
   # perform update
   try:
     auth_m.users.update(id=user_id, body={'username': new_username})
@@ -112,8 +230,21 @@ def update_barista(permissions, barista_id):
     abort(500, description='Error updating username')
 
 
+@user_bp.route('/jobs/<job_id>', methods=['GET'])
+@requires_authorization(['post:baristas', 'post:managers', 'update:baristas', 'update:managers'])
+def get_job(permission, job_id):
+  job = job_queue.get(job_id)
+  if job is None:
+    abort(404, 'job not found')
+  return jsonify({
+    'success': True,
+    'job': job.format()
+  })
+
+
 @user_bp.errorhandler(AuthError)
 def handle_auth_error(exception):
+  metrics.inc('auth_errors_total', {'error': exception.error, 'code': exception.code})
   return jsonify({
     'success': False,
     'code': exception.code,
@@ -0,0 +1,195 @@
+'''
+  job queue for slow management api calls, kept in the jobs table so every worker
+  process can run a job and report its status, each process runs them on its own threads
+'''
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import orm
+from app import db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ('queued', 'running')
+
+
+class JobQueue:
+  '''
+    JobQueue
+    runs the jobs of its handlers from the jobs table on worker threads, started in a
+    process by its first submit or status lookup, jobs with the same shard (e.g. user id)
+    run one at a time in submit order, whichever process picks them up,
+    a job submitted while another with the same key is the last one queued for
+    its shard replaces that one's payload instead of being queued again
+    Args:
+      workers (int): number of worker threads in each process
+      poll_interval (float): seconds between looks for jobs queued by other processes
+      timeout (float): seconds after which a running job is taken as lost with its process
+      keep (int): finished jobs kept for status lookups
+  '''
+  def __init__(self, workers=2, poll_interval=1.0, timeout=300, keep=1000):
+    self.workers = workers
+    self.poll_interval = poll_interval
+    self.timeout = timeout
+    self.keep = keep
+    self.handlers = {}
+    # this process' counts
+    self.stats = {'submitted': 0, 'coalesced': 0, 'succeeded': 0, 'failed': 0}
+    self._app = None
+    # the workers' sessions, apart from db.session so they don't share a request's transaction
+    self._session = None
+    self._threads = []
+    self._wakeup = threading.Event()
+    self._lock = threading.Lock()
+
+  def handler(self, kind):
+    '''
+      decorator, registers the function run for jobs of a kind with their payload
+      as keyword arguments
+    '''
+    def register(func):
+      self.handlers[kind] = func
+      return func
+    return register
+
+  def _count(self, stat):
+    with self._lock:
+      self.stats[stat] += 1
+
+  def submit(self, kind, payload, key=None, shard=None):
+    '''
+      queues a job and commits, returns it, needs an app context
+      Args:
+        kind (str): name of a registered handler
+        payload (dict): json keyword arguments of the handler
+        key (list): e.g. ['username', user_id], jobs with equal keys are coalesced,
+          defaults to the kind and payload, so only identical jobs are
+        shard (str): jobs with the same shard keep their submit order, defaults to key
+    '''
+    if kind not in self.handlers:
+      raise KeyError('no handler for {} jobs'.format(kind))
+    key = json.dumps(key if key is not None else [kind, payload], sort_keys=True)
+    shard = shard if shard is not None else key
+    self._count('submitted')
+    last = db.session.query(Job.id, Job.key, Job.status).filter(Job.shard == shard) \
+      .order_by(Job.id.desc()).first()
+    # ends the read, sqlite can't turn a read transaction another connection wrote past into a write,
+    # the conditions of the writes below are what counts
+    db.session.commit()
+    if last is not None and last.key == key and last.status == 'queued':
+      # newest payload wins, unless a worker took the job or another one was queued behind it
+      newest = db.session.query(db.func.max(Job.id)).filter(Job.shard == shard).scalar_subquery()
+      coalesced = Job.query.filter(Job.id == last.id, Job.status == 'queued', Job.id == newest) \
+        .update({Job.payload: payload, Job.coalesced: Job.coalesced + 1}, synchronize_session=False)
+      if coalesced:
+        db.session.commit()
+        self._count('coalesced')
+        return Job.query.get(last.id)
+    job = Job(job_id=uuid.uuid4().hex, kind=kind, payload=payload, key=key, shard=shard,
+      status='queued', date_created=datetime.utcnow())
+    db.session.add(job)
+    db.session.flush()
+    # drop the oldest finished jobs past keep
+    Job.query.filter(Job.id <= job.id - self.keep, Job.status.notin_(ACTIVE)) \
+      .delete(synchronize_session=False)
+    db.session.commit()
+    self._start(current_app._get_current_object())
+    self._wakeup.set()
+    return job
+
+  def get(self, job_id):
+    '''
+      the job with a job id from any process, None if unknown, needs an app context
+    '''
+    # this process helps with the queue from now on
+    self._start(current_app._get_current_object())
+    return Job.query.filter(Job.job_id == job_id).one_or_none()
+
+  def join(self, timeout=10):
+    '''
+      waits until no job of this queue's kinds is queued or running
+    '''
+    if self._app is None:
+      return
+    deadline = time.monotonic() + timeout
+    active = db.select(Job.id).where(Job.kind.in_(list(self.handlers)), Job.status.in_(ACTIVE)).limit(1)
+    while time.monotonic() < deadline:
+      # own connection, leaves the caller's session and its transaction alone
+      with db.get_engine(self._app).connect() as connection:
+        if connection.execute(active).first() is None:
+          return
+      time.sleep(0.01)
+    raise TimeoutError('jobs still running after {} seconds'.format(timeout))
+
+  def _start(self, app):
+    with self._lock:
+      if self._app is None:
+        self._app = app
+        self._session = orm.sessionmaker(bind=db.get_engine(app))
+      while len(self._threads) < self.workers:
+        thread = threading.Thread(target=self._work, daemon=True,
+          name='mgmt-job-{}'.format(len(self._threads)))
+        thread.start()
+        self._threads.append(thread)
+
+  def _claim(self, session):
+    '''
+      marks the oldest queued job of a shard with nothing before it running, None if there is none
+    '''
+    now = datetime.utcnow()
+    lost = session.query(Job).filter(Job.status == 'running',
+      Job.date_started < now - timedelta(seconds=self.timeout))
+    found = lost.first() is not None
+    session.commit()
+    if found:
+      # its process stopped, don't hold up the rest of the shard
+      lost.update({Job.status: 'failed', Job.error: 'worker stopped before the job finished',
+        Job.date_finished: now}, synchronize_session=False)
+      session.commit()
+    earlier = orm.aliased(Job)
+    blocked = session.query(earlier.id).filter(earlier.shard == Job.shard, earlier.id < Job.id,
+      earlier.status.in_(ACTIVE)).exists()
+    candidates = session.query(Job.id, Job.kind, Job.payload) \
+      .filter(Job.status == 'queued', Job.kind.in_(list(self.handlers)), ~blocked) \
+      .order_by(Job.id).limit(self.workers).all()
+    session.commit()
+    for candidate in candidates:
+      # another thread or process may have taken it meanwhile
+      claimed = session.query(Job).filter(Job.id == candidate.id, Job.status == 'queued') \
+        .update({Job.status: 'running', Job.date_started: now}, synchronize_session=False)
+      session.commit()
+      if claimed:
+        return candidate
+    return None
+
+  def _run(self, session, job):
+    try:
+      self.handlers[job.kind](**job.payload)
+      status, error = 'succeeded', None
+    except Exception as exception:
+      status, error = 'failed', str(exception)
+    session.query(Job).filter(Job.id == job.id).update({Job.status: status, Job.error: error,
+      Job.date_finished: datetime.utcnow()}, synchronize_session=False)
+    session.commit()
+    self._count(status)
+
+  def _work(self):
+    while True:
+      # set by submits of this process, other processes' jobs are found by polling
+      self._wakeup.clear()
+      job = None
+      try:
+        with self._app.app_context(), self._session() as session:
+          job = self._claim(session)
+          if job is not None:
+            self._run(session, job)
+      except Exception:
+        logger.exception('job worker failed')
+        time.sleep(self.poll_interval)
+      if job is None:
+        self._wakeup.wait(self.poll_interval)
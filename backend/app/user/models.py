@@ -32,4 +32,43 @@ class User(Base):
     self.email = email
 
   def __repr__(self):
-    return f'<User id:{self.id} name:{self.name}>'
\ No newline at end of file
+    return f'<User id:{self.id} name:{self.name}>'
+
+class Job(db.Model):
+  '''
+    Job Model
+    a queued management api call, in the database so every worker process can run it
+    and answer GET /jobs/<job_id> for it
+  '''
+  __tablename__ = 'jobs'
+  # ids are the run order, never reused after old jobs are dropped
+  __table_args__ = (db.Index('ix_jobs_status_shard', 'status', 'shard'), {'sqlite_autoincrement': True})
+
+  id = db.Column(db.Integer, primary_key=True)
+  job_id = db.Column(db.String(32), nullable=False, unique=True)
+  # name of the JobQueue handler, called with the payload as keyword arguments
+  kind = db.Column(db.String(64), nullable=False)
+  payload = db.Column(db.JSON, nullable=False)
+  # equal keys are coalesced, jobs of a shard (e.g. a user id) run in id order
+  key = db.Column(db.String(512), nullable=False)
+  shard = db.Column(db.String(255), nullable=False)
+  # queued, running, succeeded or failed
+  status = db.Column(db.String(16), nullable=False, default='queued')
+  error = db.Column(db.Text, nullable=True)
+  coalesced = db.Column(db.Integer, nullable=False, default=0)
+  date_created = db.Column(db.DateTime, nullable=False)
+  date_started = db.Column(db.DateTime, nullable=True)
+  date_finished = db.Column(db.DateTime, nullable=True)
+
+  def format(self):
+    return {
+      'id': self.job_id,
+      'status': self.status,
+      'error': self.error,
+      'coalesced': self.coalesced,
+      'created': self.date_created.isoformat(),
+      'finished': self.date_finished.isoformat() if self.date_finished else None
+    }
+
+  def __repr__(self):
+    return f'<Job id:{self.job_id} kind:{self.kind} status:{self.status}>'
@@ -1,11 +1,16 @@
 '''
   holds test cases for the user module
 '''
+import importlib.util
+import time
 import unittest
-from app import app, db
+import uuid
+from datetime import datetime, timedelta
+from app.testing import app, db, TransactionTestCase
 from dotenv import load_dotenv
 from os import environ as env
 import http.client
+from unittest.mock import patch
 
 # loadenv .env
 load_dotenv()
@@ -19,39 +24,449 @@ ALGORITHMS = env.get("ALGORITHMS", ['RS256'])
 
 # implement uittest later
 
-class UserTestCase(unittest.TestCase):
+class UserTestCase(TransactionTestCase):
   '''
-    base class for user tests
+    base class for user tests, each test is rolled back
   '''
+  def test_basic_route(self):
+    '''
+      test something
+    '''
+    result = self.client().get('/api/users/test')
+    self.assertEqual(result.status_code, 200)
+    self.assertIn('test', result.json['message'])
+    
+  
+class UserRolesTestCase(unittest.TestCase):
+  '''
+    tests the role endpoints against a local stand in for the management api
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from app.auth.testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
   def setUp(self):
     '''
       set up
-      Define test variables and initialize app.
+      serves the local key set and a fake management api
     '''
+    from app import auth
+    from app.auth.testing import FakeManagement
+    from .controllers import role_cache
     app.testing = True
-    self.app = app
-    self.client = self.app.test_client
-    # binds the app to the current context
-    with self.app.app_context():
-      self.db = db 
-      # create all tables
-      self.db.create_all()
-    pass
-
+    self.client = app.test_client
+    self.auth = auth
+    self.role_cache = role_cache
+    self.fake = FakeManagement(role_names={'rol_admin': 'Administrator'})
+    auth.jwks_store.load(self.key.jwks())
+    auth.auth_management.override(self.fake)
+    role_cache.clear()
+    self.headers = {'Authorization': 'Bearer ' + self.key.mint(AUTH0_DOMAIN, API_AUDIENCE,
+      ['post:baristas', 'post:managers', 'update:baristas'])}
 
   def tearDown(self):
     '''
       tear down
     '''
-    pass
-  
-  
-  def test_basic_route(self):
+    self.auth.auth_management.reset()
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+    self.role_cache.clear()
+
+  def patch_username(self, user_id):
+    return self.client().patch('/api/baristas/' + user_id, headers=self.headers,
+      json={'user_id': user_id, 'username': 'new name'})
+
+  def test_admin_check_is_cached(self):
     '''
-      test something
+      test repeat updates look up the roles once
     '''
-    result = self.client().get('/api/users/test')
+    for _ in range(3):
+      self.assertEqual(self.patch_username('auth0|barista').status_code, 201)
+    self.assertEqual(self.fake.users.count('list_roles'), 1)
+    self.assertEqual(self.fake.users.count('update'), 3)
+    self.assertAlmostEqual(self.role_cache.hit_rate(), 2 / 3)
+    body = self.client().get('/metrics').get_data(as_text=True)
+    self.assertIn('role_cache_lookups_total{result="hit"}', body)
+    self.assertIn('role_cache_lookups_total{result="miss"}', body)
+
+  def test_role_cache_is_bounded(self):
+    '''
+      test the oldest users are dropped past maxsize and expired ones as new ones are stored
+    '''
+    from .cache import RoleCache
+    cache = RoleCache(ttl=300, maxsize=2)
+    for user_id in ('a', 'b', 'c'):
+      cache.get(user_id, lambda: [user_id])
+    self.assertEqual(len(cache), 2)
+    self.assertEqual(cache.get('c', lambda: None), ['c'])
+    self.assertEqual(cache.stats['evictions'], 1)
+    cache.ttl = 0
+    cache.get('d', lambda: ['d'])
+    self.assertEqual(len(cache), 0)
+
+  def test_role_change_invalidates(self):
+    '''
+      test our own role changes are seen by the admin check
+    '''
+    self.assertEqual(self.patch_username('auth0|barista').status_code, 201)
+    self.fake.users.add_roles('auth0|barista', ['rol_admin'])
+    result = self.client().post('/api/baristas/edit', headers=self.headers,
+      json={'user_id': 'auth0|barista'})
+    self.assertEqual(result.status_code, 201)
+    self.assertEqual(self.patch_username('auth0|barista').status_code, 403)
+    self.assertEqual(self.fake.users.count('list_roles'), 2)
+
+  def test_bulk_add_and_remove(self):
+    '''
+      test a batch of users is promoted and demoted in one request
+    '''
+    from .controllers import BARISTA_ROLES
+    user_ids = ['auth0|user-{}'.format(i) for i in range(10)]
+    result = self.client().post('/api/baristas/edit/bulk', headers=self.headers,
+      json={'user_ids': user_ids})
     self.assertEqual(result.status_code, 200)
-    self.assertIn('test', result.json['message'])
-    
-  
\ No newline at end of file
+    self.assertEqual(result.json['updated'], 10)
+    self.assertEqual([r['user_id'] for r in result.json['results']], user_ids)
+    self.assertTrue(all(self.fake.users.roles[u] == set(BARISTA_ROLES) for u in user_ids))
+    result = self.client().delete('/api/baristas/edit/bulk', headers=self.headers,
+      json={'user_ids': user_ids})
+    self.assertEqual(result.status_code, 200)
+    self.assertTrue(all(not self.fake.users.roles[u] for u in user_ids))
+
+  def test_bulk_on_the_event_loop(self):
+    '''
+      test MANAGEMENT_CLIENT=asyncio runs the batch as coroutines against the management api
+    '''
+    from app.auth.testing import FakeAuth0Server
+    from .controllers import MANAGER_ROLES
+    server = FakeAuth0Server(latency=0.02).start()
+    provider = self.auth.auth_management
+    saved = provider.domain, provider.protocol
+    provider.override(None)
+    provider.domain, provider.protocol = server.domain, 'http'
+    user_ids = ['auth0|loop-{}'.format(i) for i in range(20)]
+    try:
+      with patch.dict(app.config, {'MANAGEMENT_CLIENT': 'asyncio'}):
+        result = self.client().post('/api/managers/edit/bulk', headers=self.headers,
+          json={'user_ids': user_ids})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([r['user_id'] for r in result.json['results']], user_ids)
+        self.assertTrue(all(server.roles[u] == set(MANAGER_ROLES) for u in user_ids))
+        result = self.client().delete('/api/managers/edit/bulk', headers=self.headers,
+          json={'user_ids': user_ids})
+        self.assertEqual(result.json['updated'], 20)
+        self.assertTrue(all(not server.roles[u] for u in user_ids))
+    finally:
+      provider.domain, provider.protocol = saved
+      server.stop()
+
+  def test_bulk_retries_transient_failures(self):
+    '''
+      test a 503 from the management api is retried and a 404 is reported
+    '''
+    from auth0.v3.exceptions import Auth0Error
+    failures = {'auth0|flaky': [Auth0Error(503, 'unavailable', 'try again')],
+      'auth0|missing': [Auth0Error(404, 'inexistent_user', 'not found')] * 5}
+    add_roles = self.fake.users.add_roles
+    def flaky_add_roles(id, roles):
+      if failures.get(id):
+        raise failures[id].pop(0)
+      add_roles(id, roles)
+    self.fake.users.add_roles = flaky_add_roles
+    with patch('app.user.bulk.BULK_BACKOFF', 0):
+      result = self.client().post('/api/managers/edit/bulk', headers=self.headers,
+        json={'user_ids': ['auth0|flaky', 'auth0|missing']})
+    self.assertEqual(result.status_code, 207)
+    self.assertEqual([r['success'] for r in result.json['results']], [True, False])
+
+  def test_bulk_requires_user_ids(self):
+    '''
+      test an empty batch is rejected
+    '''
+    result = self.client().post('/api/managers/edit/bulk', headers=self.headers,
+      json={'user_ids': []})
+    self.assertEqual(result.status_code, 422)
+
+  def test_async_role_change(self):
+    '''
+      test async mode answers 202 and the job status is reported
+    '''
+    from .controllers import job_queue, MANAGER_ROLES
+    app.config['MANAGEMENT_ASYNC'] = True
+    try:
+      result = self.client().post('/api/managers/edit', headers=self.headers,
+        json={'user_id': 'auth0|queued'})
+    finally:
+      app.config['MANAGEMENT_ASYNC'] = False
+    self.assertEqual(result.status_code, 202)
+    job_queue.join()
+    self.assertEqual(self.fake.users.roles['auth0|queued'], set(MANAGER_ROLES))
+    result = self.client().get('/api/jobs/' + result.json['job_id'], headers=self.headers)
+    self.assertEqual(result.json['job']['status'], 'succeeded')
+
+  def test_async_add_remove_add(self):
+    '''
+      test the last of a queued add, remove and add for a user wins
+    '''
+    from .controllers import job_queue, MANAGER_ROLES
+    user_id = 'auth0|add-remove-add'
+    app.config['MANAGEMENT_ASYNC'] = True
+    try:
+      hold_shard(job_queue, user_id)
+      for method in ('post', 'delete', 'post'):
+        result = getattr(self.client(), method)('/api/managers/edit', headers=self.headers,
+          json={'user_id': user_id})
+        self.assertEqual(result.status_code, 202)
+    finally:
+      app.config['MANAGEMENT_ASYNC'] = False
+    job_queue.join()
+    self.assertEqual(self.fake.users.roles[user_id], set(MANAGER_ROLES))
+
+  def test_async_add_then_remove(self):
+    '''
+      test a queued add followed by a remove for the same user are not coalesced
+    '''
+    from .controllers import job_queue
+    user_id = 'auth0|add-remove'
+    app.config['MANAGEMENT_ASYNC'] = True
+    try:
+      # holds the user's shard so both changes are still queued
+      hold_shard(job_queue, user_id)
+      added = self.client().post('/api/managers/edit', headers=self.headers, json={'user_id': user_id})
+      removed = self.client().delete('/api/managers/edit', headers=self.headers, json={'user_id': user_id})
+    finally:
+      app.config['MANAGEMENT_ASYNC'] = False
+    job_queue.join()
+    self.assertNotEqual(added.json['job_id'], removed.json['job_id'])
+    self.assertEqual(self.fake.users.roles.get(user_id, set()), set())
+    for result in (added, removed):
+      job = self.client().get('/api/jobs/' + result.json['job_id'], headers=self.headers).json['job']
+      self.assertEqual((job['status'], job['coalesced']), ('succeeded', 0))
+
+  def test_async_username_coalesces(self):
+    '''
+      test a queued username update is replaced by the newest one for the user
+    '''
+    from .controllers import job_queue
+    user_id = 'auth0|renamed'
+    app.config['MANAGEMENT_ASYNC'] = True
+    try:
+      hold_shard(job_queue, user_id)
+      first = self.client().patch('/api/baristas/' + user_id, headers=self.headers,
+        json={'user_id': user_id, 'username': 'first'})
+      second = self.client().patch('/api/baristas/' + user_id, headers=self.headers,
+        json={'user_id': user_id, 'username': 'second'})
+    finally:
+      app.config['MANAGEMENT_ASYNC'] = False
+    job_queue.join()
+    self.assertEqual(first.json['job_id'], second.json['job_id'])
+    self.assertEqual(self.fake.users.profiles[user_id], {'username': 'second'})
+    self.assertEqual(self.fake.users.count('update'), 1)
+
+
+def hold_shard(job_queue, shard, seconds=0.05):
+  '''
+    queues a job that keeps a shard busy for a moment, so the next ones stay queued,
+    returns its job id
+  '''
+  job_queue.handler('sleep')(lambda seconds: time.sleep(seconds))
+  with app.app_context():
+    return job_queue.submit('sleep', {'seconds': seconds}, shard=shard).job_id
+
+
+class JobQueueTestCase(unittest.TestCase):
+  '''
+    tests the management api job queue, each test has its own job kinds
+    since the queues of earlier tests keep polling the jobs table
+  '''
+  def setUp(self):
+    self.ctx = app.app_context()
+    self.ctx.push()
+    self.kind = uuid.uuid4().hex
+    self.calls = []
+    self.job_queue = self.queue()
+
+  def tearDown(self):
+    db.session.remove()
+    self.ctx.pop()
+
+  def queue(self):
+    '''
+      a queue as another process would have it, recording the names of its calls
+    '''
+    from .jobs import JobQueue
+    job_queue = JobQueue(workers=1, poll_interval=0.05)
+    job_queue.handler(self.kind)(lambda name: self.calls.append(name))
+    job_queue.handler(self.kind + '-fail')(lambda: 1 / 0)
+    return job_queue
+
+  def join(self, job_queue=None):
+    (job_queue or self.job_queue).join()
+    # ends the read transaction of the test's session, it may be from before the jobs ran
+    db.session.rollback()
+
+  def test_pending_jobs_coalesce(self):
+    '''
+      test a queued job with the same key is replaced by the newest call
+    '''
+    blocker = hold_shard(self.job_queue, 'a')
+    first = self.job_queue.submit(self.kind, {'name': 'first'}, key=['username', 'a'], shard='a')
+    second = self.job_queue.submit(self.kind, {'name': 'second'}, key=['username', 'a'], shard='a')
+    self.join()
+    self.assertEqual(first.job_id, second.job_id)
+    self.assertEqual(self.calls, ['second'])
+    self.assertEqual(self.job_queue.get(first.job_id).coalesced, 1)
+    self.assertEqual(self.job_queue.get(blocker).status, 'succeeded')
+
+  def test_coalesce_keeps_order(self):
+    '''
+      test a job only folds into the last one queued for its shard, add, remove, add runs all three
+    '''
+    hold_shard(self.job_queue, 'user')
+    for name in ('add', 'remove', 'add', 'add'):
+      self.job_queue.submit(self.kind, {'name': name}, key=[name, 'user'], shard='user')
+    self.join()
+    self.assertEqual(self.calls, ['add', 'remove', 'add'])
+    self.assertEqual(self.job_queue.stats['coalesced'], 1)
+
+  def test_failed_job(self):
+    '''
+      test a failing call marks the job failed with the error
+    '''
+    job = self.job_queue.submit(self.kind + '-fail', {})
+    self.join()
+    job = self.job_queue.get(job.job_id)
+    self.assertEqual(job.status, 'failed')
+    self.assertIn('division', job.error)
+
+  def test_jobs_shared_between_processes(self):
+    '''
+      test a job queued by one process is reported by another, and run there in shard order
+    '''
+    from .models import Job
+    other = self.queue()
+    job = self.job_queue.submit(self.kind, {'name': 'first'}, shard='shared')
+    # queued as if by a process that hasn't started its workers
+    for name in ('second', 'third'):
+      db.session.add(Job(job_id=uuid.uuid4().hex, kind=self.kind, payload={'name': name},
+        key=name, shard='shared', status='queued', date_created=datetime.utcnow()))
+    db.session.commit()
+    self.assertEqual(other.get(job.job_id).job_id, job.job_id)
+    self.join(other)
+    self.assertEqual(self.calls, ['first', 'second', 'third'])
+
+  def test_lost_job_fails(self):
+    '''
+      test a job left running by a stopped process is failed so its shard moves on
+    '''
+    from .models import Job
+    lost = Job(job_id=uuid.uuid4().hex, kind=self.kind, payload={'name': 'lost'}, key='lost',
+      shard='lost', status='running', date_created=datetime.utcnow(),
+      date_started=datetime.utcnow() - timedelta(seconds=self.job_queue.timeout + 1))
+    db.session.add(lost)
+    db.session.commit()
+    job = self.job_queue.submit(self.kind, {'name': 'next'}, shard='lost')
+    self.join()
+    self.assertEqual(self.job_queue.get(lost.job_id).status, 'failed')
+    self.assertEqual(self.job_queue.get(job.job_id).status, 'succeeded')
+    self.assertEqual(self.calls, ['next'])
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosqlite'), 'aiosqlite is not installed')
+class UserAsgiTestCase(unittest.TestCase):
+  '''
+    tests the async user handlers of the async serving mode against the fake Auth0 server
+  '''
+  @classmethod
+  def setUpClass(cls):
+    from app.auth.testing import LocalSigningKey
+    cls.key = LocalSigningKey()
+
+  def setUp(self):
+    from app import auth
+    from app.auth.testing import FakeAuth0Server
+    from .controllers import role_cache
+    app.testing = True
+    self.auth = auth
+    self.role_cache = role_cache
+    self.server = FakeAuth0Server().start()
+    provider = auth.auth_management
+    self.saved = provider.domain, provider.protocol
+    provider.override(None)
+    provider.domain, provider.protocol = self.server.domain, 'http'
+    auth.async_management.reset()
+    auth.jwks_store.load(self.key.jwks())
+    role_cache.clear()
+    self.headers = {'Authorization': 'Bearer ' + self.key.mint(AUTH0_DOMAIN, API_AUDIENCE,
+      ['post:baristas', 'post:managers', 'update:baristas'])}
+
+  def tearDown(self):
+    provider = self.auth.auth_management
+    provider.domain, provider.protocol = self.saved
+    provider.reset()
+    self.auth.async_management.reset()
+    self.auth.jwks_store.clear()
+    self.auth.token_cache.clear()
+    self.role_cache.clear()
+    self.server.stop()
+
+  def test_manage_roles(self):
+    '''
+      test role changes are made on the event loop, concurrently, with the sync responses
+    '''
+    from app.asgi import AsgiApp
+    from app.testing import run_asgi
+    from .controllers import BARISTA_ROLES, MANAGER_ROLES
+    asgi = AsgiApp(app, threads=1)
+    user_ids = ['auth0|asgi-{}'.format(i) for i in range(10)]
+
+    async def requests(client):
+      import asyncio
+      added = await asyncio.gather(*[client.post('/api/baristas/edit', headers=self.headers,
+        json={'user_id': user_id}) for user_id in user_ids])
+      removed = await client.request('DELETE', '/api/managers/edit', headers=self.headers,
+        json={'user_id': user_ids[0]})
+      return added, removed
+    self.server.roles[user_ids[0]] = set(MANAGER_ROLES)
+    added, removed = run_asgi(requests, asgi)
+    self.assertEqual({result.status_code for result in added}, {201})
+    self.assertEqual(added[0].json()['message'], 'User added to barista role')
+    self.assertEqual(removed.json()['message'], 'Manager role has been removed')
+    self.assertEqual(self.server.roles[user_ids[0]], set(BARISTA_ROLES))
+    self.assertTrue(all(self.server.roles[user_id] == set(BARISTA_ROLES) for user_id in user_ids))
+    self.assertEqual(asgi.stats, {'async': 11, 'sync': 0})
+
+  def test_update_barista(self):
+    '''
+      test the admin check retries a rate limited role lookup and caches the roles,
+      admins are refused
+    '''
+    from app.testing import run_asgi
+
+    async def requests(client):
+      results = []
+      for user_id in ('auth0|asgi-user', 'auth0|asgi-user', 'auth0|asgi-admin'):
+        results.append(await client.patch('/api/baristas/' + user_id, headers=self.headers,
+          json={'user_id': user_id, 'username': 'new name'}))
+      return results
+    self.server.roles['auth0|asgi-admin'] = {'Administrator'}
+    self.server.rate_limited = 1
+    with patch('app.user.async_controllers.BULK_BACKOFF', 0.01):
+      updated, cached, admin = run_asgi(requests)
+    self.assertEqual((updated.status_code, updated.json()['message']), (201, 'Username updated'))
+    self.assertEqual(cached.status_code, 201)
+    self.assertEqual(admin.status_code, 403)
+    self.assertEqual(self.server.rate_limited, 0)
+    self.assertEqual(self.role_cache.stats['hits'], 1)
+
+  def test_management_async_uses_sync_views(self):
+    '''
+      test with MANAGEMENT_ASYNC the user routes are left to the sync views that queue jobs
+    '''
+    from app.asgi import AsgiApp
+    with patch.dict(app.config, {'MANAGEMENT_ASYNC': True}):
+      asgi = AsgiApp(app, threads=1)
+    self.assertNotIn('user.manage_barista', asgi.views)
+    self.assertIn('drink.get_drinks', asgi.views)
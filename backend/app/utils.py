@@ -1,7 +1,14 @@
+'''
+  flask app cli commands, registered by create_app
+'''
 import click
+from flask import current_app
 from flask.cli import AppGroup
-from app import app, db
-from .drink.models import Drink
+from app import db
+from .drink.models import Drink, DrinkTombstone, MenuEvent, MenuVersion
+from .drink.bulk import import_drinks, export_drinks, gzip_chunks
+from .drink.search import rebuild as rebuild_search
+from .profiling import profile_paths, profile_token, report, setting as profile_setting
 
 # create a cli group
 app_cli = AppGroup('app')
@@ -17,17 +24,84 @@ def db_tables(action='create'):
 
 @app_cli.command('dbrows')
 @click.argument('action')
-def db_tables(action='create'):
+@click.argument('path', required=False, type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--mode', type=click.Choice(['upsert', 'insert']), default='upsert',
+  help='import: update existing titles or report them as conflicts')
+def db_tables(action='create', path=None, mode='upsert'):
   new_drinks =['drink 1', 'drink 2', 'drink 3']
   if action == 'create':
     for value, index in enumerate(new_drinks):
       drink = Drink(title='title {}'.format(value), recipe=[{'color': 'blue', 'name': 'name {}'.format(value), 'parts': 'parts {}'.format(index)}])
       db.session.add(drink)
+    MenuEvent.record('reload')
+    MenuVersion.bump()
     db.session.commit()
   elif action == 'drop':
+    # tombstones so delta sync clients drop them too
+    db.session.execute(DrinkTombstone.__table__.insert()
+      .from_select(['drink_id'], db.select(Drink.id)))
+    DrinkTombstone.prune()
     Drink.query.delete()
+    MenuEvent.record('reload')
+    MenuVersion.bump()
     db.session.commit()
   elif action == 'get':
     print(Drink.query.all())
-    
-app.cli.add_command(app_cli)
\ No newline at end of file
+  elif action == 'import':
+    # json array or ndjson file, - for stdin
+    if path is None:
+      raise click.UsageError('import needs a file path')
+    with click.open_file(path, 'rb') as stream:
+      report = import_drinks(stream, update=mode == 'upsert').format()
+    click.echo('inserted: {inserted}, updated: {updated}, conflicts: {conflicts}, invalid: {invalid}'
+      .format(**report))
+    for problem in report['errors']:
+      click.echo('row {row}: {title}: {error}'.format(**problem), err=True)
+
+
+@app_cli.command('export')
+@click.argument('path', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the output')
+def db_export(path='-', compress=False):
+  # every drink as ndjson, - for stdout
+  chunks = export_drinks()
+  if compress:
+    chunks = gzip_chunks(chunks)
+  with click.open_file(path, 'wb') as output:
+    for chunk in chunks:
+      output.write(chunk)
+
+
+@app_cli.command('search-rebuild')
+def search_rebuild():
+  # reindexes every drink for GET /drinks/search, creates the index when it's missing
+  count = rebuild_search()
+  db.session.commit()
+  click.echo('indexed {} drinks'.format(count))
+
+
+@app_cli.command('profiles')
+@click.option('--dir', 'directory', type=click.Path(file_okay=False), help='defaults to PROFILE_DIR')
+@click.option('--endpoint', help='only profiles of this endpoint, e.g. drink.get_drinks_detail')
+@click.option('--sort', type=click.Choice(['cumulative', 'tottime', 'calls']), default='cumulative')
+@click.option('--top', type=int, default=20, help='number of functions listed')
+def profiles_report(directory=None, endpoint=None, sort='cumulative', top=20):
+  # hottest functions over every stored profile
+  directory = directory or profile_setting(current_app.config, 'PROFILE_DIR')
+  if not directory:
+    raise click.UsageError('set PROFILE_DIR or pass --dir')
+  paths = profile_paths(directory, endpoint)
+  if not paths:
+    raise click.ClickException('no profiles in {}'.format(directory))
+  click.echo('{} profiles'.format(len(paths)))
+  click.echo(report(paths, sort, top))
+
+
+@app_cli.command('profile-token')
+@click.option('--seconds', type=int, default=300, help='seconds the header is valid')
+def profiles_token(seconds=300):
+  # X-Profile header value to profile chosen requests
+  secret = profile_setting(current_app.config, 'PROFILE_SECRET')
+  if not secret:
+    raise click.UsageError('set PROFILE_SECRET first')
+  click.echo('X-Profile: {}'.format(profile_token(secret, seconds)))
@@ -0,0 +1,3 @@
+'''
+  benchmarks, run from the backend directory, e.g. python -m benchmarks.bench_auth
+'''
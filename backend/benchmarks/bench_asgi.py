@@ -0,0 +1,59 @@
+'''
+  the sync mode (gunicorn gthread worker, a thread per request in flight) against the async
+  serving mode (uvicorn, app.asgi, the drink listings and user routes as coroutines)
+  at high concurrency, through the load test environment with injected Auth0 latency,
+  one worker process each, the role cache is off so every PATCH looks up the user's roles,
+  the async management client may open a connection per client like the threads do
+  python -m benchmarks.bench_asgi [clients] [latency seconds] [requests] [threads]
+'''
+import contextlib
+import os
+import sys
+
+ROUTES = ('POST /api/baristas/edit', 'PATCH /api/baristas/<barista_id>', 'GET /api/drinks-detail', 'GET /api/drinks')
+
+
+def run(environment, name, count, clients):
+  from .loadtest.runner import ScenarioRun
+  from .loadtest.scenarios import SCENARIOS
+  scenario = next(scenario for scenario in SCENARIOS if scenario.name == name)
+  return ScenarioRun(environment, scenario, count, clients, warmup=clients).run()
+
+
+def report(label, result):
+  print('{:<52} {:>7} rps  p50 {:>9} ms  p95 {:>9} ms  errors {}'.format(label,
+    result['rps'], result['p50_ms'], result['p95_ms'], result['errors']))
+
+
+def main(clients=256, latency=0.05, requests=2000, threads=64):
+  devnull = open(os.devnull, 'w')
+  with contextlib.redirect_stdout(devnull):
+    from app import auth, create_app
+    from app.aio import AsyncClient
+    from app.user.controllers import role_cache
+    from .loadtest.environment import LoadTestEnvironment
+  app = create_app()
+  print('clients: {}, injected Auth0 latency: {:.0f} ms, requests per run: {}, gunicorn threads: {}'.format(
+    clients, latency * 1000, requests, threads))
+  management = auth.async_management
+  saved = role_cache.ttl, management.http
+  role_cache.ttl = 0
+  management.http = AsyncClient(pool_size=clients, timeout=saved[1].timeout)
+  try:
+    with devnull:
+      for server in ('gunicorn', 'uvicorn'):
+        with LoadTestEnvironment(app, scale=100, auth0_latency=latency, server=server,
+            threads=threads) as environment:
+          for name in ROUTES:
+            with contextlib.redirect_stdout(devnull):
+              result = run(environment, name, requests, clients)
+            report('{}, {}'.format(name, server), result)
+  finally:
+    role_cache.ttl, management.http = saved
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 256,
+    float(sys.argv[2]) if len(sys.argv) > 2 else 0.05,
+    int(sys.argv[3]) if len(sys.argv) > 3 else 2000,
+    int(sys.argv[4]) if len(sys.argv) > 4 else 64)
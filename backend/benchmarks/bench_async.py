@@ -0,0 +1,61 @@
+'''
+  thread pool vs event loop for the outbound Auth0 calls at high concurrency, through
+  the load test environment (served app, fake Auth0 with injected latency)
+    bulk role changes with MANAGEMENT_CLIENT threads (BULK_MAX_WORKERS threads) and asyncio,
+    with MGMT_POOL_SIZE connections and with 50, which takes no more threads
+    token checks while the jwks keeps expiring, refreshed in the request or in the background
+  python -m benchmarks.bench_async [clients] [latency seconds] [requests]
+'''
+import contextlib
+import os
+import sys
+
+
+def run(environment, name, count, clients):
+  from .loadtest.runner import ScenarioRun
+  from .loadtest.scenarios import SCENARIOS
+  scenario = next(scenario for scenario in SCENARIOS if scenario.name == name)
+  return ScenarioRun(environment, scenario, count, clients, warmup=clients).run()
+
+
+def report(label, result):
+  print('{:<40} {:>7} rps  p50 {:>9} ms  p95 {:>9} ms  errors {}'.format(label,
+    result['rps'], result['p50_ms'], result['p95_ms'], result['errors']))
+
+
+def main(clients=32, latency=0.05, requests=200):
+  devnull = open(os.devnull, 'w')
+  with contextlib.redirect_stdout(devnull):
+    from app import auth, create_app
+    from app.aio import AsyncClient
+    from .loadtest.environment import LoadTestEnvironment
+  app = create_app()
+  print('clients: {}, injected Auth0 latency: {:.0f} ms, requests per run: {}'.format(clients,
+    latency * 1000, requests))
+  store, tokens, management = auth.jwks_store, auth.token_cache, auth.async_management
+  saved = store.ttl, store.min_refresh_interval, store.background, tokens.maxsize, management.http
+  with devnull, LoadTestEnvironment(app, scale=100, auth0_latency=latency) as environment:
+    try:
+      for mode, pool_size in (('threads', None), ('asyncio', saved[-1].pool_size), ('asyncio', 50)):
+        app.config['MANAGEMENT_CLIENT'] = mode
+        if pool_size:
+          management.http = AsyncClient(pool_size=pool_size, timeout=saved[-1].timeout)
+        with contextlib.redirect_stdout(devnull):
+          result = run(environment, 'POST /api/baristas/edit/bulk', requests // 4, clients)
+        report('bulk roles, {}{}'.format(mode, ', {} connections'.format(pool_size) if pool_size else ''), result)
+      # every token is checked against a key set that is always expired
+      tokens.maxsize = 0
+      store.ttl, store.min_refresh_interval = 0, 0
+      for background in (False, True):
+        store.background = background
+        with contextlib.redirect_stdout(devnull):
+          result = run(environment, 'GET /api/drinks-detail', requests, clients)
+        report('expiring jwks, {}'.format('background refresh' if background else 'refresh in request'), result)
+    finally:
+      store.ttl, store.min_refresh_interval, store.background, tokens.maxsize, management.http = saved
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 32,
+    float(sys.argv[2]) if len(sys.argv) > 2 else 0.05,
+    int(sys.argv[3]) if len(sys.argv) > 3 else 200)
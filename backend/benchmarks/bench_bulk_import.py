@@ -0,0 +1,59 @@
+'''
+  bulk drink import into a temporary sqlite database from a generated ndjson file
+    python -m benchmarks.bench_bulk_import [drinks]
+'''
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from app import create_app, db
+from app.drink.bulk import import_drinks
+
+app = create_app()
+
+
+def write_ndjson(path, count):
+  with open(path, 'w') as ndjson:
+    for i in range(count):
+      ndjson.write(json.dumps({'title': 'imported {}'.format(i), 'recipe': [
+        {'name': 'espresso', 'color': '#3b2313', 'parts': 1},
+        {'name': 'milk', 'color': '#f2efe6', 'parts': i % 4 + 1}
+      ]}) + '\n')
+
+
+def main(count=100000):
+  directory = tempfile.mkdtemp()
+  source = os.path.join(directory, 'drinks.ndjson')
+  write_ndjson(source, count)
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app.config['SQLALCHEMY_ECHO'] = False
+  # debug query recording would keep every bound row in memory
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  try:
+    with app.app_context():
+      db.create_all()
+      rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      for label in ('insert', 'upsert'):
+        start = time.perf_counter()
+        with open(source, 'rb') as stream:
+          report = import_drinks(stream).format()
+        elapsed = time.perf_counter() - start
+        print('{}: {} drinks in {:.2f} s ({:.0f} rows/s), inserted {}, updated {}'.format(
+          label, count, elapsed, count / elapsed, report['inserted'], report['updated']))
+      rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      print('file size: {:.1f} MB, peak rss growth: {:.1f} MB'.format(
+        os.path.getsize(source) / 1e6, (rss_after - rss_before) / 1024))
+      db.session.remove()
+      db.get_engine().dispose()
+  finally:
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
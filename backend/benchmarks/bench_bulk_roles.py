@@ -0,0 +1,50 @@
+'''
+  role assignment throughput, one POST /baristas/edit per user vs POST /baristas/edit/bulk
+  against a local fake management api with injected latency
+    python -m benchmarks.bench_bulk_roles [users] [latency seconds]
+'''
+import sys
+import time
+from app import auth, create_app
+from app.auth.testing import FakeAuth0Server, LocalSigningKey
+
+app = create_app()
+
+
+def main(users=50, latency=0.05):
+  server = FakeAuth0Server(latency=latency).start()
+  provider = auth.auth_management
+  domain, protocol = provider.domain, provider.protocol
+  provider.domain, provider.protocol = server.domain, 'http'
+  provider.reset()
+  key = LocalSigningKey()
+  auth.jwks_store.load(key.jwks())
+  headers = {'Authorization': 'Bearer ' + key.mint(auth.AUTH0_DOMAIN, auth.API_AUDIENCE,
+    ['post:baristas', 'post:managers'])}
+  client = app.test_client()
+  user_ids = ['auth0|bench-{}'.format(i) for i in range(users)]
+  try:
+    # warm the management token and the connection pool
+    client.post('/api/baristas/edit', headers=headers, json={'user_id': 'auth0|warmup'})
+
+    start = time.perf_counter()
+    for user_id in user_ids:
+      client.post('/api/baristas/edit', headers=headers, json={'user_id': user_id})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = client.post('/api/baristas/edit/bulk', headers=headers, json={'user_ids': user_ids})
+    bulk = time.perf_counter() - start
+    assert result.json['updated'] == users, result.json
+  finally:
+    provider.domain, provider.protocol = domain, protocol
+    provider.reset()
+    server.stop()
+  print('users: {}, injected latency: {:.0f} ms'.format(users, latency * 1000))
+  print('one request per user: {:.2f} s ({:.0f} users/s)'.format(single, users / single))
+  print('bulk request:         {:.2f} s ({:.0f} users/s)'.format(bulk, users / bulk))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+    float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
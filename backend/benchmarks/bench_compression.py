@@ -0,0 +1,58 @@
+'''
+  size and request time of GET /drinks with a 5k drink menu, uncompressed,
+  gzipped on every request and served from the precompressed cache entry
+    python -m benchmarks.bench_compression [drinks]
+'''
+import os
+import sys
+import tempfile
+import timeit
+from app import create_app, db
+from app.drink.bulk import import_drinks
+from .bench_bulk_import import write_ndjson
+
+app = create_app()
+
+ROUNDS = 50
+
+
+def main(count=5000):
+  directory = tempfile.mkdtemp()
+  source = os.path.join(directory, 'drinks.ndjson')
+  write_ndjson(source, count)
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app.config['SQLALCHEMY_ECHO'] = False
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  client = app.test_client()
+  try:
+    with app.app_context():
+      db.create_all()
+      with open(source, 'rb') as stream:
+        import_drinks(stream)
+    cases = [
+      ('uncompressed', {}, False),
+      ('gzip every request', {'Accept-Encoding': 'gzip'}, True),
+      ('gzip precompressed', {'Accept-Encoding': 'gzip'}, False),
+    ]
+    for label, headers, uncached in cases:
+      def get():
+        if uncached:
+          # a fresh dict per request, nothing is kept between requests
+          app.extensions['menu_cache']._entries['drinks'][3].clear()
+        return client.get('/api/drinks', headers=headers)
+      size = len(get().get_data())
+      seconds = min(timeit.repeat(get, number=ROUNDS, repeat=3)) / ROUNDS
+      print('{:<20} {:8.1f} KB {:7.2f} ms/request'.format(label, size / 1024, seconds * 1000))
+    with app.app_context():
+      db.session.remove()
+      db.get_engine().dispose()
+  finally:
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
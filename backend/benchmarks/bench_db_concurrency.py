@@ -0,0 +1,94 @@
+'''
+  concurrent read/write load on a temporary sqlite database, with the old settings
+  (rollback journal, no pool) and the configured ones (WAL, synchronous=NORMAL, pool)
+    python -m benchmarks.bench_db_concurrency [readers] [writers] [seconds]
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+from app import create_app, db
+from app.drink.models import Drink
+
+app = create_app()
+
+SETTINGS = [
+  ('journal=delete, no pool', {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_MMAP_SIZE': 0, 'DB_POOL_SIZE': 0}),
+  ('journal=wal, pool', {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024, 'DB_POOL_SIZE': 5}),
+]
+
+
+def reader(stop, counts):
+  with app.app_context():
+    while not stop.is_set():
+      try:
+        Drink.query.order_by(Drink.id.desc()).limit(50).all()
+        counts['reads'] += 1
+      except Exception:
+        db.session.rollback()
+        counts['errors'] += 1
+      finally:
+        db.session.remove()
+
+
+def writer(stop, counts, index):
+  with app.app_context():
+    i = 0
+    while not stop.is_set():
+      i += 1
+      try:
+        Drink(title='load {} {}'.format(index, i), recipe=[{'name': 'milk', 'parts': i}]).insert()
+        counts['writes'] += 1
+      except Exception:
+        db.session.rollback()
+        counts['errors'] += 1
+      finally:
+        db.session.remove()
+
+
+def run(path, settings, readers, writers, seconds):
+  app.config.update(settings)
+  # a new url makes flask-sqlalchemy build a new engine with the settings
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+  with app.app_context():
+    db.create_all()
+  counts = {'reads': 0, 'writes': 0, 'errors': 0}
+  stop = threading.Event()
+  threads = [threading.Thread(target=reader, args=(stop, counts)) for _ in range(readers)] + \
+    [threading.Thread(target=writer, args=(stop, counts, i)) for i in range(writers)]
+  for thread in threads:
+    thread.start()
+  time.sleep(seconds)
+  stop.set()
+  for thread in threads:
+    thread.join()
+  with app.app_context():
+    db.get_engine().dispose()
+  return counts
+
+
+def main(readers=8, writers=4, seconds=5):
+  directory = tempfile.mkdtemp()
+  saved = {key: app.config.get(key) for key in
+    ['SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ECHO'] + list(SETTINGS[0][1])}
+  app.config['SQLALCHEMY_ECHO'] = False
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  try:
+    print('{} readers, {} writers, {} s each'.format(readers, writers, seconds))
+    for index, (label, settings) in enumerate(SETTINGS):
+      counts = run(os.path.join(directory, 'bench{}.db'.format(index)), settings, readers, writers, seconds)
+      print('{:<24} reads {:7.0f}/s  writes {:6.0f}/s  errors {}'.format(label,
+        counts['reads'] / seconds, counts['writes'] / seconds, counts['errors']))
+  finally:
+    app.config.update(saved)
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  args = [int(arg) for arg in sys.argv[1:4]]
+  main(*args)
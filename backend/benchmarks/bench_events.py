@@ -0,0 +1,70 @@
+'''
+  delivery latency of menu events to many event stream clients of one process,
+  each client is a thread consuming the same generator the endpoint returns
+    python -m benchmarks.bench_events [clients] [changes]
+'''
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from app import create_app, db
+from app.drink.events import EventBroker
+from app.drink.models import Drink
+
+app = create_app()
+
+
+def consume(broker, subscription, changes, received):
+  for chunk in broker.stream(subscription, []):
+    if chunk.startswith('id: '):
+      received.append(time.perf_counter())
+      if len(received) == changes:
+        return
+
+
+def main(clients=500, changes=20):
+  directory = tempfile.mkdtemp()
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app.config['SQLALCHEMY_ECHO'] = False
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  try:
+    with app.app_context():
+      db.create_all()
+      broker = EventBroker()
+      broker.start(app)
+      threads, deliveries = [], []
+      for _ in range(clients):
+        received = []
+        subscription, backlog = broker.subscribe()
+        thread = threading.Thread(target=consume, args=(broker, subscription, changes, received), daemon=True)
+        thread.start()
+        threads.append(thread)
+        deliveries.append(received)
+      written = []
+      start = time.perf_counter()
+      for i in range(changes):
+        Drink(title='event bench {}'.format(i), recipe=[]).insert()
+        written.append(time.perf_counter())
+        time.sleep(0.1)
+      for thread in threads:
+        thread.join(timeout=10)
+      elapsed = time.perf_counter() - start
+      latencies = [(received[i] - written[i]) * 1000 for received in deliveries for i in range(len(received))]
+      print('{} clients, {} changes: {} deliveries, latency median {:.0f} ms, max {:.0f} ms'.format(
+        clients, changes, len(latencies), statistics.median(latencies), max(latencies)))
+      print('db reads: {} polls in {:.1f} s, for all clients together, dropped clients: {}'.format(
+        broker.stats['polls'], elapsed, broker.stats['dropped']))
+      db.session.remove()
+  finally:
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  args = [int(arg) for arg in sys.argv[1:3]]
+  main(*args)
@@ -0,0 +1,70 @@
+'''
+  peak python memory of the ndjson export against building the full drinks-detail body,
+  at two table sizes in a temporary sqlite database
+    python -m benchmarks.bench_export [drinks]
+'''
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from app import create_app, db
+from app.drink.bulk import import_drinks, export_drinks
+from app.drink.models import Drink
+from .bench_bulk_import import write_ndjson
+
+app = create_app()
+
+
+def full_body():
+  drinks = Drink.query.all()
+  return json.dumps({'success': True, 'drinks': [drink.format() for drink in drinks]}).encode('utf-8')
+
+
+def streamed_body():
+  size = 0
+  for chunk in export_drinks():
+    size += len(chunk)
+  return size
+
+
+def measure(label, func):
+  db.session.remove()
+  tracemalloc.start()
+  start = time.perf_counter()
+  func()
+  elapsed = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  print('  {}: {:.2f} s, peak {:.1f} MB'.format(label, elapsed, peak / 1e6))
+
+
+def main(count=50000):
+  directory = tempfile.mkdtemp()
+  source = os.path.join(directory, 'drinks.ndjson')
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app.config['SQLALCHEMY_ECHO'] = False
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  try:
+    with app.app_context():
+      db.create_all()
+      for size in (count // 2, count):
+        write_ndjson(source, size)
+        with open(source, 'rb') as stream:
+          import_drinks(stream)
+        print('{} drinks'.format(size))
+        measure('full body', full_body)
+        measure('ndjson export', streamed_body)
+      db.session.remove()
+      db.get_engine().dispose()
+  finally:
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
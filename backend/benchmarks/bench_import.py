@@ -0,0 +1,39 @@
+'''
+  cold start time of `import app` and of `import app` plus create_app(),
+  each run in a fresh interpreter
+    python -m benchmarks.bench_import [runs]
+'''
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCES = [
+  ('import app', 'import app'),
+  ('create_app', 'import app; app.create_app()'),
+]
+
+
+def time_import(runs, source='import app'):
+  timings = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', source], cwd=BACKEND_DIR, check=True,
+      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings.append(time.perf_counter() - start)
+  return timings
+
+
+def main(runs=10):
+  print('runs: {}'.format(runs))
+  for name, source in SOURCES:
+    timings = time_import(runs, source)
+    print('{} median: {:.0f} ms'.format(name, statistics.median(timings) * 1000))
+    print('{} min:    {:.0f} ms'.format(name, min(timings) * 1000))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
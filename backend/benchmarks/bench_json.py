@@ -0,0 +1,54 @@
+'''
+  encode time of a 5k drink menu with flask's default jsonify, jsonify through
+  the response encoder and the encoder's bytes directly
+    python -m benchmarks.bench_json [drinks]
+'''
+import sys
+import timeit
+from flask import jsonify
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from app import create_app
+from app.encoding import ResponseEncoder, JSONEncoder, json_response, orjson
+
+app = create_app()
+
+ROUNDS = 20
+
+
+def menu(count):
+  return {'success': True, 'drinks': [{
+    'id': i,
+    'title': 'drink {}'.format(i),
+    'recipe': [
+      {'name': 'espresso', 'color': '#3b2313', 'parts': 1},
+      {'name': 'milk', 'color': '#f2efe6', 'parts': i % 4 + 1}
+    ]
+  } for i in range(count)]}
+
+
+def report(label, func):
+  seconds = min(timeit.repeat(func, number=ROUNDS, repeat=3)) / ROUNDS
+  print('{:<28} {:7.2f} ms'.format(label, seconds * 1000))
+
+
+def main(count=5000):
+  payload = menu(count)
+  json_encoder, debug = app.json_encoder, app.debug
+  # compact output as in production, debug pretty prints
+  app.debug = False
+  with app.test_request_context():
+    app.json_encoder = FlaskJSONEncoder
+    report('flask jsonify', lambda: jsonify(payload).get_data())
+    backends = ['json'] + (['orjson'] if orjson is not None else [])
+    for backend in backends:
+      encoder = ResponseEncoder(backend)
+      app.json_encoder = type('JSONEncoder', (JSONEncoder,), {'response_encoder': encoder})
+      report('jsonify ({})'.format(backend), lambda: jsonify(payload).get_data())
+      report('encoder bytes ({})'.format(backend), lambda: encoder.dumps(payload))
+    body = encoder.dumps(payload)
+    report('pre-encoded response', lambda: json_response(body).get_data())
+    app.json_encoder, app.debug = json_encoder, debug
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,57 @@
+'''
+  cost of a counter increment and a histogram observation, in memory and in a
+  METRICS_DIR file, from 1 and 8 threads, and of rendering /metrics with 8 worker files
+    python -m benchmarks.bench_metrics [operations]
+'''
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from app.metrics import Metrics, MmapValues
+
+
+def run(registry, operation, operations, threads):
+  def work():
+    for _ in range(operations // threads):
+      operation(registry)
+  workers = [threading.Thread(target=work) for _ in range(threads)]
+  start = time.perf_counter()
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return (time.perf_counter() - start) / operations * 1e6
+
+
+def main(operations=200000):
+  directory = tempfile.mkdtemp()
+  labels = {'blueprint': 'drink', 'route': '/api/drinks', 'method': 'GET', 'status': 200}
+  operations_by_name = [
+    ('inc', lambda registry: registry.inc('requests_total', labels)),
+    ('observe', lambda registry: registry.observe('seconds', 0.02, labels)),
+  ]
+  try:
+    for mode, registry in (('memory', Metrics()), ('mmap', Metrics(directory))):
+      registry.describe('requests_total', 'counter', 'Requests.')
+      registry.describe('seconds', 'histogram', 'Seconds.')
+      for name, operation in operations_by_name:
+        for threads in (1, 8):
+          print('{:<7} {:<8} {} threads {:6.2f} us'.format(mode, name, threads,
+            run(registry, operation, operations, threads)))
+    # other workers' files, as gunicorn would leave them
+    for pid in range(2 ** 31 - 8, 2 ** 31 - 1):
+      values = MmapValues('{}/metrics_{}.db'.format(directory, pid))
+      for route in range(20):
+        for status in (200, 304, 401, 404):
+          values.add(('requests_total', (('route', str(route)), ('status', str(status)))), 1)
+    start = time.perf_counter()
+    for _ in range(100):
+      registry.render()
+    print('render with 8 files    {:6.2f} ms'.format((time.perf_counter() - start) * 10))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
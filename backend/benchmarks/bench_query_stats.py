@@ -0,0 +1,54 @@
+'''
+  request time of an uncached drink page with query stats off, on, and with
+  SQLALCHEMY_ECHO writing every statement (to /dev/null)
+    python -m benchmarks.bench_query_stats [requests]
+'''
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from app import create_app, db
+from app.drink.models import Drink
+
+app = create_app()
+
+MODES = [
+  ('no instrumentation', {'QUERY_STATS': False, 'SQLALCHEMY_ECHO': False}),
+  ('query stats', {'QUERY_STATS': True, 'SQLALCHEMY_ECHO': False}),
+  ('echo', {'QUERY_STATS': False, 'SQLALCHEMY_ECHO': True}),
+]
+
+
+def main(requests=2000):
+  directory = tempfile.mkdtemp()
+  saved = {key: app.config.get(key) for key in ('SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ECHO', 'QUERY_STATS')}
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  client = app.test_client()
+  try:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      for index, (label, settings) in enumerate(MODES):
+        app.config.update(settings)
+        # a new url makes flask-sqlalchemy build a new engine with the settings
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, '{}.db'.format(index))
+        with app.app_context():
+          db.create_all()
+          for i in range(50):
+            db.session.add(Drink(title='drink {}'.format(i), recipe=[{'name': 'milk', 'parts': i}]))
+          db.session.commit()
+        start = time.perf_counter()
+        for _ in range(requests):
+          client.get('/api/drinks?limit=50')
+        elapsed = time.perf_counter() - start
+        with contextlib.redirect_stdout(sys.__stdout__):
+          print('{:<20} {:7.0f} requests/s'.format(label, requests / elapsed))
+        with app.app_context():
+          db.get_engine().dispose()
+  finally:
+    app.config.update(saved)
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,71 @@
+'''
+  list drinks latency with pickled recipes (old storage) vs json recipes,
+  select every drink, decode the recipe and encode the menu like get_drinks_detail
+    python -m benchmarks.bench_recipe_storage [drinks]
+'''
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import sqlalchemy as sa
+
+
+def make_table(metadata, name, recipe_type):
+  return sa.Table(name, metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('title', sa.String(80), nullable=False, unique=True),
+    sa.Column('recipe', recipe_type, nullable=False))
+
+
+def list_drinks(connection, table):
+  rows = connection.execute(sa.select(table.c.id, table.c.title, table.c.recipe)).fetchall()
+  return json.dumps({
+    'success': True,
+    'drinks': [{'id': row.id, 'title': row.title, 'recipe': row.recipe} for row in rows]
+  })
+
+
+def time_listing(engine, table, runs):
+  timings = []
+  with engine.connect() as connection:
+    for _ in range(runs):
+      start = time.perf_counter()
+      list_drinks(connection, table)
+      timings.append(time.perf_counter() - start)
+  return statistics.median(timings)
+
+
+def main(count=10000, runs=10):
+  handle, path = tempfile.mkstemp(suffix='.db')
+  os.close(handle)
+  engine = sa.create_engine('sqlite:///' + path)
+  metadata = sa.MetaData()
+  pickled = make_table(metadata, 'drinks_pickle', sa.PickleType)
+  as_json = make_table(metadata, 'drinks_json', sa.JSON)
+  metadata.create_all(engine)
+  rows = [{
+    'title': 'drink {}'.format(i),
+    'recipe': [
+      {'name': 'espresso', 'color': '#3b2313', 'parts': 1},
+      {'name': 'milk', 'color': '#f2efe6', 'parts': 3},
+      {'name': 'syrup {}'.format(i % 20), 'color': '#c47c32', 'parts': 1}
+    ]
+  } for i in range(count)]
+  try:
+    with engine.begin() as connection:
+      connection.execute(pickled.insert(), rows)
+      connection.execute(as_json.insert(), rows)
+    before = time_listing(engine, pickled, runs)
+    after = time_listing(engine, as_json, runs)
+  finally:
+    engine.dispose()
+    os.remove(path)
+  print('drinks: {}'.format(count))
+  print('pickled recipes: {:.1f} ms per listing'.format(before * 1000))
+  print('json recipes:    {:.1f} ms per listing'.format(after * 1000))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,96 @@
+'''
+  GET /drinks/search latency in a temporary sqlite database of generated drinks, against
+  a LIKE scan of titles and recipes, the import cost of keeping the index in sync and
+  the time of flask app search-rebuild
+    python -m benchmarks.bench_search [drinks]
+'''
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from app import create_app, db
+from app.drink.bulk import import_drinks
+from app.drink.models import Drink
+from app.drink.search import rebuild
+
+app = create_app()
+
+FLAVOURS = ['vanilla', 'caramel', 'hazelnut', 'mocha', 'cinnamon', 'cardamom', 'honey', 'maple',
+  'pumpkin', 'peppermint', 'lavender', 'coconut', 'almond', 'toffee', 'ginger', 'matcha', 'chai', 'rose']
+STYLES = ['iced', 'hot', 'blended', 'nitro', 'smoked', 'salted', 'spiced', 'double', 'skinny', 'frozen']
+DRINKS = ['latte', 'cappuccino', 'americano', 'macchiato', 'flat white', 'cortado', 'mocha', 'espresso',
+  'cold brew', 'frappe', 'tea', 'affogato']
+INGREDIENTS = ['espresso', 'whole milk', 'oat milk', 'almond milk', 'soy milk', 'cream', 'ice', 'water',
+  'chocolate', 'syrup', 'foam', 'whipped cream', 'sugar', 'cold brew', 'tea leaves'] + FLAVOURS
+QUERIES = ['vanilla oat latte', 'la', 'car mac', 'cardamom', 'm', 'iced choc', 'nothing here']
+
+
+def write_drinks(path, count):
+  rng = random.Random(1)
+  with open(path, 'w') as ndjson:
+    for i in range(count):
+      title = '{} {} {} {}'.format(rng.choice(STYLES), rng.choice(FLAVOURS), rng.choice(DRINKS), i)
+      recipe = [{'name': name, 'color': '#c47c32', 'parts': rng.randint(1, 3)}
+        for name in rng.sample(INGREDIENTS, 3)]
+      ndjson.write(json.dumps({'title': title, 'recipe': recipe}) + '\n')
+
+
+def like_scan(query):
+  # the scan a search without an index would run
+  filters = [db.or_(Drink.title.ilike('%{}%'.format(word)), db.cast(Drink.recipe, db.Text).ilike('%{}%'.format(word)))
+    for word in query.split()]
+  return Drink.query.filter(*filters).order_by(Drink.id).limit(20).all()
+
+
+def timed(func, runs):
+  timings = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    func()
+    timings.append((time.perf_counter() - start) * 1000)
+  timings.sort()
+  return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main(count=100000, runs=50):
+  directory = tempfile.mkdtemp()
+  source = os.path.join(directory, 'drinks.ndjson')
+  write_drinks(source, count)
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app.config['SQLALCHEMY_ECHO'] = False
+  app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+  client = app.test_client()
+  try:
+    with app.app_context():
+      db.create_all()
+      start = time.perf_counter()
+      with open(source, 'rb') as stream:
+        import_drinks(stream)
+      print('drinks: {}, import with the index kept in sync: {:.1f} s'.format(count, time.perf_counter() - start))
+      start = time.perf_counter()
+      rebuild()
+      db.session.commit()
+      print('search-rebuild: {:.1f} s'.format(time.perf_counter() - start))
+      print('{:<20} {:>8} {:>16} {:>16} {:>16}'.format('q', 'matches', 'search p50/p95', 'page 3 p50', 'like scan p50'))
+      for query in QUERIES:
+        matches = len(client.get('/api/drinks/search', query_string={'q': query, 'limit': 500}).json['drinks'])
+        search = timed(lambda: client.get('/api/drinks/search', query_string={'q': query}), runs)
+        page = timed(lambda: client.get('/api/drinks/search', query_string={'q': query, 'offset': 40}), runs)
+        scan = timed(lambda: like_scan(query), max(runs // 10, 3))
+        print('{:<20} {:>8} {:>9.1f}/{:.1f} ms {:>13.1f} ms {:>13.1f} ms'.format(query,
+          '500+' if matches == 500 else matches, search[0], search[1], page[0], scan[0]))
+      db.session.remove()
+      db.get_engine().dispose()
+  finally:
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    for name in os.listdir(directory):
+      os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,6 @@
+'''
+  load test of every drink and user route over http, against a seeded temporary
+  sqlite database and a local Auth0 stand in, results as json
+    python -m benchmarks.loadtest --scale 1000 --clients 8 --requests 500 --output before.json
+    python -m benchmarks.loadtest --compare before.json --output after.json
+'''
@@ -0,0 +1,122 @@
+'''
+  python -m benchmarks.loadtest [--scale 1000] [--clients 8] [--requests 500] [--routes GET /api/drinks,...]
+    [--auth0-latency 0] [--server werkzeug] [--threads 64] [--output results.json] [--compare baseline.json]
+    [--max-regression 0.2]
+'''
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+      check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(baseline, results, max_regression):
+  '''
+    prints the change of rps and p95 per route, returns the routes whose p95
+    got more than max_regression (a fraction) slower
+  '''
+  regressions = []
+  print('{:<36} {:>10} {:>10} {:>9} {:>9}'.format('route', 'rps', 'change', 'p95 ms', 'change'), file=sys.stderr)
+  for name, result in results['routes'].items():
+    before = baseline['routes'].get(name)
+    if before is None or not before['p95_ms'] or not before['rps']:
+      continue
+    p95_change = result['p95_ms'] / before['p95_ms'] - 1
+    print('{:<36} {:>10} {:>+9.0%} {:>9} {:>+8.0%}'.format(name, result['rps'],
+      result['rps'] / before['rps'] - 1, result['p95_ms'], p95_change), file=sys.stderr)
+    if p95_change > max_regression:
+      regressions.append(name)
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+    description='load test of the drink and user routes, results as json')
+  parser.add_argument('--scale', type=int, default=1000, help='drinks seeded')
+  parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+  parser.add_argument('--requests', type=int, default=500, help='timed requests per route')
+  parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route sent first')
+  parser.add_argument('--routes', help='comma separated scenario names, e.g. "GET /api/drinks", all by default')
+  parser.add_argument('--auth0-latency', type=float, default=0, help='seconds every fake Auth0 call takes')
+  parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'uvicorn'), default='werkzeug',
+    help='werkzeug in this process, a gunicorn gthread worker (sync mode) or uvicorn (async serving mode)')
+  parser.add_argument('--threads', type=int, default=64,
+    help='threads of the gunicorn worker, or for the sync routes under uvicorn')
+  parser.add_argument('--output', help='json file, stdout by default')
+  parser.add_argument('--compare', help='json results of an earlier run')
+  parser.add_argument('--max-regression', type=float, default=0.2,
+    help='exit with 1 when a p95 is this much slower than in --compare')
+  args = parser.parse_args(argv)
+  # the app prints on errors, that would end up in the json on stdout
+  devnull = open(os.devnull, 'w')
+  with contextlib.redirect_stdout(devnull):
+    from app import create_app
+    from .environment import LoadTestEnvironment
+    from .runner import ScenarioRun
+    from .scenarios import SCENARIOS, SKIPPED, uncovered_routes
+
+  scenarios = SCENARIOS
+  if args.routes:
+    names = [name.strip() for name in args.routes.split(',')]
+    unknown = set(names) - {scenario.name for scenario in SCENARIOS}
+    if unknown:
+      parser.error('unknown routes: {}'.format(', '.join(sorted(unknown))))
+    scenarios = [scenario for scenario in SCENARIOS if scenario.name in names]
+  app = create_app()
+  for name in uncovered_routes(app):
+    print('no scenario for {}'.format(name), file=sys.stderr)
+
+  results = {
+    'meta': {
+      'commit': git_commit(),
+      'started': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'cpus': os.cpu_count(),
+      'scale': args.scale,
+      'clients': args.clients,
+      'requests': args.requests,
+      'warmup': args.warmup,
+      'auth0_latency': args.auth0_latency,
+      'server': args.server,
+      'threads': args.threads,
+      'skipped': SKIPPED,
+    },
+    'routes': {},
+  }
+  with devnull, contextlib.redirect_stdout(devnull), \
+      LoadTestEnvironment(app, args.scale, args.auth0_latency, args.server, args.threads) as environment:
+    for scenario in scenarios:
+      result = ScenarioRun(environment, scenario, args.requests, args.clients, args.warmup).run()
+      results['routes'][scenario.name] = result
+      print('{:<36} {:>7} rps  p50 {:>8} ms  p95 {:>8} ms  p99 {:>8} ms  errors {}'.format(scenario.name,
+        result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['errors']), file=sys.stderr)
+
+  encoded = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, 'w') as output:
+      output.write(encoded + '\n')
+  else:
+    print(encoded)
+  if args.compare:
+    with open(args.compare) as source:
+      regressions = compare(json.load(source), results, args.max_regression)
+    if regressions:
+      print('p95 regressions over {:.0%}: {}'.format(args.max_regression, ', '.join(regressions)), file=sys.stderr)
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,183 @@
+'''
+  the app served on a local port with a seeded database, tokens from a local key,
+  and the jwks and management api served by the fake Auth0 server
+'''
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import auth, db
+from app.auth.testing import FakeAuth0Server, LocalSigningKey
+from app.drink.bulk import import_drinks
+from app.drink.models import Drink
+from app.user.controllers import role_cache
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+  # clients reuse their connection like they would behind a real server
+  protocol_version = 'HTTP/1.1'
+
+  def log_request(self, *args, **kwargs):
+    pass
+
+
+def seed_rows(scale):
+  for index in range(scale):
+    yield json.dumps({'title': 'load test drink {}'.format(index),
+      'recipe': [{'name': 'milk', 'color': 'white', 'parts': index % 5 + 1},
+        {'name': 'coffee', 'color': 'brown', 'parts': 1}]}).encode('utf-8') + b'\n'
+
+
+def serve_gunicorn(app, host, port, threads):
+  '''
+    the sync mode as deployed with gunicorn.conf.py, one gthread worker
+  '''
+  from gunicorn.app.base import BaseApplication
+
+  class Server(BaseApplication):
+    def load_config(self):
+      for name, value in (('bind', '{}:{}'.format(host, port)), ('workers', 1), ('worker_class', 'gthread'),
+          ('threads', threads), ('backlog', 2048), ('loglevel', 'warning')):
+        self.cfg.set(name, value)
+
+    def load(self):
+      return app
+  Server().run()
+
+
+def serve_uvicorn(app, host, port, threads):
+  '''
+    the async serving mode (app.asgi), one uvicorn worker
+  '''
+  import uvicorn
+  from app.asgi import AsgiApp
+  uvicorn.run(AsgiApp(app, threads=threads), host=host, port=port, log_level='warning')
+
+
+# servers run in a forked process, which starts with the app and Auth0 settings of this one
+SERVERS = {'gunicorn': serve_gunicorn, 'uvicorn': serve_uvicorn}
+
+
+def free_port(host):
+  with socket.socket() as probe:
+    probe.bind((host, 0))
+    return probe.getsockname()[1]
+
+
+def wait_for(host, port, process, timeout=30):
+  deadline = time.monotonic() + timeout
+  while True:
+    try:
+      socket.create_connection((host, port), timeout=1).close()
+      return
+    except OSError:
+      if time.monotonic() > deadline or not process.is_alive():
+        raise
+      time.sleep(0.1)
+
+
+class LoadTestEnvironment:
+  '''
+    LoadTestEnvironment
+    context manager, sets everything up on enter and puts the app back on exit
+    Args:
+      app (Flask): app from create_app, served with its own temporary database
+      scale (int): drinks seeded
+      auth0_latency (float): seconds every fake Auth0 call sleeps
+      server (str): werkzeug (threaded, in this process), gunicorn (a gthread worker, the sync mode)
+        or uvicorn (the async serving mode)
+      threads (int): threads of the gunicorn worker, or for the sync routes under uvicorn
+  '''
+  def __init__(self, app, scale=1000, auth0_latency=0, server='werkzeug', threads=64):
+    self.app = app
+    self.scale = scale
+    self.auth0_latency = auth0_latency
+    self.server_name = server
+    self.threads = threads
+    self.key = LocalSigningKey()
+    self.tokens = {}
+
+  def token(self, permissions):
+    '''
+      bearer token with permissions, one per set so repeat requests hit the token cache
+    '''
+    permissions = tuple(sorted(permissions))
+    if permissions not in self.tokens:
+      self.tokens[permissions] = self.key.mint(auth.AUTH0_DOMAIN, auth.API_AUDIENCE, list(permissions))
+    return self.tokens[permissions]
+
+  def url(self, path):
+    return 'http://{}:{}{}'.format(self.host, self.port, path)
+
+  def create_drinks(self, count, prefix):
+    '''
+      drinks for the routes that use them up, returns their ids
+    '''
+    with self.app.app_context():
+      drinks = [Drink(title='{} {}'.format(prefix, index), recipe=[{'name': 'water', 'parts': 1}])
+        for index in range(count)]
+      db.session.add_all(drinks)
+      db.session.commit()
+      return [drink.id for drink in drinks]
+
+  def __enter__(self):
+    self.directory = tempfile.mkdtemp()
+    self.saved_uri = self.app.config['SQLALCHEMY_DATABASE_URI']
+    # a new url makes flask-sqlalchemy build a new engine
+    self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.directory, 'loadtest.db')
+    with self.app.app_context():
+      db.create_all()
+      report = import_drinks(io.BytesIO(b''.join(seed_rows(self.scale))))
+      assert report.inserted == self.scale, report.format()
+      self.drink_ids = [row.id for row in db.session.query(Drink.id)]
+    # tokens are checked against the fake server's key set, fetched over http
+    self.auth0 = FakeAuth0Server(latency=self.auth0_latency, jwks=self.key.jwks()).start()
+    provider = auth.auth_management
+    self.saved_auth = (auth.jwks_store.url, provider.domain, provider.protocol)
+    auth.jwks_store.url = 'http://{}/.well-known/jwks.json'.format(self.auth0.domain)
+    auth.jwks_store.clear()
+    auth.token_cache.clear()
+    role_cache.clear()
+    provider.domain, provider.protocol = self.auth0.domain, 'http'
+    provider.reset()
+    self.server = self.process = None
+    if self.server_name == 'werkzeug':
+      self.server = make_server('127.0.0.1', 0, self.app, threaded=True, request_handler=KeepAliveRequestHandler)
+      threading.Thread(target=self.server.serve_forever, daemon=True).start()
+      self.host, self.port = self.server.host, self.server.port
+    else:
+      self.host = '127.0.0.1'
+      self.port = free_port(self.host)
+      # the child opens its own database connections
+      with self.app.app_context():
+        db.get_engine().dispose()
+      self.process = multiprocessing.get_context('fork').Process(target=SERVERS[self.server_name],
+        args=(self.app, self.host, self.port, self.threads))
+      self.process.start()
+      wait_for(self.host, self.port, self.process)
+    return self
+
+  def __exit__(self, *exc_info):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+    else:
+      self.process.terminate()
+      self.process.join(30)
+    self.auth0.stop()
+    provider = auth.auth_management
+    auth.jwks_store.url, provider.domain, provider.protocol = self.saved_auth
+    auth.jwks_store.clear()
+    auth.token_cache.clear()
+    role_cache.clear()
+    provider.reset()
+    with self.app.app_context():
+      db.get_engine().dispose()
+    self.app.config['SQLALCHEMY_DATABASE_URI'] = self.saved_uri
+    shutil.rmtree(self.directory)
@@ -0,0 +1,115 @@
+'''
+  drives a scenario with concurrent clients and sums up its latencies
+'''
+import math
+import threading
+import time
+from collections import Counter
+import requests
+
+
+def percentile(ordered, percent):
+  '''
+    nearest rank percentile of sorted values
+  '''
+  if not ordered:
+    return None
+  return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(scenario, latencies, statuses, elapsed):
+  ordered = sorted(latencies)
+  errors = sum(count for status, count in statuses.items() if status not in scenario.expect)
+  milliseconds = lambda value: None if value is None else round(value * 1000, 3)
+  return {
+    'requests': len(ordered),
+    'errors': errors,
+    'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    'rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+    'mean_ms': milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+    'p50_ms': milliseconds(percentile(ordered, 50)),
+    'p95_ms': milliseconds(percentile(ordered, 95)),
+    'p99_ms': milliseconds(percentile(ordered, 99)),
+    'max_ms': milliseconds(ordered[-1]) if ordered else None,
+  }
+
+
+class ScenarioRun:
+  '''
+    ScenarioRun
+    count requests of a scenario spread over clients threads, each with its own
+    keep alive session, the first warmup requests aren't timed
+    Args:
+      environment (LoadTestEnvironment): the served app
+      scenario (Scenario): what to request
+      count (int): timed requests
+      clients (int): concurrent clients
+      warmup (int): untimed requests sent first
+  '''
+  def __init__(self, environment, scenario, count, clients, warmup=0):
+    self.environment = environment
+    self.scenario = scenario
+    self.count = count
+    self.clients = clients
+    self.warmup = warmup
+    self.headers = {}
+    if scenario.permissions is not None:
+      self.headers['Authorization'] = 'Bearer ' + environment.token(scenario.permissions)
+    self._next = 0
+    self._lock = threading.Lock()
+
+  def send(self, session, state, index):
+    scenario = self.scenario
+    options = scenario.body(state, index)
+    headers = dict(self.headers, **options.pop('headers', {}))
+    started = time.perf_counter()
+    try:
+      response = session.request(scenario.method, self.environment.url(scenario.path(state, index)),
+        headers=headers, timeout=60, **options)
+      # streamed bodies, e.g. the export, are read to the end
+      response.content
+      status = response.status_code
+    except requests.RequestException as e:
+      status = type(e).__name__
+    return time.perf_counter() - started, status
+
+  def take(self, stop):
+    with self._lock:
+      if self._next >= stop:
+        return None
+      self._next += 1
+      return self._next - 1
+
+  def client(self, state, stop, results):
+    # per client results, merged after the threads are joined
+    latencies = []
+    statuses = Counter()
+    with requests.Session() as session:
+      while True:
+        index = self.take(stop)
+        if index is None:
+          break
+        seconds, status = self.send(session, state, index)
+        latencies.append(seconds)
+        statuses[status] += 1
+    results.append((latencies, statuses))
+
+  def phase(self, state, stop):
+    results = []
+    threads = [threading.Thread(target=self.client, args=(state, stop, results))
+      for _ in range(self.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = [seconds for client_latencies, _ in results for seconds in client_latencies]
+    statuses = sum((client_statuses for _, client_statuses in results), Counter())
+    return latencies, statuses, elapsed
+
+  def run(self):
+    state = self.scenario.prepare(self.environment, self.warmup + self.count)
+    if self.warmup:
+      self.phase(state, self.warmup)
+    return summarize(self.scenario, *self.phase(state, self.warmup + self.count))
@@ -0,0 +1,119 @@
+'''
+  one scenario per route and method of drink_bp and user_bp, named like the
+  route label of /metrics, e.g. PATCH /api/drinks/<int:id>
+'''
+import json
+import uuid
+
+# user ids the role routes are called with
+USERS = 100
+BULK_USERS = 10
+BULK_DRINKS = 50
+# long lived stream, timed by benchmarks.bench_events instead
+SKIPPED = {'GET /api/drinks/events': 'event stream, see benchmarks.bench_events'}
+
+
+class Scenario:
+  '''
+    Scenario
+    Args:
+      method (str): http method
+      rule (str): url rule, as in app.url_map
+      path (callable): (state, index) -> path, defaults to the rule
+      permissions (list): permissions of the token sent, None for no token
+      body (callable): (state, index) -> requests keyword arguments, e.g. json
+      expect (tuple): status codes that count as a success
+      prepare (callable): (environment, count) -> state, e.g. rows used up by the run
+  '''
+  def __init__(self, method, rule, path=None, permissions=None, body=None, expect=(200,), prepare=None):
+    self.method = method
+    self.rule = rule
+    self.path = path or (lambda state, index: rule)
+    self.permissions = permissions
+    self.body = body or (lambda state, index: {})
+    self.expect = expect
+    self.prepare = prepare or (lambda environment, count: environment)
+
+  @property
+  def name(self):
+    return '{} {}'.format(self.method, self.rule)
+
+
+def user_id(index):
+  return 'auth0|load-{}'.format(index % USERS)
+
+
+def bulk_users(state, index):
+  return {'json': {'user_ids': [user_id(index * BULK_USERS + offset) for offset in range(BULK_USERS)]}}
+
+
+def bulk_drinks(state, index):
+  # seeded titles, so the upsert updates the same rows every run
+  start = index * BULK_DRINKS % max(state.scale - BULK_DRINKS, 1)
+  rows = [json.dumps({'title': 'load test drink {}'.format(start + offset),
+    'recipe': [{'name': 'milk', 'color': 'white', 'parts': index % 5 + 1}]}) for offset in range(BULK_DRINKS)]
+  return {'data': '\n'.join(rows), 'headers': {'Content-Type': 'application/x-ndjson'}}
+
+
+def new_drink(state, index):
+  return {'json': {'title': 'load test new {} {}'.format(state['run'], index),
+    'recipe': [{'name': 'water', 'color': 'blue', 'parts': 1}]}}
+
+
+def drink_path(state, index):
+  return '/api/drinks/{}'.format(state.drink_ids[index % len(state.drink_ids)])
+
+
+SCENARIOS = [
+  Scenario('GET', '/api/drink/test'),
+  Scenario('GET', '/api/drinks'),
+  Scenario('GET', '/api/drinks/changes'),
+  # a word of the seeded titles, a page of one ingredient and a prefix
+  Scenario('GET', '/api/drinks/search',
+    path=lambda state, index: '/api/drinks/search?q=' + ('load dri', 'milk&offset=20', 'te')[index % 3]),
+  Scenario('GET', '/api/drinks-detail', permissions=['get:drinks-detail']),
+  Scenario('GET', '/api/drinks/export', permissions=['get:drinks-detail']),
+  Scenario('POST', '/api/drinks', permissions=['post:drinks'], body=new_drink, expect=(201,),
+    prepare=lambda environment, count: {'run': uuid.uuid4().hex[:8]}),
+  Scenario('POST', '/api/drinks/bulk', permissions=['post:drinks'], body=bulk_drinks),
+  Scenario('PATCH', '/api/drinks/<int:id>', path=drink_path, permissions=['patch:drinks'],
+    body=lambda state, index: {'json': {'recipe': [{'name': 'milk', 'color': 'white', 'parts': index % 5 + 1}]}}),
+  # each request deletes a drink made for it
+  Scenario('DELETE', '/api/drinks/<int:id>', permissions=['delete:drinks'],
+    path=lambda ids, index: '/api/drinks/{}'.format(ids[index]),
+    prepare=lambda environment, count: environment.create_drinks(count, 'load test delete {}'.format(uuid.uuid4().hex[:8]))),
+  Scenario('GET', '/api/users/test'),
+  Scenario('POST', '/api/baristas/edit', permissions=['post:baristas'],
+    body=lambda state, index: {'json': {'user_id': user_id(index)}}, expect=(201,)),
+  Scenario('DELETE', '/api/baristas/edit', permissions=['post:baristas'],
+    body=lambda state, index: {'json': {'user_id': user_id(index)}}, expect=(201,)),
+  Scenario('POST', '/api/managers/edit', permissions=['post:managers'],
+    body=lambda state, index: {'json': {'user_id': user_id(index)}}, expect=(201,)),
+  Scenario('DELETE', '/api/managers/edit', permissions=['post:managers'],
+    body=lambda state, index: {'json': {'user_id': user_id(index)}}, expect=(201,)),
+  Scenario('POST', '/api/baristas/edit/bulk', permissions=['post:baristas'], body=bulk_users),
+  Scenario('DELETE', '/api/baristas/edit/bulk', permissions=['post:baristas'], body=bulk_users),
+  Scenario('POST', '/api/managers/edit/bulk', permissions=['post:managers'], body=bulk_users),
+  Scenario('DELETE', '/api/managers/edit/bulk', permissions=['post:managers'], body=bulk_users),
+  Scenario('PATCH', '/api/baristas/<barista_id>', permissions=['update:baristas'],
+    path=lambda state, index: '/api/baristas/{}'.format(user_id(index)),
+    body=lambda state, index: {'json': {'user_id': user_id(index), 'username': 'load{}'.format(index)}},
+    expect=(201,)),
+  # jobs only exist with MANAGEMENT_ASYNC, this times the lookup of an unknown one
+  Scenario('GET', '/api/jobs/<job_id>', permissions=['update:baristas'],
+    path=lambda state, index: '/api/jobs/{}'.format(uuid.uuid4().hex), expect=(404,)),
+]
+
+
+def uncovered_routes(app, scenarios=SCENARIOS):
+  '''
+    drink and user routes without a scenario, so a new route isn't silently left out
+  '''
+  covered = {scenario.name for scenario in scenarios} | set(SKIPPED)
+  routes = set()
+  for rule in app.url_map.iter_rules():
+    if rule.endpoint.split('.')[0] not in ('drink', 'user'):
+      continue
+    for method in rule.methods - {'HEAD', 'OPTIONS'}:
+      routes.add('{} {}'.format(method, rule.rule))
+  return sorted(routes - covered)
@@ -14,12 +14,54 @@ DB_PATH = os.path.join(BASE_DIR, 'coffee_shop_tests.db')
 # Define the database - we are working with
 # SQLLITE_DB for sql lite, DB_URI for postgres
 SQLALCHEMY_DATABASE_URI = f'sqlite:///{DB_PATH}'
-# print queries if debug
-SQLALCHEMY_ECHO = True if DEBUG else False
+# print every query, slow for real traffic, the query stats below are meant for production
+SQLALCHEMY_ECHO = os.environ.get("SQLALCHEMY_ECHO", "").lower() in ("1", "true", "yes")
 # over head
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-DATABASE_CONNECT_OPTIONS = {}
+# per request query counts and time, Server-Timing headers and a log of slow and repeated queries
+QUERY_STATS = os.environ.get("QUERY_STATS", "true").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+# the same statement this many times in one request is logged as a possible n+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 10))
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+# sampled request profiles, off unless PROFILE_DIR is set, reports with flask app profiles
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# comma separated endpoint names to sample, e.g. drink.get_drinks_detail, all when empty
+PROFILE_ENDPOINTS = tuple(name for name in os.environ.get("PROFILE_ENDPOINTS", "").split(",") if name)
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 500))
+# key of the signed X-Profile header that profiles a single request, see flask app profile-token
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET")
+
+# engine pool, sqlite file dbs are pooled too, recycle and pre ping only apply to servers
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# sqlite pragmas run on every new connection, WAL lets reads run next to a write
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+# ms a write waits for the lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+# read replica for the drink listings and export, reads use the primary when unset
+REPLICA_DATABASE_URL = os.environ.get("REPLICA_DATABASE_URL")
+SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+# seconds a client reads from the primary after it wrote, so it sees its own changes
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+# json encoder of responses: orjson, json (stdlib) or auto, orjson when installed
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+
+# queue management api changes on background workers and answer 202 with a job id
+MANAGEMENT_ASYNC = os.environ.get("MANAGEMENT_ASYNC", "").lower() in ("1", "true", "yes")
+# how the bulk role routes call the management api: threads (a pool thread per call) or asyncio (coroutines on one event loop)
+MANAGEMENT_CLIENT = os.environ.get("MANAGEMENT_CLIENT", "threads")
 
 # Application threads. A common general assumption is
 # using 2 per available processor cores - to handle
@@ -0,0 +1,16 @@
+'''
+  gunicorn settings, read from the working directory by
+    gunicorn 'app:create_app()'
+  gthread workers, so an open event stream holds one thread of a worker instead of the
+  whole worker, and at most SSE_MAX_CLIENTS of them do, the rest are left for other requests
+'''
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+# threads per worker, event streams wait on a queue, so many of them are cheap
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+# threads of a worker never given to event streams
+REQUEST_THREADS = int(os.environ.get('GUNICORN_REQUEST_THREADS', 8))
+os.environ.setdefault('SSE_MAX_CLIENTS', str(max(threads - REQUEST_THREADS, 1)))
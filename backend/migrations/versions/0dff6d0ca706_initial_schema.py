@@ -0,0 +1,46 @@
+"""initial schema
+
+Revision ID: 0dff6d0ca706
+Revises: 
+Create Date: 2026-10-18 11:28:03.651380
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0dff6d0ca706'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # schema as created by db.create_all() before migrations were added,
+    # existing databases: flask db stamp 0dff6d0ca706
+    op.create_table(
+        'drinks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('date_modified', sa.DateTime(), nullable=True),
+        sa.Column('title', sa.String(length=80), nullable=False),
+        sa.Column('recipe', sa.PickleType(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('title')
+    )
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('date_modified', sa.DateTime(), nullable=True),
+        sa.Column('name', sa.String(length=128), nullable=False),
+        sa.Column('email', sa.String(length=128), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+    )
+
+
+def downgrade():
+    op.drop_table('users')
+    op.drop_table('drinks')
@@ -0,0 +1,44 @@
+"""jobs
+
+Revision ID: a5d3e8c47f12
+Revises: f3b81d6c2a95
+Create Date: 2026-10-18 21:14:05.530982
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d3e8c47f12'
+down_revision = 'f3b81d6c2a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # queued management api calls, shared by the worker processes
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.String(length=32), nullable=False),
+        sa.Column('kind', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('key', sa.String(length=512), nullable=False),
+        sa.Column('shard', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('coalesced', sa.Integer(), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=False),
+        sa.Column('date_started', sa.DateTime(), nullable=True),
+        sa.Column('date_finished', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('job_id'),
+        sqlite_autoincrement=True
+    )
+    op.create_index('ix_jobs_status_shard', 'jobs', ['status', 'shard'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_status_shard', table_name='jobs')
+    op.drop_table('jobs')
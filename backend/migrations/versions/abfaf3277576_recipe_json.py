@@ -0,0 +1,75 @@
+"""recipe json
+
+Revision ID: abfaf3277576
+Revises: 0dff6d0ca706
+Create Date: 2026-10-18 11:28:10.360967
+
+"""
+import pickle
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'abfaf3277576'
+down_revision = '0dff6d0ca706'
+branch_labels = None
+depends_on = None
+
+
+# rows converted per round trip
+BATCH_SIZE = 1000
+RECIPE_TYPE = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def convert(source, source_type, target, target_type, transform):
+    """copies drinks.source into drinks.target in id ordered batches"""
+    connection = op.get_bind()
+    drinks = sa.table(
+        'drinks',
+        sa.column('id', sa.Integer),
+        sa.column(source, source_type),
+        sa.column(target, target_type)
+    )
+    update = drinks.update() \
+        .where(drinks.c.id == sa.bindparam('drink_id')) \
+        .values({target: sa.bindparam('value')})
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(drinks.c.id, drinks.c[source])
+            .where(drinks.c.id > last_id)
+            .order_by(drinks.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            {'drink_id': row[0], 'value': transform(row[1])} for row in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('drinks') as batch_op:
+        batch_op.add_column(sa.Column('recipe_json', RECIPE_TYPE, nullable=True))
+    # pickled bytes -> json
+    convert('recipe', sa.LargeBinary(), 'recipe_json', RECIPE_TYPE,
+            lambda value: pickle.loads(value) if value is not None else [])
+    with op.batch_alter_table('drinks') as batch_op:
+        batch_op.drop_column('recipe')
+        batch_op.alter_column('recipe_json', new_column_name='recipe',
+                              existing_type=RECIPE_TYPE, nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('drinks') as batch_op:
+        # PickleType is stored as plain binary
+        batch_op.add_column(sa.Column('recipe_pickle', sa.LargeBinary(), nullable=True))
+    convert('recipe', RECIPE_TYPE, 'recipe_pickle', sa.LargeBinary(),
+            lambda value: pickle.dumps(value if value is not None else []))
+    with op.batch_alter_table('drinks') as batch_op:
+        batch_op.drop_column('recipe')
+        batch_op.alter_column('recipe_pickle', new_column_name='recipe',
+                              nullable=False)
@@ -0,0 +1,35 @@
+"""drink changes
+
+Revision ID: b72d962b5d26
+Revises: abfaf3277576
+Create Date: 2026-10-18 14:05:41.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b72d962b5d26'
+down_revision = 'abfaf3277576'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # delta sync: changed drinks by date_modified, deleted ones from tombstones
+    op.create_index('ix_drinks_date_modified', 'drinks', ['date_modified'])
+    op.create_table(
+        'drink_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('drink_id', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_drink_tombstones_deleted_at', 'drink_tombstones', ['deleted_at'])
+
+
+def downgrade():
+    op.drop_index('ix_drink_tombstones_deleted_at', table_name='drink_tombstones')
+    op.drop_table('drink_tombstones')
+    op.drop_index('ix_drinks_date_modified', table_name='drinks')
@@ -0,0 +1,33 @@
+"""menu events
+
+Revision ID: c41e0a9d7f3b
+Revises: b72d962b5d26
+Create Date: 2026-10-18 15:12:09.804117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e0a9d7f3b'
+down_revision = 'b72d962b5d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # drink changes pushed to /drinks/events subscribers by every worker
+    op.create_table(
+        'menu_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('data', sa.JSON(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True
+    )
+
+
+def downgrade():
+    op.drop_table('menu_events')
@@ -0,0 +1,52 @@
+"""drink search
+
+Revision ID: e7a2c95d1b40
+Revises: c41e0a9d7f3b
+Create Date: 2026-10-18 17:40:22.531907
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c95d1b40'
+down_revision = 'c41e0a9d7f3b'
+branch_labels = None
+depends_on = None
+
+
+# the schema of app/drink/search.py at this revision
+SQLITE_INGREDIENTS = """(SELECT group_concat(value, ' ') FROM json_tree({row}.recipe)
+  WHERE key = 'name' AND type = 'text')"""
+SQLITE_SYNC = """
+  INSERT INTO drinks_search (rowid, title, ingredients)
+  VALUES (new.id, new.title, {});""".format(SQLITE_INGREDIENTS.format(row='new'))
+POSTGRES_VECTOR = """(setweight(to_tsvector('simple', title), 'A') ||
+  setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(recipe, '$[*].name')::text, '')), 'B'))"""
+
+
+def upgrade():
+    # GET /drinks/search, fts5 kept in sync by triggers on sqlite, a gin index on postgres
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX ix_drinks_search ON drinks USING gin ({})'.format(POSTGRES_VECTOR))
+        return
+    op.execute("""CREATE VIRTUAL TABLE drinks_search USING fts5(title, ingredients,
+  tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')""")
+    op.execute('CREATE TRIGGER drinks_search_insert AFTER INSERT ON drinks BEGIN' + SQLITE_SYNC + '\nEND')
+    op.execute("""CREATE TRIGGER drinks_search_update AFTER UPDATE OF title, recipe ON drinks BEGIN
+  DELETE FROM drinks_search WHERE rowid = old.id;""" + SQLITE_SYNC + '\nEND')
+    op.execute("""CREATE TRIGGER drinks_search_delete AFTER DELETE ON drinks BEGIN
+  DELETE FROM drinks_search WHERE rowid = old.id;
+END""")
+    # index the drinks already there
+    op.execute('INSERT INTO drinks_search (rowid, title, ingredients) SELECT id, title, {} FROM drinks'
+               .format(SQLITE_INGREDIENTS.format(row='drinks')))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_drinks_search')
+        return
+    for trigger in ('drinks_search_insert', 'drinks_search_update', 'drinks_search_delete'):
+        op.execute('DROP TRIGGER {}'.format(trigger))
+    op.execute('DROP TABLE drinks_search')
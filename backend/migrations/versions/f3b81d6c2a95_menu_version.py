@@ -0,0 +1,33 @@
+"""menu version
+
+Revision ID: f3b81d6c2a95
+Revises: e7a2c95d1b40
+Create Date: 2026-10-18 19:02:47.118264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b81d6c2a95'
+down_revision = 'e7a2c95d1b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # counter bumped by every drink change for the menu cache, databases upgraded
+    # while the initial revision still created it already have it
+    if sa.inspect(op.get_bind()).has_table('menu_version'):
+        return
+    op.create_table(
+        'menu_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('menu_version')
@@ -1,19 +1,83 @@
 '''
-  handler to start tests
+  handler to start tests, the test case classes are spread over worker processes,
+  each with its own app and database
+    python run_tests.py [--workers 4] [-q] [DrinkTestCase DrinkTestCase.test_get_drinks ...]
+  --workers 1 runs everything in this process
 '''
-import sys, unittest
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# add args to sys.path
-sys.argv.append('--testApp')
+# import test cases
+from app.auth.tests import JWKSTestCase, TokenCacheTestCase, VerifyTokenTestCase, \
+  ManagementProviderTestCase, AsyncClientTestCase
+from app.user.tests import UserTestCase, UserRolesTestCase, JobQueueTestCase, UserAsgiTestCase
+from app.drink.tests import DrinkTestCase, DrinkEventsTestCase, DrinkBulkTestCase, DrinkSearchTestCase, \
+  DrinkAsgiTestCase
+from app.tests import EncodingTestCase, CompressionTestCase, DatabaseTestCase, QueryStatsTestCase, \
+  MetricsTestCase, ProfilingTestCase, ReplicaTestCase, AppFactoryTestCase, GunicornTestCase, AsgiTestCase, \
+  UvicornTestCase
+from app.testing import run_names, shard
 
-# import app
-from app import *
+CASES = [JWKSTestCase, TokenCacheTestCase, VerifyTokenTestCase, ManagementProviderTestCase, AsyncClientTestCase,
+  UserTestCase, UserRolesTestCase, JobQueueTestCase, DrinkTestCase, DrinkEventsTestCase, EncodingTestCase,
+  CompressionTestCase, DatabaseTestCase, QueryStatsTestCase, MetricsTestCase, ProfilingTestCase,
+  ReplicaTestCase, DrinkBulkTestCase, DrinkSearchTestCase, AppFactoryTestCase, GunicornTestCase, DrinkAsgiTestCase,
+  UserAsgiTestCase, AsgiTestCase, UvicornTestCase]
+
+
+def selected_names(cases, tests):
+  '''
+    dotted names of the classes or single tests asked for, e.g. DrinkTestCase.test_get_drinks
+  '''
+  by_name = {case.__name__: case for case in cases}
+  names = []
+  for test in tests:
+    case = by_name.get(test.split('.')[0])
+    if case is None:
+      raise SystemExit('unknown test case: {}'.format(test))
+    names.append('{}.{}'.format(case.__module__, test))
+  return names
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python run_tests.py')
+  parser.add_argument('tests', nargs='*', help='test cases or Case.test_name, all by default')
+  parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+  parser.add_argument('-q', '--quiet', action='store_const', const=1, default=2, dest='verbosity')
+  args = parser.parse_args(argv)
+
+  if args.tests:
+    shards = [[name] for name in selected_names(CASES, args.tests)]
+  else:
+    shards = shard(CASES, args.workers)
+  if args.workers <= 1 or len(shards) <= 1:
+    result = run_names([name for names in shards for name in names], args.verbosity)
+    sys.stderr.write(result['output'])
+    return 0 if result['success'] else 1
+
+  started = time.perf_counter()
+  results = []
+  # spawned, not forked, so every worker imports app.testing and makes its own database
+  context = multiprocessing.get_context('spawn')
+  with ProcessPoolExecutor(max_workers=min(args.workers, len(shards)), mp_context=context) as pool:
+    futures = [pool.submit(run_names, names, args.verbosity) for names in shards]
+    for future in as_completed(futures):
+      result = future.result()
+      sys.stderr.write(result['output'])
+      results.append(result)
+  total = {key: sum(result[key] for result in results) for key in ('run', 'failures', 'errors', 'skipped')}
+  sys.stderr.write('\n{}\nRan {} tests in {:.3f}s on {} workers\n\n'.format('=' * 70, total['run'],
+    time.perf_counter() - started, len(results)))
+  if all(result['success'] for result in results):
+    sys.stderr.write('OK{}\n'.format(' (skipped={})'.format(total['skipped']) if total['skipped'] else ''))
+    return 0
+  sys.stderr.write('FAILED (failures={}, errors={})\n'.format(total['failures'], total['errors']))
+  return 1
 
-# import test cases
-from app.user.tests import UserTestCase
-from app.drink.tests import DrinkTestCase
 
 if __name__ == '__main__':
-  sys.argv.remove('--testApp')
-  unittest.main(verbosity=2)
-  pass
\ No newline at end of file
+  sys.exit(main())